@@ -0,0 +1,154 @@
+"""Benchmark the build pipeline on a synthetic project.
+
+Cases:
+    list_files              walk the source dir
+    full_build_cold         full build with an empty compile cache
+    full_build_warm         full build with a filled compile cache
+    noop_rebuild            incremental build without any change
+    unchanged_full_build    full build without any change, the output is kept by the fingerprint
+    single_change_rebuild   incremental build after changing one module
+    variant_single_cold     one of the variants below alone, with an empty compile cache
+    variants_sequential_cold
+                            three variants (other mpy-cross params, the base config, other target dir) built one by one
+    variants_batch_cold     the same variants built by `build_variants`, sharing the walk and the compile pass
+
+Usage:
+    python benchmarks/bench_build.py [--modules N] [--repeat N] [--output result.json] [--compare old.json]
+"""
+import sys
+import json
+import os
+import platform
+import subprocess
+from argparse import ArgumentParser
+from pathlib import Path
+from shutil import rmtree
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from gba_mpy_tools.config import Config
+import gba_mpy_tools.action as m_action
+from synthetic import make_project
+
+def git_commit():
+    try:
+        p = subprocess.run(
+            [ "git", "rev-parse", "HEAD" ],
+            cwd=Path(__file__).resolve().parent, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        return p.stdout.strip()
+    except OSError:
+        return ""
+
+def measure(func, repeat: int, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t = perf_counter()
+        func()
+        times.append(perf_counter() - t)
+    return { "min": min(times), "median": median(times), "max": max(times), "repeat": repeat }
+
+def run_cases(paths: dict[str, Path], repeat: int, jobs: int | None):
+    os.chdir(paths["root"])
+    cfg = Config(paths["config"])
+    results = {}
+    results["list_files"] = measure(lambda: m_action.list_files(cfg), repeat)
+    def clear_cache():
+        rmtree(paths["cache"], ignore_errors=True)
+    results["full_build_cold"] = measure(lambda: m_action.build(cfg, jobs, force=True), repeat, clear_cache)
+    results["full_build_warm"] = measure(lambda: m_action.build(cfg, jobs, force=True), repeat)
+    results["noop_rebuild"] = measure(lambda: m_action.build(cfg, jobs, incremental=True), repeat)
+    m_action.build(cfg, jobs, force=True)
+    results["unchanged_full_build"] = measure(lambda: m_action.build(cfg, jobs), repeat)
+    # change one module every time, so every repetition has real work
+    changing = sorted(paths["source"].rglob("mod_0.py"))[0]
+    original = changing.read_text()
+    counter = [ 0 ]
+    def change_one():
+        counter[0] += 1
+        changing.write_text(original + f"\nCHANGE = {counter[0]}\n")
+    results["single_change_rebuild"] = measure(lambda: m_action.build(cfg, jobs, incremental=True), repeat, change_one)
+    changing.write_text(original)
+    variants = Config(write_variants_config(paths)).variants()
+    results["variant_single_cold"] = measure(lambda: m_action.build(variants[-1], jobs, force=True), repeat, clear_cache)
+    def build_sequential():
+        for variant in variants:
+            m_action.build(variant, jobs, force=True)
+    results["variants_sequential_cold"] = measure(build_sequential, repeat, clear_cache)
+    results["variants_batch_cold"] = measure(lambda: m_action.build_variants(variants, jobs, force=True), repeat, clear_cache)
+    return results
+
+def write_variants_config(paths: dict[str, Path]):
+    # the project config with three variants
+    config = paths["root"].joinpath("variants.toml")
+    out = paths["output"].parent
+    text = paths["config"].read_text(encoding="utf-8")
+    text += f"""
+[[variant]]
+name = "debug"
+mpy-cross = {{ params = "-O0" }}
+gba = {{ output = "{out.joinpath('debug.gba').as_posix()}" }}
+
+[[variant]]
+name = "release"
+gba = {{ output = "{out.joinpath('release.gba').as_posix()}" }}
+
+[[variant]]
+name = "app"
+project = {{ target_dir = "/app" }}
+gba = {{ output = "{out.joinpath('app.gba').as_posix()}" }}
+"""
+    config.write_text(text, encoding="utf-8")
+    return config
+
+def print_results(results: dict, baseline: dict | None):
+    header = f"{'case':<26}{'min s':>10}{'median s':>10}"
+    if baseline is not None:
+        header += f"{'baseline':>10}{'speedup':>9}"
+    print(header)
+    for name, r in results.items():
+        line = f"{name:<26}{r['min']:>10.4f}{r['median']:>10.4f}"
+        if baseline is not None and name in baseline:
+            base = baseline[name]["median"]
+            line += f"{base:>10.4f}{(base / r['median'] if r['median'] > 0 else 0):>8.2f}x"
+        print(line)
+
+def main():
+    parser = ArgumentParser(description="Build pipeline benchmark")
+    parser.add_argument("--modules", type=int, default=300, help="Number of modules")
+    parser.add_argument("--assets", type=int, default=20, help="Number of binary assets")
+    parser.add_argument("--junk", type=int, default=2000, help="Number of ignored files")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeat every case N times")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Max parallel mpy-cross processes")
+    parser.add_argument("--workdir", default="", help="Keep the synthetic project in this dir")
+    parser.add_argument("--output", default="", help="Write the result as JSON")
+    parser.add_argument("--compare", default="", help="Compare with a previous JSON result")
+    args = parser.parse_args()
+    with TemporaryDirectory() as tmp:
+        workdir = Path(args.workdir) if args.workdir else Path(tmp)
+        paths = make_project(workdir, modules=args.modules, assets=args.assets, junk=args.junk)
+        results = run_cases(paths, args.repeat, args.jobs)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": { "modules": args.modules, "assets": args.assets, "junk": args.junk, "repeat": args.repeat, "jobs": args.jobs },
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+
+if __name__ == "__main__":
+    main()
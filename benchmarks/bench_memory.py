@@ -0,0 +1,107 @@
+"""Check the peak memory of the build with a large asset, as a regression test.
+
+Each build runs in a fresh process that reports its own peak RSS. The project is built twice,
+once with a small asset and once with a large one (16 MiB by default). Files are streamed into the
+ROM in chunks, so the large asset must not add more than `--threshold` bytes to the peak RSS.
+The file system buffer is the same in both builds, so it cancels out.
+
+Cases:
+    full_build              full build with an empty compile cache
+    asset_change_rebuild    incremental build after changing the asset
+
+Usage:
+    python benchmarks/bench_memory.py [--asset-size BYTES] [--threshold BYTES] [--output result.json]
+
+Exit with 1 if the threshold is exceeded.
+"""
+import sys
+import json
+import platform
+import subprocess
+from argparse import ArgumentParser, SUPPRESS
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic import make_project, make_template_rom
+from bench_build import git_commit
+
+MIB = 1024 * 1024
+
+def child_main(config: str, incremental: bool):
+    # runs in the measured process
+    import os
+    import resource
+    from gba_mpy_tools.config import Config
+    import gba_mpy_tools.action as m_action
+    os.chdir(Path(config).parent)
+    m_action.build(Config(config), incremental=incremental)
+    # ru_maxrss is in KiB on linux
+    print(json.dumps({ "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 }))
+
+def measure(config: Path, incremental: bool = False):
+    p = subprocess.run(
+        [ sys.executable, __file__, "--child", str(config) ] + ([ "--incremental" ] if incremental else []),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    if p.returncode != 0:
+        raise RuntimeError(p.stderr)
+    return json.loads(p.stdout.strip().splitlines()[-1])["peak_rss"]
+
+def run_project(workdir: Path, asset_size: int, capacity: int):
+    # the same template for both builds, large enough for the old and the new asset in the incremental build
+    template = workdir.joinpath("template.gba")
+    make_template_rom(template, capacity + 16 * MIB, capacity)
+    paths = make_project(workdir, modules=50, assets=0, junk=0)
+    # fewer blocks, and a lookahead window covering them, or writing a large file is slow
+    with open(paths["config"], "a", encoding="utf-8") as f:
+        f.write("\n[littlefs]\nblock_size = 4096\nlookahead_size = 1024\n")
+    asset = paths["source"].joinpath("music.bin")
+    with open(asset, "wb") as f:
+        chunk = bytes(range(256)) * 4096
+        for pos in range(0, asset_size, len(chunk)):
+            f.write(chunk[:min(len(chunk), asset_size - pos)])
+    results = { "full_build": measure(paths["config"]) }
+    with open(asset, "r+b") as f:
+        f.write(b"changed")
+    results["asset_change_rebuild"] = measure(paths["config"], incremental=True)
+    return results
+
+def main():
+    parser = ArgumentParser(description="Build peak memory check")
+    parser.add_argument("--asset-size", type=int, default=16 * MIB, help="Size of the large asset")
+    parser.add_argument("--threshold", type=int, default=4 * MIB, help="Max peak RSS added by the large asset")
+    parser.add_argument("--output", default="", help="Write the result as JSON")
+    parser.add_argument("--child", default="", help=SUPPRESS)
+    parser.add_argument("--incremental", action="store_true", help=SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child_main(args.child, args.incremental)
+        return
+    with TemporaryDirectory() as small_dir, TemporaryDirectory() as large_dir:
+        capacity = args.asset_size * 2 + 8 * MIB
+        small = run_project(Path(small_dir), 64 * 1024, capacity)
+        large = run_project(Path(large_dir), args.asset_size, capacity)
+    failed = False
+    print(f"{'case':<24}{'small MiB':>11}{'large MiB':>11}{'added MiB':>11}{'limit MiB':>11}")
+    for name in small:
+        added = large[name] - small[name]
+        failed = failed or added > args.threshold
+        print(f"{name:<24}{small[name] / MIB:>11.1f}{large[name] / MIB:>11.1f}{added / MIB:>11.1f}{args.threshold / MIB:>11.1f}", "" if added <= args.threshold else "FAILED")
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": { "asset_size": args.asset_size, "threshold": args.threshold },
+        "results": { "small": small, "large": large },
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Compare the full-copy ROM save with the block-patching save, and the block-patching save also making a BPS patch.
+
+Every case runs in a child process, so the peak RSS is measured separately.
+
+Usage:
+    python benchmarks/bench_rom_save.py [--rom-size MiB] [--capacity MiB] [--output result.json]
+"""
+import sys
+import json
+import resource
+import subprocess
+from argparse import ArgumentParser, SUPPRESS
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from gba_mpy_tools.rom import GBAMicroPythonRom
+from synthetic import make_template_rom
+
+FILE_COUNT = 64
+FILE_SIZE = 16 * 1024
+
+def fill_fs(rom: GBAMicroPythonRom, revision: int):
+    rom.mkfs(512)
+    for i in range(FILE_COUNT):
+        content = bytes([ (i + (revision if i == 0 else 0)) % 256 ]) * FILE_SIZE
+        with rom.fs.open(f"/file_{i}.bin", "wb") as f:
+            f.write(content)
+
+def legacy_save(template: Path, rom: GBAMicroPythonRom, output: Path):
+    # the previous implementation: read the whole ROM, copy it, patch and write everything
+    with open(template, "rb") as f:
+        data = f.read()
+    p = data.find(b"GBABDEV\0")
+    data = bytearray(data)
+    data[p + 8: p + 12] = rom.fs_block_size.to_bytes(4, "little")
+    data[p + 12: p + 16] = rom.fs_block_count.to_bytes(4, "little")
+    buffer = rom.fs.context.buffer
+    data[p + 20: p + 20 + len(buffer)] = buffer
+    with open(output, "wb") as f:
+        f.write(data)
+    return len(data)
+
+def child(mode: str, template: Path, output: Path, revision: int):
+    rom = GBAMicroPythonRom.load(template)
+    fill_fs(rom, revision)
+    rss_before_save = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t = perf_counter()
+    patch_size = -1
+    patch_seconds = 0.0
+    if mode == "legacy":
+        written = legacy_save(template, rom, output)
+        copied = 0
+    else:
+        result = rom.save(output, output.with_name(output.name + ".bps") if mode == "bps" else None)
+        written, copied = result.written, result.copied
+        if result.patch is not None:
+            patch_size, patch_seconds = result.patch.size, result.patch.seconds
+    seconds = perf_counter() - t
+    rom.close()
+    print(json.dumps({
+        "written": written,
+        "copied": copied,
+        "seconds": seconds,
+        "patch_size": patch_size,
+        "patch_seconds": patch_seconds,
+        "peak_rss_before_save_kib": rss_before_save,
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+def run_child(mode: str, template: Path, output: Path, revision: int):
+    p = subprocess.run(
+        [ sys.executable, __file__, "--child", mode, str(template), str(output), str(revision) ],
+        check=True, stdout=subprocess.PIPE, text=True,
+    )
+    return json.loads(p.stdout)
+
+def main():
+    parser = ArgumentParser(description="ROM save benchmark")
+    parser.add_argument("--rom-size", type=int, default=32, help="ROM size in MiB")
+    parser.add_argument("--capacity", type=int, default=16, help="File system size in MiB")
+    parser.add_argument("--output", default="", help="Write the result as JSON")
+    parser.add_argument("--child", nargs=4, help=SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        mode, template, output, revision = args.child
+        child(mode, Path(template), Path(output), int(revision))
+        return
+    results = {}
+    with TemporaryDirectory() as tmp:
+        template = Path(tmp, "template.gba")
+        make_template_rom(template, args.rom_size * 1024 * 1024, args.capacity * 1024 * 1024)
+        for mode in ("legacy", "patch", "bps"):
+            output = Path(tmp, f"{mode}.gba")
+            # first save creates the output, the second one changes one file
+            results[f"{mode}_first"] = run_child(mode, template, output, 0)
+            results[f"{mode}_rebuild"] = run_child(mode, template, output, 1)
+    print(f"{'case':<16}{'written':>12}{'copied':>12}{'RSS before save':>17}{'peak RSS':>10}{'seconds':>10}{'patch':>10}{'patch s':>9}")
+    for name, r in results.items():
+        patch = f"{r['patch_size']:>10}{r['patch_seconds']:>9.3f}" if r["patch_size"] >= 0 else ""
+        print(f"{name:<16}{r['written']:>12}{r['copied']:>12}{r['peak_rss_before_save_kib']:>17}{r['peak_rss_kib']:>10}{r['seconds']:>10.3f}{patch}")
+    print("(RSS in KiB)")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Benchmark the CLI startup on a synthetic project.
+
+Every case runs `python -X importtime -m gba_mpy_tools.cli ...` in a fresh process, and measures
+the wall time from process start to the first line of output, and to the process exit.
+The import time report is summed up to show what the startup spends its time on.
+
+Cases:
+    help                    print the usage, no config is loaded
+    list                    list the files that will be written into the ROM
+    cache_stats             show the build cache stats
+    noop_rebuild            incremental build without any change
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat N] [--top N] [--output result.json] [--compare old.json]
+"""
+import sys
+import json
+import os
+import platform
+import subprocess
+from argparse import ArgumentParser
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic import make_project
+from bench_build import git_commit
+
+CASES = {
+    "help": [ "--help" ],
+    "list": [ "list" ],
+    "cache_stats": [ "cache", "stats" ],
+    "noop_rebuild": [ "build", "-i" ],
+}
+
+def parse_importtime(stderr: str):
+    # "import time: self [us] | cumulative | imported package", nested imports are indented
+    imports: list[tuple[str, int, int]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        imports.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return imports
+
+def run_once(config: Path, cmd: list[str]):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = str(ROOT) + os.pathsep + env.get("PYTHONPATH", "")
+    # line buffered like a terminal, so the first line is seen when it is printed
+    env["PYTHONUNBUFFERED"] = "1"
+    start = perf_counter()
+    p = subprocess.Popen(
+        [ sys.executable, "-X", "importtime", "-m", "gba_mpy_tools.cli", "-c", str(config), *cmd ],
+        cwd=config.parent, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    first_line = p.stdout.readline()
+    first_output = perf_counter() - start
+    rest, stderr = p.communicate()
+    exit_time = perf_counter() - start
+    if p.returncode != 0 and cmd != [ "--help" ]:
+        raise RuntimeError(f"{' '.join(cmd)} failed: {first_line}{rest}{stderr}")
+    return first_output, exit_time, parse_importtime(stderr)
+
+def measure(config: Path, cmd: list[str], repeat: int, top: int):
+    first_outputs = []
+    exits = []
+    import_totals = []
+    modules: dict[str, list[int]] = {}
+    for _ in range(repeat):
+        first_output, exit_time, imports = run_once(config, cmd)
+        first_outputs.append(first_output)
+        exits.append(exit_time)
+        import_totals.append(sum(self_us for _, self_us, _ in imports) / 1e6)
+        for name, self_us, _ in imports:
+            modules.setdefault(name, []).append(self_us)
+    slowest = sorted(((name, median(times) / 1e6) for name, times in modules.items()), key=lambda item: item[1], reverse=True)
+    return {
+        "first_output": { "min": min(first_outputs), "median": median(first_outputs), "max": max(first_outputs) },
+        "exit": { "min": min(exits), "median": median(exits), "max": max(exits) },
+        "import_total": median(import_totals),
+        "modules": len(modules),
+        "slowest_imports": slowest[:top],
+        "repeat": repeat,
+    }
+
+def print_results(results: dict, baseline: dict | None):
+    header = f"{'case':<16}{'first out s':>12}{'exit s':>10}{'imports s':>11}{'modules':>9}"
+    if baseline is not None:
+        header += f"{'baseline':>10}{'speedup':>9}"
+    print(header)
+    for name, r in results.items():
+        line = f"{name:<16}{r['first_output']['median']:>12.4f}{r['exit']['median']:>10.4f}{r['import_total']:>11.4f}{r['modules']:>9}"
+        if baseline is not None and name in baseline:
+            base = baseline[name]["first_output"]["median"]
+            line += f"{base:>10.4f}{(base / r['first_output']['median'] if r['first_output']['median'] > 0 else 0):>8.2f}x"
+        print(line)
+    for name, r in results.items():
+        print()
+        print(f"Slowest imports of {name} (self time):")
+        for module, seconds in r["slowest_imports"]:
+            print(f"  {seconds * 1000:8.2f} ms  {module}")
+
+def main():
+    parser = ArgumentParser(description="CLI startup benchmark")
+    parser.add_argument("--modules", type=int, default=100, help="Number of modules")
+    parser.add_argument("--repeat", type=int, default=10, help="Repeat every case N times")
+    parser.add_argument("--top", type=int, default=10, help="Number of the slowest imports to keep")
+    parser.add_argument("--output", default="", help="Write the result as JSON")
+    parser.add_argument("--compare", default="", help="Compare with a previous JSON result")
+    args = parser.parse_args()
+    results = {}
+    with TemporaryDirectory() as tmp:
+        paths = make_project(tmp, modules=args.modules, assets=5, junk=100)
+        # the no-op rebuild needs a previous build
+        run_once(paths["config"], [ "build" ])
+        for name, cmd in CASES.items():
+            results[name] = measure(paths["config"], cmd, args.repeat, args.top)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": { "modules": args.modules, "repeat": args.repeat },
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Synthetic inputs for the benchmarks, no real GBA template is required."""
+from pathlib import Path
+from random import Random
+import json
+
+MAGIC_BLOCK_SIZE = 0x67452301
+MAGIC_BLOCK_COUNT = 0xEFCDAB89
+
+def make_template_rom(path: str | Path, rom_size: int = 32 * 1024 * 1024, capacity: int = 16 * 1024 * 1024, seed: int = 0):
+    """Write a fake MicroPython template ROM with valid GBABDEV/BDEVGBA tags.
+
+    The code area before and after the file system is filled with random bytes.
+
+    Args:
+        path (str | Path): The output template file.
+        rom_size (int): Total size of the ROM.
+        capacity (int): Size of the file system region.
+        seed (int): Random seed of the code area.
+    """
+    rng = Random(seed)
+    header_size = 20
+    # put the tag at an 8 bytes aligned position, after some "code"
+    offset = (rom_size - capacity - header_size - 8) // 2 // 8 * 8
+    assert offset > 0
+    tail = rom_size - offset - header_size - capacity - 8
+    assert tail >= 0
+    with open(path, "wb") as f:
+        f.write(rng.randbytes(offset))
+        f.write(b"GBABDEV\0")
+        f.write(MAGIC_BLOCK_SIZE.to_bytes(4, "little"))
+        f.write(MAGIC_BLOCK_COUNT.to_bytes(4, "little"))
+        f.write(capacity.to_bytes(4, "little"))
+        chunk = b"\xff" * (1024 * 1024)
+        left = capacity
+        while left > 0:
+            n = min(left, len(chunk))
+            f.write(chunk[:n])
+            left -= n
+        f.write(b"BDEVGBA\0")
+        f.write(rng.randbytes(tail))
+
+MODULE_TEMPLATE = '''"""Synthetic module {index}."""
+import {import_name}
+
+CONSTANT_{index} = {index}
+
+class Thing{index}:
+    def __init__(self, value):
+        self.value = value + CONSTANT_{index}
+
+    def step(self, dt):
+        # some loop to give mpy-cross something to do
+        total = 0
+        for i in range(dt):
+            total += i * self.value
+        return total
+
+def make_{index}(value):
+    return Thing{index}(value)
+'''
+
+def make_project(root: str | Path, modules: int = 200, packages: int = 10, depth: int = 3, assets: int = 20, asset_size: int = 64 * 1024, junk: int = 500, seed: int = 0):
+    """Generate a synthetic project with its .gbampy.toml.
+
+    Layout:
+        src/boot.py, src/main.py            entry files, kept as .py
+        src/pkg_<p>/.../mod_<i>.py          modules in nested packages
+        src/assets/asset_<i>.bin            random binary assets
+        src/.git/objects/.., __pycache__    ignored junk
+
+    Args:
+        root (str | Path): The project dir, created if not exist.
+        modules (int): Number of modules.
+        packages (int): Number of top level packages.
+        depth (int): Package nesting depth.
+        assets (int): Number of binary assets.
+        asset_size (int): Size of each asset.
+        junk (int): Number of ignored files.
+        seed (int): Random seed.
+
+    Returns:
+        dict[str, Path]: Paths of "root", "source", "config", "template", "output" and "cache".
+    """
+    rng = Random(seed)
+    root = Path(root).resolve()
+    src = root.joinpath("src")
+    src.mkdir(parents=True, exist_ok=True)
+    src.joinpath("boot.py").write_text("print('boot')\n")
+    src.joinpath("main.py").write_text("import pkg_0\nprint('main')\n")
+    # nested packages
+    package_dirs: list[Path] = []
+    for p in range(max(1, packages)):
+        pdir = src.joinpath(f"pkg_{p}")
+        for d in range(max(1, depth)):
+            pdir.mkdir(parents=True, exist_ok=True)
+            pdir.joinpath("__init__.py").write_text(f"# package {p} level {d}\n")
+            package_dirs.append(pdir)
+            pdir = pdir.joinpath(f"sub_{d}")
+    for i in range(modules):
+        pdir = package_dirs[i % len(package_dirs)]
+        pdir.joinpath(f"mod_{i}.py").write_text(MODULE_TEMPLATE.format(index=i, import_name="micropython"))
+    # binary assets
+    adir = src.joinpath("assets")
+    adir.mkdir(exist_ok=True)
+    for i in range(assets):
+        adir.joinpath(f"asset_{i}.bin").write_bytes(rng.randbytes(asset_size))
+    # ignored junk
+    for i in range(junk):
+        jdir = src.joinpath(".git", "objects", f"{i % 256:02x}")
+        jdir.mkdir(parents=True, exist_ok=True)
+        jdir.joinpath(f"{i:038x}").write_bytes(rng.randbytes(64))
+    cache_dir = package_dirs[0].joinpath("__pycache__")
+    cache_dir.mkdir(exist_ok=True)
+    for i in range(min(junk, 50)):
+        cache_dir.joinpath(f"mod_{i}.cpython-313.pyc").write_bytes(rng.randbytes(128))
+    src.joinpath("game.sav").write_bytes(rng.randbytes(1024))
+    # template and config
+    template = root.joinpath("template.gba")
+    if not template.exists():
+        make_template_rom(template, 4 * 1024 * 1024, 2 * 1024 * 1024)
+    output = root.joinpath("out", "game.gba")
+    output.parent.mkdir(exist_ok=True)
+    cache = root.joinpath("cache")
+    # pin the mpy-cross binary, a wrapper script in PATH would dominate the timing
+    try:
+        from mpy_cross import mpy_cross as mpy_cross_path
+    except ImportError:
+        mpy_cross_path = ""
+    config = root.joinpath(".gbampy.toml")
+    config.write_text(f'''[project]
+source_dir = {json.dumps(str(src))}
+target_dir = "/"
+ignore_pattern = ["**/__pycache__", "**/.*", "**/*.gba", "**/*.sav"]
+before_build = ""
+after_build = ""
+
+[mpy-cross]
+compile = true
+path = {json.dumps(str(mpy_cross_path))}
+params = "-O2"
+ignore_pattern = ["boot.py", "main.py"]
+
+[gba]
+template = {json.dumps(str(template))}
+output = {json.dumps(str(output))}
+
+[cache]
+dir = {json.dumps(str(cache))}
+''')
+    return { "root": root, "source": src, "config": config, "template": template, "output": output, "cache": cache }
@@ -1,111 +1,1235 @@
-from gba_mpy_tools.config import Config
-from gba_mpy_tools.rom import GBAMicroPythonRom
-from gba_mpy_tools.wrap_mpy_cross import MpyCross
-from gba_mpy_tools.wrap_gba_emulator import GBAEmulator
+from gba_mpy_tools.config import Config, ConfigSnapshot
+from gba_mpy_tools.assets import asset_target_suffix, converter_identity, ASSET_FORMAT_VERSION
+from gba_mpy_tools.cache import BuildCache
+from gba_mpy_tools.errors import CompileError, ROMInvalidError, LFSNotFormatedError, LFSConfigInvalidError, LFSNoSpaceError, \
+    VariantOutputConflictError, OutputChangedError
+from gba_mpy_tools.manifest import BuildManifest, ManifestEntryDict, ManifestFileStatDict, manifest_path_for, stat_file, \
+    hooks_path_for, load_hook_records, save_hook_records
+from gba_mpy_tools.profiler import Profiler, NO_PROFILER
+from os import cpu_count
+from shutil import copyfileobj
+from collections import deque
 from pathlib import Path, PurePosixPath
-from typing import NamedTuple
+from typing import NamedTuple, Iterator, TYPE_CHECKING
 from sys import path as import_path
 from importlib import import_module
+from hashlib import sha256
+import os
+import re
+import json
+# littlefs, mpy-cross and the emulator are imported by the steps that use them, to keep the startup fast
+if TYPE_CHECKING:
+    from gba_mpy_tools.rom import GBAMicroPythonRom
+    from gba_mpy_tools.wrap_mpy_cross import MpyCross
+    from gba_mpy_tools.assets import AssetConverter
+    from gba_mpy_tools.minify import Minifier
+    from gba_mpy_tools.patch import PatchResult
+
+# files are written into the ROM in chunks of this size
+WRITE_CHUNK_SIZE = 64 * 1024
 
 class FileItemPair(NamedTuple):
     source: Path
     target: PurePosixPath
     is_dir: bool
     compile: bool
+    convert: bool = False
+    minify: bool = False
+
+def __should_minify(rel: str, cfg: ConfigSnapshot):
+    if not cfg.minify_enable or rel[-3:].lower() != ".py":
+        return False
+    matcher = cfg.minify_ignore_matcher
+    return matcher is None or matcher.match(rel) is None
 
-def __deal_file_with_config(file: Path, cfg: Config):
+def __deal_file_with_config(file: Path, cfg: ConfigSnapshot):
     target = cfg.to_target_path(file)
     should_compile = False
+    rule = cfg.find_asset_rule(target)
+    if rule is not None:
+        return FileItemPair(file, target.with_suffix(asset_target_suffix(rule)), False, False, True)
     if cfg.mpy_cross_compile and target.suffix.lower() == ".py" and (not cfg.should_ignore_mpy_cross_compile(file)):
         target = target.with_suffix(".mpy")
         should_compile = True
+    elif __should_minify(target.relative_to(cfg.project_target_dir).as_posix(), cfg):
+        return FileItemPair(file, target, False, False, False, True)
     return FileItemPair(file, target, False, should_compile)
 
-def __walk_dir_with_config(dir: Path, cfg: Config) -> list[FileItemPair]:
-    if dir.is_dir():
-        result = [FileItemPair(dir, cfg.to_target_path(dir), True, False)]
-        # list current dir
-        for fp in dir.iterdir():
-            if cfg.should_ignore_project_file(fp):
-                continue
-            if fp.is_dir():
-                result.extend(__walk_dir_with_config(fp, cfg))
+class __WalkContext(NamedTuple):
+    cfg: ConfigSnapshot
+    target_dir: PurePosixPath
+    ignore_matcher: re.Pattern | None
+    compile_matcher: re.Pattern | None
+    asset_matcher: re.Pattern | None
+    should_compile: bool
+    profiler: Profiler
+
+def __scan_dir(dir_path: str, rel_prefix: str, ctx: __WalkContext) -> Iterator[FileItemPair]:
+    # entries are matched by the posix path relative to the source dir, built by string concat
+    with os.scandir(dir_path) as it:
+        # sorted, the scandir order depends on the file system and makes different ROMs
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        rel = rel_prefix + entry.name
+        if ctx.ignore_matcher is not None:
+            if ctx.profiler.enabled:
+                with ctx.profiler.span("ignore match", "walk", path=rel):
+                    ignored = ctx.ignore_matcher.match(rel) is not None
             else:
-                result.append(__deal_file_with_config(fp, cfg))
-        return result
-    else:
-        return [ __deal_file_with_config(dir, cfg) ]
+                ignored = ctx.ignore_matcher.match(rel) is not None
+            if ignored:
+                continue
+        target = ctx.target_dir.joinpath(rel)
+        if entry.is_dir():
+            yield FileItemPair(Path(entry.path), target, True, False)
+            yield from __scan_dir(entry.path, rel + "/", ctx)
+            continue
+        if ctx.asset_matcher is not None and ctx.asset_matcher.match(rel) is not None:
+            rule = ctx.cfg.find_asset_rule(target)
+            yield FileItemPair(Path(entry.path), target.with_suffix(asset_target_suffix(rule)), False, False, True)
+            continue
+        should_compile = False
+        if ctx.should_compile and entry.name[-3:].lower() == ".py" \
+            and (ctx.compile_matcher is None or ctx.compile_matcher.match(rel) is None):
+            target = target.with_suffix(".mpy")
+            should_compile = True
+        elif __should_minify(rel, ctx.cfg):
+            yield FileItemPair(Path(entry.path), target, False, False, False, True)
+            continue
+        yield FileItemPair(Path(entry.path), target, False, should_compile)
+
+def iter_files(cfg: Config, dir: Path | None = None, profiler: Profiler = NO_PROFILER) -> Iterator[FileItemPair]:
+    """Walk the files that will be write into the ROM, parents before children.
+
+    Ignored dirs are pruned without being listed.
 
-def list_files(cfg: Config):
+    Args:
+        cfg (Config): Config info object.
+        dir (Path | None): Only walk the files in this dir, default is the project source dir.
+        profiler (Profiler): Record the ignore matching of each entry.
+
+    Yields:
+        FileItemPair: File item.
+    """
+    cfg = cfg.freeze()
+    dir = cfg.project_source_dir if dir is None else dir
+    if not dir.is_dir():
+        yield __deal_file_with_config(dir, cfg)
+        return
+    target = cfg.to_target_path(dir)
+    rel = target.relative_to(cfg.project_target_dir).as_posix()
+    ctx = __WalkContext(
+        cfg,
+        cfg.project_target_dir,
+        cfg.project_ignore_matcher,
+        cfg.mpy_cross_ignore_matcher,
+        cfg.asset_matcher,
+        cfg.mpy_cross_compile,
+        profiler,
+    )
+    yield FileItemPair(dir, target, True, False)
+    yield from __scan_dir(str(dir), "" if rel == "." else rel + "/", ctx)
+
+def list_files(cfg: Config, dir: Path | None = None, profiler: Profiler = NO_PROFILER):
     """List all the files that will be write into the ROM.
 
+    With `[prune]` enabled, only the modules reachable from the entry files and the kept files are listed.
+
     Args:
         cfg (Config): Config info object.
+        dir (Path | None): Only list the files in this dir, default is the project source dir.
+            It is not pruned, the imports from the other dirs are unknown.
+        profiler (Profiler): Record the walk.
     
     Returns:
         list[FileItemPair]: File list
     """
-    return __walk_dir_with_config(cfg.project_source_dir, cfg)
+    with profiler.span("walk", "walk"):
+        items = list(iter_files(cfg, dir, profiler))
+    if dir is None and cfg.prune_enable:
+        with profiler.span("prune", "walk"):
+            items, _ = __prune(cfg, items, profiler)
+    return items
+
+def __prune(cfg: Config, items: list[FileItemPair], profiler: Profiler = NO_PROFILER):
+    from gba_mpy_tools.imports import prune_files
+    cache = open_build_cache(cfg)
+    try:
+        return prune_files(cfg, items, cache, profiler)
+    finally:
+        if cache is not None:
+            cache.flush()
+
+def explain_files(cfg: Config):
+    """List all the files that will be write into the ROM, with why each one is included.
+
+    Args:
+        cfg (Config): Config info object.
+
+    Returns:
+        list[tuple[FileItemPair, str]]: File list, and the reason of each file.
+    """
+    items = list(iter_files(cfg))
+    if not cfg.prune_enable:
+        return [ (item, "walked, [prune] is disabled") for item in items ]
+    items, reasons = __prune(cfg, items)
+    return [ (item, reasons[item.target]) for item in items ]
+
+def open_build_cache(cfg: Config):
+    """Open the build cache.
+
+    Args:
+        cfg (Config): Config info object.
+
+    Returns:
+        BuildCache | None: The cache, None if the cache is disabled.
+    """
+    if not cfg.cache_enable:
+        return None
+    return BuildCache(cfg.cache_dir, cfg.cache_max_size)
+
+class BuildHookResult(NamedTuple):
+    entry: str
+    skipped: bool
+    # the outputs written by the hook, resolved
+    changed: set[Path]
+
+def __stat_hook_output(path: Path, known: ManifestFileStatDict | None):
+    if path.is_dir():
+        return None
+    return stat_file(path, known)
+
+def __hook_fingerprint(entry: str, module_file: str, inputs: dict[str, ManifestFileStatDict], outputs: list[Path]):
+    h = sha256()
+    h.update(f"{entry}\0{module_file}\0".encode("utf-8"))
+    for path in sorted(inputs):
+        h.update(f"{path}\0{inputs[path]['hash']}\0".encode("utf-8"))
+    for path in outputs:
+        h.update(f"{path}\0".encode("utf-8"))
+    return h.hexdigest()
+
+def __execute_build_hook(cfg: Config, name: str, script: tuple[str, str], input_patterns: list[str], outputs: list[Path]):
+    # run the hook unless its inputs and outputs are the same as after its last successful run
+    from importlib.util import find_spec
+    entry = ":".join(part for part in script if part)
+    if not script[0]:
+        return BuildHookResult(entry, False, set())
+    # append import path
+    if str(cfg.config_file_dir) not in import_path:
+        import_path.append(str(cfg.config_file_dir))
+    if not input_patterns:
+        __call_build_hook(cfg, script)
+        return BuildHookResult(entry, False, set(outputs))
+    records_path = hooks_path_for(cfg.gba_output)
+    records = load_hook_records(records_path)
+    old = records.get(name)
+    old_inputs = old["inputs"] if old is not None else {}
+    old_outputs = old["outputs"] if old is not None else {}
+    # the hook module itself is an input too
+    spec = find_spec(script[0])
+    module_file = spec.origin if spec is not None and spec.origin is not None else ""
+    inputs: dict[str, ManifestFileStatDict] = {}
+    for pattern in input_patterns:
+        for path in cfg.config_file_dir.glob(pattern):
+            if path.is_file():
+                key = str(path.resolve())
+                inputs[key] = stat_file(key, old_inputs.get(key))
+    if module_file and Path(module_file).is_file():
+        inputs[module_file] = stat_file(module_file, old_inputs.get(module_file))
+    fingerprint = __hook_fingerprint(entry, module_file, inputs, outputs)
+    def outputs_matched():
+        for path in outputs:
+            key = str(path)
+            if not path.exists() or key not in old_outputs:
+                return False
+            known = old_outputs[key]
+            if known is not None and __stat_hook_output(path, known) != known:
+                return False
+        return True
+    if old is not None and old["fingerprint"] == fingerprint and outputs_matched():
+        return BuildHookResult(entry, True, set())
+    __call_build_hook(cfg, script)
+    new_outputs: dict[str, ManifestFileStatDict | None] = {}
+    changed: set[Path] = set()
+    for path in outputs:
+        if not path.exists():
+            if str(path) in old_outputs:
+                changed.add(path)
+            continue
+        stat = __stat_hook_output(path, None)
+        new_outputs[str(path)] = stat
+        known = old_outputs.get(str(path))
+        if stat is None or known is None or stat["hash"] != known["hash"]:
+            changed.add(path)
+    records[name] = { "fingerprint": fingerprint, "inputs": inputs, "outputs": new_outputs }
+    records_path.parent.mkdir(parents=True, exist_ok=True)
+    save_hook_records(records_path, records)
+    return BuildHookResult(entry, False, changed)
+
+def __call_build_hook(cfg: Config, script: tuple[str, str]):
+    # import module
+    module = import_module(script[0])
+    if script[1]:
+        # execute function
+        func = getattr(module, script[1])
+        if callable(func):
+            func(cfg)
 
 def execute_before_build_script(cfg: Config):
     """Execute before build script.
 
+    With `inputs` declared, it is skipped if the input files (and the hook module) have the same content
+    as in its last successful run, and its `outputs` are still there unchanged.
+    The records are saved next to the output ROM as `<output>.hooks.json`.
+
     Args:
         cfg (Config): Config info object.
+
+    Returns:
+        BuildHookResult: If it is skipped, and the outputs it changed, to be passed to the incremental build
+            as changed paths. All the outputs are changed if it has no inputs.
     """
-    if cfg.project_before_build[0]:
-        # append import path
-        if cfg.config_file_dir not in import_path:
-            import_path.append(str(cfg.config_file_dir))
-        # import module
-        module = import_module(cfg.project_before_build[0])
-        if cfg.project_before_build[1]:
-            # execute function
-            func = getattr(module, cfg.project_before_build[1])
-            if callable(func):
-                func(cfg)
+    return __execute_build_hook(cfg, "before_build", cfg.project_before_build, cfg.project_before_build_inputs, cfg.project_before_build_outputs)
 
 def execute_after_build_script(cfg: Config):
-    """Execute after build script.
+    """Execute after build script, skipped the same way as the before build script.
 
     Args:
         cfg (Config): Config info object.
+
+    Returns:
+        BuildHookResult: If it is skipped, and the outputs it changed.
     """
-    if cfg.project_after_build[0]:
-        # append import path
-        if cfg.config_file_dir not in import_path:
-            import_path.append(str(cfg.config_file_dir))
-        # import module
-        module = import_module(cfg.project_after_build[0])
-        if cfg.project_after_build[1]:
-            # execute function
-            func = getattr(module, cfg.project_after_build[1])
-            if callable(func):
-                func(cfg)
-
-def build(cfg: Config):
-    """Build the ROM with files.
+    return __execute_build_hook(cfg, "after_build", cfg.project_after_build, cfg.project_after_build_inputs, cfg.project_after_build_outputs)
+
+def compile_files(
+    file_list: list[FileItemPair],
+    mpy_cross: 'MpyCross',
+    jobs: int | None = None,
+    profiler: Profiler = NO_PROFILER,
+    asset_converter: 'AssetConverter | None' = None,
+    minifier: 'Minifier | None' = None,
+    memory_limit: int = 0,
+):
+    """Compile all the files that need to be compiled, convert the assets and minify the sources, on a bounded worker pool.
 
     Args:
-        cfg (Config): Config info object.
+        file_list (list[FileItemPair]): File list.
+        mpy_cross (MpyCross): The mpy-cross wrapper.
+        jobs (int | None): Max parallel mpy-cross processes, default is the CPU count.
+        profiler (Profiler): Record the compiling of each file.
+        asset_converter (AssetConverter | None): Convert the asset files, they are skipped if it is None.
+        minifier (Minifier | None): Minify the plain python files, they are skipped if it is None.
+        memory_limit (int): Max total size of the source files being processed at the same time, 0 means no limit.
+            A file larger than it is processed alone.
+
+    Raises:
+        CompileError: One or more files failed to compile, all of them are reported.
+
+    Returns:
+        dict[Path, bytes]: Compiled content for each source file.
     """
-    # build littlefs file system
-    file_list = list_files(cfg)
-    rom = GBAMicroPythonRom.load(cfg.gba_template)
-    rom.mkfs(512)
-    mpy_cross = MpyCross(cfg)
+    from concurrent.futures import ThreadPoolExecutor
+    items = [
+        item for item in file_list
+        if (not item.is_dir) and (item.compile or (item.convert and asset_converter is not None) or (item.minify and minifier is not None))
+    ]
+    if jobs is None or jobs <= 0:
+        jobs = cpu_count() or 1
+    compiled: dict[Path, bytes] = {}
+    failures: list[CompileError] = []
+    def compile_one(item: FileItemPair):
+        if item.convert:
+            with profiler.span("convert", "convert", file=item.source):
+                return asset_converter.convert(item.source)
+        if item.minify:
+            with profiler.span("minify", "minify", file=item.source):
+                return minifier.minify(item.source)
+        with profiler.span("compile", "compile", file=item.source):
+            return mpy_cross.compile(item.source)
+    pending = deque()
+    inflight = 0
+    def collect_oldest():
+        nonlocal inflight
+        source, size, future = pending.popleft()
+        inflight -= size
+        try:
+            compiled[source] = future.result()
+        except CompileError as e:
+            failures.append(e)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for item in items:
+            size = item.source.stat().st_size if memory_limit > 0 else 0
+            while pending and memory_limit > 0 and inflight + size > memory_limit:
+                collect_oldest()
+            pending.append((item.source, size, executor.submit(compile_one, item)))
+            inflight += size
+        while pending:
+            collect_oldest()
+    if failures:
+        failed_sources = [ s for e in failures for s in e.sources ]
+        message = "\n".join(f"[{', '.join(str(s) for s in e.sources)}]\n{e.output}" for e in failures)
+        raise CompileError(failed_sources, message)
+    return compiled
+
+class FsTrial(NamedTuple):
+    block_size: int
+    block_count: int
+    used_blocks: int
+    used_bytes: int
+    overhead: int
+    error: str
+
+class PackResult(NamedTuple):
+    modules: int
+    # None if the archive is not rewritten
+    archive_size: int | None
+    dirs_removed: int
+    # net change of the directory entries by packing, negative is fewer
+    entries_change: int
+    # net change of the used ROM bytes by packing, negative is saved, None if not measured (incremental builds)
+    bytes_change: int | None
+
+    @property
+    def helped(self):
+        if self.bytes_change is not None:
+            return self.bytes_change < 0
+        return self.entries_change < 0
+
+class MinifyResult(NamedTuple):
+    target: PurePosixPath
+    before: int
+    after: int
+
+class BuildResult(NamedTuple):
+    incremental: bool
+    written: int
+    removed: int
+    block_size: int
+    fs_trials: list[FsTrial]
+    pack: PackResult | None = None
+    minified: list[MinifyResult] | None = None
+    patch: 'PatchResult | None' = None
+    fingerprint: str = ""
+    # nothing is changed since the last build, the output is kept as it is
+    reused: bool = False
+
+def __item_key(item: FileItemPair, cfg: ConfigSnapshot):
+    # describe how the target content is made from the source
+    if item.convert:
+        rule = cfg.find_asset_rule(item.source)
+        return "asset\0" + converter_identity(cfg, rule["converter"]) + "\0" + json.dumps(rule, sort_keys=True, default=dict)
+    if item.minify:
+        return f"minify\0rename_locals={cfg.minify_rename_locals}"
+    if item.compile:
+        return "mpy-cross\0" + "\0".join(cfg.find_mpy_cross_params(item.source))
+    return "raw"
+
+def __is_affected(source: Path, changed: set[Path] | None):
+    if changed is None:
+        return True
+    return source in changed or any(parent in changed for parent in source.parents)
+
+def __update_file_list(cfg: ConfigSnapshot, old_manifest: BuildManifest, changed: set[Path]):
+    # rebuild the file list from the last build, only walk the changed paths
+    file_list: list[FileItemPair] = []
+    for target, entry in old_manifest.entries.items():
+        source = Path(entry["source"])
+        if __is_affected(source, changed):
+            continue
+        if entry["is_dir"]:
+            file_list.append(FileItemPair(source, PurePosixPath(target), True, False))
+        else:
+            file_list.append(__deal_file_with_config(source, cfg))
+    source_dir = cfg.project_source_dir
+    for path in changed:
+        if not path.exists() or not path.is_relative_to(source_dir):
+            continue
+        if any(parent in changed for parent in path.parents):
+            # walked with the changed parent
+            continue
+        # skip the path if itself or any of its parents is ignored
+        rel_parts = path.relative_to(source_dir).parts
+        if any(cfg.should_ignore_project_file(source_dir.joinpath(*rel_parts[:i + 1])) for i in range(len(rel_parts))):
+            continue
+        walked = list(iter_files(cfg, path))
+        # the parents may be missing from the last build, if they only had packed modules
+        known_targets = { item.target for item in file_list }
+        for parent in path.parents:
+            if not parent.is_relative_to(source_dir):
+                break
+            parent_target = cfg.to_target_path(parent)
+            if parent_target not in known_targets:
+                walked.append(FileItemPair(parent, parent_target, True, False))
+        file_list.extend(walked)
+    # parents before children
+    file_list.sort(key=lambda item: item.target.parts)
+    return file_list
+
+def __split_packed(file_list: list[FileItemPair], cfg: ConfigSnapshot):
+    # move the modules matched by [pack] out of the file list, and drop the dirs left with nothing else
+    matcher = cfg.pack_matcher
+    if matcher is None:
+        return file_list, [], 0
+    source_dir = cfg.project_source_dir
+    root = cfg.project_target_dir
+    packed: list[FileItemPair] = []
+    kept: list[FileItemPair] = []
+    for item in file_list:
+        if (not item.is_dir) and item.target.suffix in (".py", ".mpy") and item.target not in (cfg.pack_hook, __import_hook_target(cfg)) \
+            and matcher.match(item.source.relative_to(source_dir).as_posix()) is not None:
+            packed.append(item)
+        else:
+            kept.append(item)
+    if not packed:
+        return file_list, [], 0
+    touched = { parent for item in packed for parent in item.target.parents }
+    needed: set[PurePosixPath] = set()
+    for item in kept:
+        if (not item.is_dir) or item.target not in touched:
+            needed.update(item.target.parents)
+    result = [ item for item in kept if (not item.is_dir) or item.target == root or item.target not in touched or item.target in needed ]
+    return result, packed, len(kept) - len(result)
+
+def __import_hook_target(cfg: ConfigSnapshot):
+    # the hook is compiled like the modules, so it does not cost more ROM than packing saves
+    return cfg.pack_hook.with_suffix(".mpy") if cfg.mpy_cross_compile else cfg.pack_hook
+
+def __import_hook_key(cfg: ConfigSnapshot):
+    if cfg.mpy_cross_compile:
+        return "mpy-cross\0" + "\0".join(cfg.mpy_cross_params)
+    return f"minify\0rename_locals={cfg.minify_rename_locals}"
+
+def __make_import_hook(cfg: ConfigSnapshot, mpy_cross: 'MpyCross', minifier: 'Minifier'):
+    # generate the hook, then compile or minify it from a temp file named as the hook, like the other modules,
+    # it is minified even without [minify], nobody reads the generated source in the ROM
+    from gba_mpy_tools.pack import make_import_hook
+    from tempfile import TemporaryDirectory
+    with TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir).joinpath(cfg.pack_hook.name)
+        path.write_bytes(make_import_hook(str(cfg.pack_archive), cfg.pack_mount))
+        if cfg.mpy_cross_compile:
+            return mpy_cross.compile(path, cfg.mpy_cross_params)
+        return minifier.minify(path)
+
+def __is_packed_entry(entry: ManifestEntryDict):
+    return entry["key"].startswith("pack\0")
+
+def __item_content(item: FileItemPair, compiled: dict[Path, bytes]):
+    if item.compile or item.convert or item.minify:
+        return compiled[item.source]
+    with open(item.source, "rb") as f:
+        return f.read()
+
+def __stream_item(item: FileItemPair, compiled: dict[Path, bytes], f):
+    # write in fixed-size chunks, a large file is never loaded or copied as a whole
+    if item.compile or item.convert or item.minify:
+        with memoryview(compiled[item.source]) as content:
+            for pos in range(0, len(content), WRITE_CHUNK_SIZE):
+                f.write(content[pos: pos + WRITE_CHUNK_SIZE])
+        return
+    with open(item.source, "rb") as src:
+        copyfileobj(src, f, WRITE_CHUNK_SIZE)
+
+def __make_manifest_entries(file_list: list[FileItemPair], cfg: ConfigSnapshot, old_manifest: BuildManifest, changed: set[Path] | None = None):
+    entries: dict[str, ManifestEntryDict] = {}
     for item in file_list:
+        target = str(item.target)
         if item.is_dir:
-            rom.fs.makedirs(str(item.target), exist_ok=True)
+            entries[target] = { "source": str(item.source), "is_dir": True, "size": 0, "mtime_ns": 0, "hash": "", "key": "" }
         else:
-            if item.compile:
-                content = mpy_cross.compile(item.source)
+            known = old_manifest.source_stat(target)
+            if known is not None and not __is_affected(item.source, changed):
+                st = known
             else:
-                with open(item.source, "rb") as f:
-                    content = f.read()
-            with rom.fs.open(str(item.target), "wb") as f:
+                st = stat_file(item.source, known)
+            entries[target] = {
+                "source": st["path"],
+                "is_dir": False,
+                "size": st["size"],
+                "mtime_ns": st["mtime_ns"],
+                "hash": st["hash"],
+                "key": __item_key(item, cfg),
+            }
+    return entries
+
+def __load_previous_output(cfg: ConfigSnapshot, old_manifest: BuildManifest, manifest: BuildManifest):
+    # reuse the previous output only if it is built from the same template with the same geometry
+    if old_manifest.template is None or old_manifest.template["hash"] != manifest.template["hash"]:
+        return None
+    if old_manifest.geometry is None or old_manifest.geometry.get("options", {}) != cfg.littlefs_options:
+        return None
+    if cfg.littlefs_block_size != "auto" and old_manifest.geometry["block_size"] != cfg.littlefs_block_size:
+        return None
+    if not old_manifest.is_output_matched(cfg.gba_output):
+        return None
+    from gba_mpy_tools.rom import GBAMicroPythonRom
+    rom = GBAMicroPythonRom.load(cfg.gba_output)
+    try:
+        rom.mount(**cfg.littlefs_options)
+    except (ROMInvalidError, LFSNotFormatedError):
+        rom.close()
+        return None
+    if rom.fs_block_size != old_manifest.geometry["block_size"] or rom.fs_block_count != old_manifest.geometry["block_count"]:
+        rom.close()
+        return None
+    return rom
+
+def __write_items(
+    rom: 'GBAMicroPythonRom',
+    file_list: list[FileItemPair],
+    compiled: dict[Path, bytes],
+    profiler: Profiler = NO_PROFILER,
+    extra_files: dict[PurePosixPath, bytes] | None = None,
+):
+    for item in file_list:
+        if item.is_dir:
+            with profiler.span("fs mkdir", "fs write", path=item.target):
+                rom.fs.makedirs(str(item.target), exist_ok=True)
+        else:
+            with profiler.span("fs write", "fs write", file=item.source):
+                with rom.fs.open(str(item.target), "wb", buffering=0) as f:
+                    __stream_item(item, compiled, f)
+    # generated files, like the module archive
+    for target, content in (extra_files or {}).items():
+        with profiler.span("fs write", "fs write", path=target):
+            if target.parent != target.parent.parent:
+                rom.fs.makedirs(str(target.parent), exist_ok=True)
+            with rom.fs.open(str(target), "wb") as f:
                 f.write(content)
-    rom.save(cfg.gba_output)
+
+def tune_fs_block_size(
+    rom: 'GBAMicroPythonRom',
+    file_list: list[FileItemPair],
+    compiled: dict[Path, bytes],
+    candidates: list[int],
+    options: dict[str, int],
+    extra_files: dict[PurePosixPath, bytes] | None = None,
+):
+    """Format the file system with every candidate block size and write all the files, to measure the usage.
+
+    Args:
+        rom (GBAMicroPythonRom): The ROM loaded from the template.
+        file_list (list[FileItemPair]): File list.
+        compiled (dict[Path, bytes]): Compiled content for each source file.
+        candidates (list[int]): Block sizes to try.
+        options (dict[str, int]): Other LittleFS config.
+        extra_files (dict[PurePosixPath, bytes] | None): Generated files written with the file list.
+
+    Raises:
+        LFSConfigInvalidError: Every candidate breaks a rule of LittleFS with the other options.
+
+    Returns:
+        list[FsTrial]: Usage for each candidate, `error` is set if the files do not fit
+            or the block size does not work with the other options.
+    """
+    from littlefs import LittleFSError
+    content_size = 0
+    for item in file_list:
+        if not item.is_dir:
+            content_size += len(compiled[item.source]) if item.compile or item.convert or item.minify else item.source.stat().st_size
+    content_size += sum(len(content) for content in (extra_files or {}).values())
+    trials: list[FsTrial] = []
+    config_errors: list[str] = []
+    for block_size in candidates:
+        block_count = rom.fs_capacity // block_size
+        try:
+            rom.mkfs(block_size, **options)
+            __write_items(rom, file_list, compiled, extra_files=extra_files)
+        except LFSConfigInvalidError as e:
+            # a candidate not fitting the other options fails alone
+            trials.append(FsTrial(block_size, block_count, -1, -1, -1, str(e)))
+            config_errors.append(f"block_size={block_size}: {e}")
+            continue
+        except (LittleFSError, AssertionError, OSError) as e:
+            trials.append(FsTrial(block_size, block_count, -1, -1, -1, str(e)))
+            continue
+        used_blocks = rom.fs.used_block_count
+        used_bytes = used_blocks * block_size
+        trials.append(FsTrial(block_size, block_count, used_blocks, used_bytes, used_bytes - content_size, ""))
+    if config_errors and len(config_errors) == len(trials):
+        raise LFSConfigInvalidError("no candidate block size works with the other options, " + ", ".join(config_errors))
+    return trials
+
+def __choose_fs_trial(trials: list[FsTrial]):
+    # lowest usage, the larger block size wins a tie because it needs fewer reads
+    usable = [ t for t in trials if not t.error ]
+    if not usable:
+        raise LFSNoSpaceError(", ".join(f"block_size={t.block_size}: {t.error}" for t in trials))
+    return min(usable, key=lambda t: (t.used_bytes, -t.block_size))
+
+class __BuildPlan(NamedTuple):
+    cfg: ConfigSnapshot
+    manifest_path: Path
+    old_manifest: BuildManifest
+    manifest: BuildManifest
+    all_list: list[FileItemPair]
+    file_list: list[FileItemPair]
+    packed_list: list[FileItemPair]
+    dirs_removed: int
+    rom: 'GBAMicroPythonRom | None'
+    removed_targets: list[str]
+    changed_list: list[FileItemPair]
+    repack: bool
+    compile_list: list[FileItemPair]
+    reused: bool = False
+
+def __build_fingerprint(cfg: ConfigSnapshot, manifest: BuildManifest):
+    # the content of the inputs and how they are built, not where they are, so other machines get the same one
+    mpy_cross_version = ""
+    if (manifest.pack is not None and manifest.pack["key"].startswith("mpy-cross\0")) \
+        or any(entry["key"].startswith("mpy-cross\0") or entry["key"].startswith("pack\0mpy-cross\0") for entry in manifest.entries.values()):
+        from gba_mpy_tools.wrap_mpy_cross import MpyCross
+        mpy_cross_version = MpyCross(cfg).version()
+    # how this version of the tools writes the outputs, the same inputs make other bytes when they change
+    from gba_mpy_tools.minify import MINIFY_VERSION
+    from gba_mpy_tools.pack import ARCHIVE_VERSION, IMPORT_HOOK_TEMPLATE
+    data = {
+        "template": manifest.template["hash"],
+        "entries": { target: [ entry["is_dir"], entry["hash"], entry["key"] ] for target, entry in manifest.entries.items() },
+        "pack": manifest.pack,
+        "littlefs": [ cfg.littlefs_block_size, cfg.littlefs_block_size_candidates, cfg.littlefs_options ],
+        "patch": [ cfg.patch_format, str(cfg.patch_path) if cfg.patch_format else "" ],
+        "mpy-cross": mpy_cross_version,
+        "tools": {
+            "minify": MINIFY_VERSION,
+            "asset": ASSET_FORMAT_VERSION,
+            "archive": ARCHIVE_VERSION,
+            "import_hook": sha256(IMPORT_HOOK_TEMPLATE.encode("utf-8")).hexdigest(),
+        },
+    }
+    return sha256(json.dumps(data, sort_keys=True, default=dict).encode("utf-8")).hexdigest()
+
+def __plan_build(
+    cfg: ConfigSnapshot,
+    incremental: bool,
+    changed: set[Path] | None,
+    profiler: Profiler,
+    all_list: list[FileItemPair] | None = None,
+    force: bool = False,
+):
+    # find out what to compile, write and remove, the previous output is loaded for the incremental build
+    manifest_path = manifest_path_for(cfg.gba_output)
+    old_manifest = BuildManifest.load(manifest_path)
+    # with pruning, a change may make any other file reachable or not
+    if not (incremental and old_manifest.entries) or cfg.prune_enable:
+        changed = None
+    if changed is not None:
+        with profiler.span("update file list", "walk"):
+            all_list = __update_file_list(cfg, old_manifest, changed)
+    elif all_list is None:
+        all_list = list_files(cfg, profiler=profiler)
+    file_list, packed_list, dirs_removed = __split_packed(all_list, cfg)
+    manifest = BuildManifest()
+    with profiler.span("check changes", "manifest"):
+        manifest.template = stat_file(cfg.gba_template, old_manifest.template)
+        manifest.entries = __make_manifest_entries(file_list + packed_list, cfg, old_manifest, changed)
+        if packed_list:
+            manifest.pack = {
+                "archive": str(cfg.pack_archive), "hook": str(__import_hook_target(cfg)), "mount": cfg.pack_mount,
+                "key": __import_hook_key(cfg),
+            }
+            for item in packed_list:
+                entry = manifest.entries[str(item.target)]
+                entry["key"] = "pack\0" + entry["key"]
+    with profiler.span("fingerprint", "manifest"):
+        manifest.fingerprint = __build_fingerprint(cfg, manifest)
+    # a full build only reuses the output of a full build, so the bytes are the same as building it again
+    if not force and manifest.fingerprint == old_manifest.fingerprint and (incremental or old_manifest.reproducible) \
+        and old_manifest.is_output_matched(cfg.gba_output):
+        return __BuildPlan(
+            cfg, manifest_path, old_manifest, manifest, all_list, file_list, packed_list, dirs_removed,
+            None, [], [], False, [], True,
+        )
+    with profiler.span("load previous output", "rom"):
+        rom = __load_previous_output(cfg, old_manifest, manifest) if incremental else None
+    if rom is None:
+        removed_targets = []
+        changed_list = file_list
+        repack = bool(packed_list)
+    else:
+        old_entries = old_manifest.entries
+        new_entries = manifest.entries
+        removed_targets = [
+            target for target, entry in old_entries.items()
+            if target not in new_entries or new_entries[target]["is_dir"] != entry["is_dir"]
+            or (__is_packed_entry(new_entries[target]) and not __is_packed_entry(entry))
+        ]
+        changed_list = []
+        for item in file_list:
+            old_entry = old_entries.get(str(item.target))
+            new_entry = new_entries[str(item.target)]
+            if old_entry is None or old_entry["is_dir"] != new_entry["is_dir"] \
+                or old_entry["hash"] != new_entry["hash"] or old_entry["key"] != new_entry["key"]:
+                changed_list.append(item)
+        # the archive is rewritten as a whole if any packed module is changed, added or removed
+        packed_targets = { str(item.target) for item in packed_list }
+        repack = manifest.pack != old_manifest.pack \
+            or any(t not in old_entries or old_entries[t]["hash"] != new_entries[t]["hash"] \
+                or old_entries[t]["key"] != new_entries[t]["key"] for t in packed_targets) \
+            or any(__is_packed_entry(entry) and t not in packed_targets for t, entry in old_entries.items())
+        if old_manifest.pack is not None and manifest.pack != old_manifest.pack:
+            removed_targets.extend(
+                target for target in (old_manifest.pack["archive"], old_manifest.pack["hook"])
+                if manifest.pack is None or target not in (manifest.pack["archive"], manifest.pack["hook"])
+            )
+    compile_list = changed_list + (packed_list if repack else [])
+    return __BuildPlan(
+        cfg, manifest_path, old_manifest, manifest, all_list, file_list, packed_list, dirs_removed,
+        rom, removed_targets, changed_list, repack, compile_list,
+    )
+
+def __make_compilers(cfg: ConfigSnapshot, cache: BuildCache | None, profiler: Profiler):
+    from gba_mpy_tools.wrap_mpy_cross import MpyCross
+    from gba_mpy_tools.assets import AssetConverter
+    from gba_mpy_tools.minify import Minifier
+    return MpyCross(cfg, cache, profiler), AssetConverter(cfg, cache, profiler), Minifier(cfg, cache, profiler)
+
+def __assemble(
+    plan: __BuildPlan,
+    compiled: dict[Path, bytes],
+    cache: BuildCache | None,
+    profiler: Profiler,
+    import_hook: bytes | None = None,
+    measure_pack: bool = False,
+):
+    # build the littlefs file system in file list order, and save the ROM
+    from gba_mpy_tools.rom import GBAMicroPythonRom
+    from gba_mpy_tools.pack import make_archive
+    from littlefs import LittleFSError
+    cfg = plan.cfg
+    if plan.reused:
+        # keep the output, only record the new stats of the touched files
+        manifest = plan.manifest
+        manifest.geometry = plan.old_manifest.geometry
+        manifest.output = plan.old_manifest.output
+        manifest.reproducible = plan.old_manifest.reproducible
+        manifest.save(plan.manifest_path)
+        return BuildResult(
+            not manifest.reproducible, 0, 0, manifest.geometry["block_size"], [],
+            fingerprint=manifest.fingerprint, reused=True,
+        )
+    rom = plan.rom
+    is_incremental = rom is not None
+    try:
+        minified = [
+            MinifyResult(item.target, item.source.stat().st_size, len(compiled[item.source]))
+            for item in plan.compile_list if item.minify
+        ]
+        pack_files: dict[PurePosixPath, bytes] = {}
+        if plan.repack and plan.packed_list:
+            with profiler.span("pack", "pack"):
+                pack_files[cfg.pack_archive] = make_archive([
+                    (item.target.relative_to("/").as_posix(), __item_content(item, compiled)) for item in plan.packed_list
+                ])
+                pack_files[__import_hook_target(cfg)] = import_hook
+        fs_trials: list[FsTrial] = []
+        unpacked_blocks: int | None = None
+        if not is_incremental:
+            with profiler.span("load template", "rom"):
+                rom = GBAMicroPythonRom.load(cfg.gba_template, cache)
+            block_size = cfg.littlefs_block_size
+            if block_size == "auto":
+                with profiler.span("tune block size", "fs write"):
+                    fs_trials = tune_fs_block_size(rom, plan.file_list, compiled, cfg.littlefs_block_size_candidates, cfg.littlefs_options, pack_files)
+                block_size = __choose_fs_trial(fs_trials).block_size
+            if plan.packed_list and measure_pack:
+                # measure the usage without packing, to report the saving, it formats and writes the file system twice
+                with profiler.span("measure unpacked", "pack"):
+                    try:
+                        rom.mkfs(block_size, **cfg.littlefs_options)
+                        __write_items(rom, plan.all_list, compiled)
+                        unpacked_blocks = rom.fs.used_block_count
+                    except (LittleFSError, OSError):
+                        pass
+            with profiler.span("mkfs", "fs write"):
+                rom.mkfs(block_size, **cfg.littlefs_options)
+        # deepest first, so the children are removed before their parents
+        for target in sorted(plan.removed_targets, key=lambda t: len(PurePosixPath(t).parts), reverse=True):
+            with profiler.span("fs remove", "fs write", path=target):
+                try:
+                    rom.fs.remove(target, recursive=True)
+                except FileNotFoundError:
+                    pass
+        __write_items(rom, plan.changed_list, compiled, profiler, pack_files)
+        pack_result = None
+        if plan.packed_list:
+            bytes_change = (rom.fs.used_block_count - unpacked_blocks) * rom.fs_block_size if unpacked_blocks is not None else None
+            pack_result = PackResult(
+                len(plan.packed_list),
+                len(pack_files[cfg.pack_archive]) if pack_files else None,
+                plan.dirs_removed,
+                # the archive and the hook are added
+                2 - len(plan.packed_list) - plan.dirs_removed,
+                bytes_change,
+            )
+        with profiler.span("save", "save") as span:
+            save_result = rom.save(cfg.gba_output, cfg.patch_path if cfg.patch_format else None, cfg.patch_format)
+            span.args["copied"] = save_result.copied
+            span.args["written"] = save_result.written
+            if save_result.patch is not None:
+                span.args["patch"] = save_result.patch.size
+    finally:
+        if rom is not None:
+            rom.close()
+    # record the build
+    manifest = plan.manifest
+    manifest.geometry = { "block_size": rom.fs_block_size, "block_count": rom.fs_block_count, "options": dict(cfg.littlefs_options) }
+    output_st = Path(cfg.gba_output).resolve().stat()
+    manifest.output = { "path": str(Path(cfg.gba_output).resolve()), "size": output_st.st_size, "mtime_ns": output_st.st_mtime_ns, "hash": "" }
+    manifest.reproducible = not is_incremental
+    manifest.save(plan.manifest_path)
+    return BuildResult(
+        is_incremental, len(plan.changed_list) + len(pack_files), len(plan.removed_targets),
+        rom.fs_block_size, fs_trials, pack_result, minified, save_result.patch, manifest.fingerprint,
+    )
+
+def build(
+    cfg: Config,
+    jobs: int | None = None,
+    incremental: bool = False,
+    changed: set[Path] | None = None,
+    profiler: Profiler = NO_PROFILER,
+    force: bool = False,
+    measure_pack: bool = False,
+):
+    """Build the ROM with files.
+
+    Args:
+        cfg (Config): Config info object.
+        jobs (int | None): Max parallel mpy-cross processes, default is the CPU count.
+        incremental (bool): Update the LittleFS file system in the previous output ROM
+            with the changed files only, instead of formatting a new one.
+            Fall back to full rebuild if the template or the block geometry changed.
+        changed (set[Path] | None): Resolved source paths changed since the last build, used
+            with `incremental` to skip walking and checking the whole source dir.
+            None means unknown.
+        profiler (Profiler): Record the build phases.
+        force (bool): Build even if the fingerprint of the inputs is the same as the last build.
+            Otherwise the output is kept as it is, if it is not changed since then, and it is a full build
+            or `incremental` is set. The fingerprint is saved in the manifest.
+        measure_pack (bool): With `[pack]`, also format and write the file system without packing on full builds,
+            to report the ROM bytes saved by packing. It doubles the time of writing the file system.
+
+    Returns:
+        BuildResult: Build mode and the count of written and removed files.
+    """
+    cfg = cfg.freeze()
+    cache = open_build_cache(cfg)
+    plan = None
+    try:
+        plan = __plan_build(cfg, incremental, changed, profiler, force=force)
+        mpy_cross, asset_converter, minifier = __make_compilers(cfg, cache, profiler)
+        with profiler.span("compile stage", "compile"):
+            compiled = compile_files(plan.compile_list, mpy_cross, jobs, profiler, asset_converter, minifier, cfg.build_memory_limit)
+            import_hook = __make_import_hook(cfg, mpy_cross, minifier) if plan.repack and plan.packed_list else None
+        return __assemble(plan, compiled, cache, profiler, import_hook, measure_pack)
+    finally:
+        if plan is not None and plan.rom is not None:
+            plan.rom.close()
+        if cache is not None:
+            cache.flush()
+
+def __assemble_in_worker(
+    plan: __BuildPlan,
+    incremental: bool,
+    compiled: dict[Path, bytes],
+    import_hook: bytes | None,
+    measure_pack: bool,
+    profile: bool,
+):
+    # run in a worker process, LittleFS calls back into python and holds the GIL, so threads assemble one at a time,
+    # everything passed in and out is plain data, the previous output is mapped again here
+    from traceback import format_exc
+    cfg = plan.cfg
+    profiler = Profiler(enabled=profile)
+    cache = open_build_cache(cfg)
+    try:
+        with profiler.span("assemble", "variant", variant=cfg.variant_name):
+            if incremental:
+                rom = __load_previous_output(cfg, plan.old_manifest, plan.manifest)
+                if rom is None:
+                    raise OutputChangedError(cfg.gba_output)
+                plan = plan._replace(rom=rom)
+            try:
+                result = __assemble(plan, compiled, cache, profiler, import_hook, measure_pack)
+            finally:
+                if plan.rom is not None:
+                    plan.rom.close()
+        return result, profiler.export_spans(), None
+    except Exception as e:
+        # the errors of this package can not be rebuilt by pickle from their message
+        return None, profiler.export_spans(), (type(e), e.args, format_exc())
+    finally:
+        if cache is not None:
+            cache.flush()
+
+def __rebuild_error(error_type: type[Exception], args: tuple, remote_traceback: str):
+    error = error_type.__new__(error_type)
+    error.args = args
+    error.add_note(f"In the worker process:\n{remote_traceback}")
+    return error
+
+def __walk_key(cfg: ConfigSnapshot):
+    # everything but the target dir that changes the file list
+    return (
+        cfg.project_source_dir,
+        cfg.project_ignore_pattern,
+        cfg.mpy_cross_compile,
+        cfg.mpy_cross_ignore_pattern,
+        json.dumps(cfg.asset_rules, sort_keys=True, default=dict),
+        cfg.minify_enable,
+        cfg.minify_ignore_pattern,
+        cfg.prune_enable,
+        # the imports are resolved in the ROM
+        (cfg.prune_roots, cfg.prune_keep, cfg.prune_search_path, cfg.project_target_dir) if cfg.prune_enable else None,
+    )
+
+def __shared_walk(cfg: ConfigSnapshot, walks: dict[tuple, tuple[PurePosixPath, list[FileItemPair]]], profiler: Profiler):
+    key = __walk_key(cfg)
+    if key not in walks:
+        walks[key] = (cfg.project_target_dir, list_files(cfg, profiler=profiler))
+    target_dir, all_list = walks[key]
+    if target_dir == cfg.project_target_dir:
+        return all_list
+    return [ item._replace(target=cfg.project_target_dir.joinpath(item.target.relative_to(target_dir))) for item in all_list ]
+
+def __compile_key(item: FileItemPair, cfg: ConfigSnapshot):
+    # the same output for the same key, whichever variant it is compiled for
+    return (item.source, __item_key(item, cfg), str(cfg.mpy_cross_path) if item.compile else "")
+
+def build_variants(
+    cfgs: list[Config],
+    jobs: int | None = None,
+    incremental: bool = False,
+    profiler: Profiler = NO_PROFILER,
+    force: bool = False,
+    measure_pack: bool = False,
+):
+    """Build several ROM variants in one pass.
+
+    The source dir is walked once for the variants with the same file list (the target dir may differ),
+    and every file is compiled once for the variants compiling it the same way.
+    Then the file systems of the variants are assembled and saved in parallel, in worker processes.
+
+    Args:
+        cfgs (list[Config]): Config of each variant, see `Config.variants`.
+        jobs (int | None): Max parallel mpy-cross processes and assembling variants, default is the CPU count.
+        incremental (bool): Update the previous output ROM of each variant, see `build`.
+        profiler (Profiler): Record the build phases.
+        force (bool): Build even if the fingerprint is not changed, see `build`.
+        measure_pack (bool): Report the ROM bytes saved by packing, see `build`.
+
+    Raises:
+        VariantOutputConflictError: Two variants have the same output ROM.
+        CompileError: One or more files failed to compile.
+
+    Returns:
+        list[BuildResult]: Result of each variant, in the same order.
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    snapshots = [ cfg.freeze() for cfg in cfgs ]
+    outputs = [ Path(cfg.gba_output).resolve() for cfg in snapshots ]
+    for i, output in enumerate(outputs):
+        if output in outputs[:i]:
+            raise VariantOutputConflictError(output)
+    caches: dict[tuple, BuildCache | None] = {}
+    def cache_for(cfg: ConfigSnapshot):
+        key = (cfg.cache_enable, cfg.cache_dir, cfg.cache_max_size)
+        if key not in caches:
+            caches[key] = open_build_cache(cfg)
+        return caches[key]
+    walks: dict[tuple, tuple[PurePosixPath, list[FileItemPair]]] = {}
+    plans: list[__BuildPlan] = []
+    try:
+        for cfg in snapshots:
+            with profiler.span("plan", "variant", variant=cfg.variant_name):
+                plans.append(__plan_build(cfg, incremental, None, profiler, __shared_walk(cfg, walks, profiler), force))
+        # compile each distinct job once, with the tools of the first variant needing it,
+        # the variants compiling differently share the jobs and run at the same time
+        groups: list[tuple[ConfigSnapshot, dict[tuple, FileItemPair]]] = []
+        claimed: set[tuple] = set()
+        for cfg, plan in zip(snapshots, plans):
+            todo: dict[tuple, FileItemPair] = {}
+            for item in plan.compile_list:
+                key = __compile_key(item, cfg)
+                if (not item.is_dir) and key not in claimed:
+                    todo[key] = item
+                    claimed.add(key)
+            if todo:
+                groups.append((cfg, todo))
+        total_jobs = jobs if jobs is not None and jobs > 0 else (cpu_count() or 1)
+        total_items = sum(len(todo) for _, todo in groups)
+        def compile_group(cfg: ConfigSnapshot, todo: dict[tuple, FileItemPair]):
+            mpy_cross, asset_converter, minifier = __make_compilers(cfg, cache_for(cfg), profiler)
+            # the jobs and the memory limit are split by the group size
+            share = len(todo) / max(1, total_items)
+            group_jobs = max(1, int(total_jobs * share))
+            memory_limit = max(1, int(cfg.build_memory_limit * share)) if cfg.build_memory_limit > 0 else 0
+            compiled = compile_files(list(todo.values()), mpy_cross, group_jobs, profiler, asset_converter, minifier, memory_limit)
+            return { key: compiled[item.source] for key, item in todo.items() if item.source in compiled }
+        results: dict[tuple, bytes] = {}
+        with profiler.span("compile stage", "compile"):
+            if len(groups) == 1:
+                results.update(compile_group(*groups[0]))
+            elif groups:
+                with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                    for group_results in executor.map(lambda group: compile_group(*group), groups):
+                        results.update(group_results)
+        variant_compiled = [
+            { item.source: results[key] for item in plan.compile_list if (key := __compile_key(item, cfg)) in results }
+            for cfg, plan in zip(snapshots, plans)
+        ]
+        import_hooks: list[bytes | None] = []
+        for cfg, plan in zip(snapshots, plans):
+            if plan.repack and plan.packed_list:
+                mpy_cross, _, minifier = __make_compilers(cfg, cache_for(cfg), profiler)
+                import_hooks.append(__make_import_hook(cfg, mpy_cross, minifier))
+            else:
+                import_hooks.append(None)
+        results: list[BuildResult | None] = [ None ] * len(plans)
+        # the reused outputs are only recorded, a single variant or CPU is not worth starting the processes
+        remote = [ i for i, plan in enumerate(plans) if not plan.reused ]
+        if len(remote) <= 1 or total_jobs <= 1:
+            remote = []
+        for i, plan in enumerate(plans):
+            if i not in remote:
+                with profiler.span("assemble", "variant", variant=snapshots[i].variant_name):
+                    results[i] = __assemble(plan, variant_compiled[i], cache_for(snapshots[i]), profiler, import_hooks[i], measure_pack)
+        if remote:
+            with ProcessPoolExecutor(max_workers=min(len(remote), total_jobs)) as executor:
+                futures = {}
+                for i in remote:
+                    incremental_plan = plans[i].rom is not None
+                    if incremental_plan:
+                        # the worker maps the previous output by itself
+                        plans[i].rom.close()
+                        plans[i] = plans[i]._replace(rom=None)
+                    futures[i] = executor.submit(
+                        __assemble_in_worker, plans[i], incremental_plan, variant_compiled[i], import_hooks[i],
+                        measure_pack, profiler.enabled,
+                    )
+                errors = []
+                for i, future in futures.items():
+                    result, spans, error = future.result()
+                    profiler.merge_spans(spans)
+                    results[i] = result
+                    if error is not None:
+                        errors.append(error)
+                if errors:
+                    raise __rebuild_error(*errors[0])
+        return results
+    finally:
+        for plan in plans:
+            if plan.rom is not None:
+                plan.rom.close()
+        for cache in caches.values():
+            if cache is not None:
+                cache.flush()
+
+EMITTERS = ("bytecode", "native", "viper")
+
+class EmitterReportRow(NamedTuple):
+    target: PurePosixPath
+    source_size: int
+    emitter: str
+    # None if it failed to compile with the emitter
+    sizes: dict[str, int | None]
+    seconds: dict[str, float]
+    errors: dict[str, str]
+
+def __current_emitter(params: list[str]):
+    emitter = "bytecode"
+    for i, param in enumerate(params):
+        option = params[i + 1] if param == "-X" and i + 1 < len(params) else param.removeprefix("-X")
+        if option.startswith("emit="):
+            emitter = option.removeprefix("emit=")
+    return emitter
+
+def __emitter_params(params: list[str], emitter: str, march: str):
+    # the file's own params with the emitter replaced, and the arch for the native code,
+    # the bytecode keeps its own arch for the @micropython.native functions
+    out: list[str] = []
+    skip = False
+    for i, param in enumerate(params):
+        if skip:
+            skip = False
+            continue
+        if param == "-X" and i + 1 < len(params) and params[i + 1].startswith("emit="):
+            skip = True
+            continue
+        if param.startswith("-Xemit=") or (emitter != "bytecode" and param.startswith("-march=")):
+            continue
+        out.append(param)
+    out.extend([ "-X", f"emit={emitter}" ])
+    if emitter != "bytecode":
+        out.append(f"-march={march}")
+    return out
+
+def emitter_report(
+    cfg: Config,
+    emitters: tuple[str, ...] = EMITTERS,
+    march: str = "armv6m",
+    jobs: int | None = None,
+    profiler: Profiler = NO_PROFILER,
+):
+    """Compile every module with each emitter, to compare the .mpy sizes before choosing the overrides.
+
+    Each file keeps its own params (the matching `[[mpy-cross.overrides]]` or `[mpy-cross] params`),
+    only the emitter is replaced, with `-march` for the native emitters. The outputs are cached like the build.
+
+    Args:
+        cfg (Config): Config info object.
+        emitters (tuple[str, ...]): The mpy-cross emitters compared.
+        march (str): The arch of the native code.
+        jobs (int | None): Max parallel mpy-cross processes, default is the CPU count.
+        profiler (Profiler): Record the compiling of each file and emitter.
+
+    Returns:
+        list[EmitterReportRow]: One row per compiled module, in the walk order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from gba_mpy_tools.wrap_mpy_cross import MpyCross
+    from time import perf_counter
+    cfg = cfg.freeze()
+    items = [ item for item in list_files(cfg, profiler=profiler) if item.compile ]
+    if jobs is None or jobs <= 0:
+        jobs = cpu_count() or 1
+    cache = open_build_cache(cfg)
+    try:
+        mpy_cross = MpyCross(cfg, cache, profiler)
+        def compile_one(item: FileItemPair, emitter: str):
+            params = __emitter_params(cfg.find_mpy_cross_params(item.source), emitter, march)
+            start = perf_counter()
+            try:
+                with profiler.span(f"emit={emitter}", "compile", file=item.source):
+                    return len(mpy_cross.compile(item.source, params)), perf_counter() - start, ""
+            except CompileError as e:
+                return None, perf_counter() - start, e.output.strip()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                (item, { emitter: executor.submit(compile_one, item, emitter) for emitter in emitters })
+                for item in items
+            ]
+            rows: list[EmitterReportRow] = []
+            for item, results in futures:
+                row = EmitterReportRow(
+                    item.target,
+                    item.source.stat().st_size,
+                    __current_emitter(cfg.find_mpy_cross_params(item.source)),
+                    dict(), dict(), dict(),
+                )
+                for emitter, future in results.items():
+                    size, seconds, error = future.result()
+                    row.sizes[emitter] = size
+                    row.seconds[emitter] = seconds
+                    if error:
+                        row.errors[emitter] = error
+                rows.append(row)
+            return rows
+    finally:
+        if cache is not None:
+            cache.flush()
 
 def run(cfg: Config):
     """Build GBA ROM and run with emulator
@@ -113,5 +1237,6 @@ def run(cfg: Config):
     Args:
         cfg (Config): Config info object.
     """
+    from gba_mpy_tools.wrap_gba_emulator import GBAEmulator
     gba_emu = GBAEmulator(cfg)
     gba_emu.run(cfg.gba_output)
@@ -0,0 +1,385 @@
+from gba_mpy_tools.config import Config, AssetRuleDict, parse_script_module_and_function
+from gba_mpy_tools.errors import FileNotFoundError, CompileError
+from gba_mpy_tools.cache import BuildCache, hash_key
+from gba_mpy_tools.profiler import Profiler, NO_PROFILER
+from gba_mpy_tools.manifest import hash_file
+from pathlib import Path
+from struct import pack, unpack_from, error as StructError
+from sys import path as import_path
+from importlib import import_module
+from importlib.util import find_spec
+from typing import Callable
+import json
+import zlib
+import io
+
+# bump it when the output of a built-in converter changes, to invalidate the cache and the built assets
+ASSET_FORMAT_VERSION = 1
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+IMAGE_MAGIC = b"GBAI"
+SOUND_MAGIC = b"GBAS"
+
+class AssetFormatError(ValueError):
+    pass
+
+def rgb_to_bgr555(r: int, g: int, b: int):
+    return (r >> 3) | ((g >> 3) << 5) | ((b >> 3) << 10)
+
+def __paeth(a: int, b: int, c: int):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    if pb <= pc:
+        return b
+    return c
+
+def __unfilter_png(raw: bytes, height: int, stride: int, pixel_bytes: int):
+    rows: list[bytearray] = []
+    prev = bytearray(stride)
+    pos = 0
+    for _ in range(height):
+        if pos + 1 + stride > len(raw):
+            raise AssetFormatError("PNG image data is truncated")
+        filter_type = raw[pos]
+        row = bytearray(raw[pos + 1: pos + 1 + stride])
+        pos += 1 + stride
+        if filter_type == 1:
+            for i in range(pixel_bytes, stride):
+                row[i] = (row[i] + row[i - pixel_bytes]) & 0xFF
+        elif filter_type == 2:
+            row = bytearray((x + y) & 0xFF for x, y in zip(row, prev))
+        elif filter_type == 3:
+            for i in range(stride):
+                left = row[i - pixel_bytes] if i >= pixel_bytes else 0
+                row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif filter_type == 4:
+            for i in range(stride):
+                left = row[i - pixel_bytes] if i >= pixel_bytes else 0
+                up_left = prev[i - pixel_bytes] if i >= pixel_bytes else 0
+                row[i] = (row[i] + __paeth(left, prev[i], up_left)) & 0xFF
+        elif filter_type != 0:
+            raise AssetFormatError(f"unknown PNG filter type {filter_type}")
+        rows.append(row)
+        prev = row
+    return rows
+
+def __unpack_samples(row: bytearray, count: int, depth: int):
+    # split a row into samples, 16 bit samples keep the high byte only
+    if depth == 8:
+        return list(row[:count])
+    if depth == 16:
+        return list(row[0:count * 2:2])
+    per_byte = 8 // depth
+    mask = (1 << depth) - 1
+    samples = []
+    for i in range(count):
+        shift = 8 - depth * (i % per_byte + 1)
+        samples.append((row[i // per_byte] >> shift) & mask)
+    return samples
+
+def decode_png(data: bytes):
+    """Decode a non-interlaced PNG image.
+
+    Args:
+        data (bytes): PNG file content.
+
+    Raises:
+        AssetFormatError: The image is broken or not supported.
+
+    Returns:
+        tuple[int, int, list[int] | None, list[int]]:
+            (width, height, palette, pixels). For indexed images `palette` is the BGR555 colors
+            and `pixels` is the indexes, otherwise `palette` is None and `pixels` is BGR555 colors,
+            with -1 for transparent pixels.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise AssetFormatError("not a PNG file")
+    pos = len(PNG_SIGNATURE)
+    header = None
+    plte = b""
+    trns = b""
+    idat = []
+    while pos + 8 <= len(data):
+        length, chunk_type = unpack_from(">I4s", data, pos)
+        chunk = data[pos + 8: pos + 8 + length]
+        crc, = unpack_from(">I", data, pos + 8 + length)
+        if zlib.crc32(chunk, zlib.crc32(chunk_type)) != crc:
+            raise AssetFormatError(f"bad CRC in PNG chunk {chunk_type!r}")
+        pos += 12 + length
+        if chunk_type == b"IHDR":
+            header = unpack_from(">IIBBBBB", chunk)
+        elif chunk_type == b"PLTE":
+            plte = chunk
+        elif chunk_type == b"tRNS":
+            trns = chunk
+        elif chunk_type == b"IDAT":
+            idat.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+    if header is None:
+        raise AssetFormatError("missing PNG header")
+    width, height, depth, color_type, _, _, interlace = header
+    if interlace != 0:
+        raise AssetFormatError("interlaced PNG is not supported")
+    channels = { 0: 1, 2: 3, 3: 1, 4: 2, 6: 4 }.get(color_type)
+    if channels is None or depth not in (1, 2, 4, 8, 16) or (channels > 1 and depth < 8) or (color_type == 3 and depth > 8):
+        raise AssetFormatError(f"PNG color type {color_type} with bit depth {depth} is not supported")
+    stride = (width * channels * depth + 7) // 8
+    rows = __unfilter_png(zlib.decompress(b"".join(idat)), height, stride, max(1, channels * depth // 8))
+    if color_type == 3:
+        palette = [ rgb_to_bgr555(*plte[i:i + 3]) for i in range(0, len(plte) - 2, 3) ]
+        pixels = []
+        for row in rows:
+            pixels.extend(__unpack_samples(row, width, depth))
+        return width, height, palette, pixels
+    # scale to 8 bit
+    scale = 255 // ((1 << depth) - 1) if depth < 8 else 1
+    transparent_key = None
+    if trns and color_type == 0:
+        transparent_key = (unpack_from(">H", trns)[0] >> (depth - 8 if depth == 16 else 0)) * scale
+    elif trns and color_type == 2:
+        key = unpack_from(">HHH", trns)
+        transparent_key = tuple(v >> 8 for v in key) if depth == 16 else key
+    pixels = []
+    for row in rows:
+        samples = __unpack_samples(row, width * channels, depth)
+        for i in range(0, len(samples), channels):
+            if color_type in (0, 4):
+                r = g = b = samples[i] * scale
+                opaque = samples[i + 1] >= 128 if color_type == 4 else samples[i] * scale != transparent_key
+            else:
+                r, g, b = samples[i:i + 3]
+                opaque = samples[i + 3] >= 128 if color_type == 6 else (r, g, b) != transparent_key
+            pixels.append(rgb_to_bgr555(r, g, b) if opaque else -1)
+    return width, height, None, pixels
+
+def convert_png(data: bytes, options: dict):
+    """Convert a PNG image to GBA tiles and a BGR555 palette.
+
+    Index 0 of the palette is the transparent color. Indexed images keep their indexes,
+    other images get a palette made from their colors in order of appearance.
+
+    Options:
+        bpp (int): 4 or 8 bits per pixel, default 4.
+        transparent (str): "#rrggbb" color of index 0, default "#000000".
+
+    Output layout, little endian:
+        "GBAI", bpp (u8), 0 (u8), width (u16), height (u16), palette count (u16),
+        palette (u16 * palette count, padded to an even count), 8x8 tiles in row-major order.
+
+    Raises:
+        AssetFormatError: The image can not be converted.
+    """
+    bpp = options.get("bpp", 4)
+    if bpp not in (4, 8):
+        raise AssetFormatError(f"bpp must be 4 or 8, got {bpp}")
+    transparent = options.get("transparent", "#000000").lstrip("#")
+    transparent_color = rgb_to_bgr555(*bytes.fromhex(transparent))
+    width, height, palette, pixels = decode_png(data)
+    if width % 8 != 0 or height % 8 != 0:
+        raise AssetFormatError(f"image size {width}x{height} is not a multiple of 8")
+    max_colors = 1 << bpp
+    if palette is None:
+        color_index: dict[int, int] = { -1: 0 }
+        palette = [ transparent_color ]
+        indexes = []
+        for color in pixels:
+            index = color_index.get(color)
+            if index is None:
+                index = color_index[color] = len(palette)
+                palette.append(color)
+            indexes.append(index)
+        if len(palette) > max_colors:
+            raise AssetFormatError(f"{len(palette) - 1} colors do not fit in {bpp}bpp, at most {max_colors - 1}")
+        pixels = indexes
+    else:
+        if pixels and max(pixels) >= max_colors:
+            raise AssetFormatError(f"palette index {max(pixels)} does not fit in {bpp}bpp")
+        palette = palette[:max_colors]
+    if len(palette) % 2 != 0:
+        palette.append(0)
+    out = bytearray(pack("<4sBBHHH", IMAGE_MAGIC, bpp, 0, width, height, len(palette)))
+    out += pack(f"<{len(palette)}H", *palette)
+    for ty in range(0, height, 8):
+        for tx in range(0, width, 8):
+            for y in range(ty, ty + 8):
+                line = pixels[y * width + tx: y * width + tx + 8]
+                if bpp == 8:
+                    out += bytes(line)
+                else:
+                    # low nibble is the left pixel
+                    out += bytes(line[i] | (line[i + 1] << 4) for i in range(0, 8, 2))
+    return bytes(out)
+
+def convert_wav(data: bytes, options: dict):
+    """Convert a PCM WAV file to signed 8 bit mono samples.
+
+    Options:
+        rate (int): Resample to this sample rate, 0 keeps the original rate, default 0.
+
+    Output layout, little endian:
+        "GBAS", sample rate (u32), sample count (u32), samples (s8 * sample count).
+
+    Raises:
+        AssetFormatError: The sound can not be converted.
+    """
+    import wave
+    try:
+        with wave.open(io.BytesIO(data), "rb") as w:
+            channels = w.getnchannels()
+            width = w.getsampwidth()
+            rate = w.getframerate()
+            frames = w.readframes(w.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise AssetFormatError(f"bad WAV file: {e}")
+    # take the high byte of each sample as signed 8 bit
+    if width == 1:
+        samples = [ v - 128 for v in frames ]
+    else:
+        samples = [ v - 256 if v >= 128 else v for v in frames[width - 1::width] ]
+    if channels > 1:
+        samples = [ sum(samples[i:i + channels]) // channels for i in range(0, len(samples) - channels + 1, channels) ]
+    target_rate = options.get("rate", 0)
+    if target_rate and target_rate != rate and samples:
+        # linear interpolation
+        count = len(samples) * target_rate // rate
+        step = rate / target_rate
+        resampled = []
+        last = len(samples) - 1
+        for i in range(count):
+            pos = i * step
+            left = int(pos)
+            right = min(left + 1, last)
+            frac = pos - left
+            resampled.append(round(samples[left] * (1 - frac) + samples[right] * frac))
+        samples = resampled
+        rate = target_rate
+    return pack("<4sII", SOUND_MAGIC, rate, len(samples)) + bytes(v & 0xFF for v in samples)
+
+CONVERTERS: dict[str, Callable[[bytes, dict], bytes]] = {
+    "png": convert_png,
+    "wav": convert_wav,
+}
+CONVERTER_SUFFIXES = {
+    "png": ".img",
+    "wav": ".pcm",
+}
+
+def asset_target_suffix(rule: AssetRuleDict):
+    """Get the suffix of the converted file.
+
+    Args:
+        rule (AssetRuleDict): The asset rule.
+
+    Returns:
+        str: The suffix set in the rule, or the default one of the converter.
+    """
+    return rule["suffix"] or CONVERTER_SUFFIXES.get(rule["converter"], ".bin")
+
+# content hash of each converter script, by (path, size, mtime_ns)
+__script_hashes: dict[tuple[str, int, int], str] = {}
+
+def converter_identity(cfg: Config, name: str):
+    """Identify how a converter makes its output, for the cache key and the build manifest.
+
+    It is the name and `ASSET_FORMAT_VERSION`, and for a "module:function" converter
+    also the content hash of its script. The script is found without importing it.
+
+    Args:
+        cfg (Config): Config info object, the scripts are imported from the config dir.
+        name (str): The converter in the asset rule.
+
+    Returns:
+        str: The identity, changed when the converter output may change.
+    """
+    identity = f"{name}\0{ASSET_FORMAT_VERSION}"
+    if name in CONVERTERS:
+        return identity
+    module_name, _ = parse_script_module_and_function(name)
+    if str(cfg.config_file_dir) not in import_path:
+        import_path.append(str(cfg.config_file_dir))
+    try:
+        spec = find_spec(module_name)
+    except (ImportError, ValueError):
+        # reported when converting
+        return identity
+    if spec is None or spec.origin is None or not Path(spec.origin).is_file():
+        return identity
+    script = Path(spec.origin).resolve()
+    st = script.stat()
+    key = (str(script), st.st_size, st.st_mtime_ns)
+    if key not in __script_hashes:
+        __script_hashes[key] = hash_file(script)
+    return f"{identity}\0{__script_hashes[key]}"
+
+class AssetConverter():
+    def __init__(self, cfg: Config, cache: BuildCache | None = None, profiler: Profiler = NO_PROFILER):
+        self.__cfg = cfg
+        self.__cache = cache
+        self.__profiler = profiler
+        self.__converters: dict[str, tuple[Callable[[bytes, dict], bytes], str]] = {}
+
+    def __get_converter(self, name: str):
+        # built-in converters by name, or "module:function" from the config dir
+        if name not in self.__converters:
+            if name in CONVERTERS:
+                self.__converters[name] = (CONVERTERS[name], converter_identity(self.__cfg, name))
+            else:
+                module_name, func_name = parse_script_module_and_function(name)
+                if str(self.__cfg.config_file_dir) not in import_path:
+                    import_path.append(str(self.__cfg.config_file_dir))
+                func = getattr(import_module(module_name), func_name or "convert", None)
+                if not callable(func):
+                    raise AssetFormatError(f"asset converter '{name}' is not found")
+                # the converter script is part of the cache key
+                self.__converters[name] = (func, converter_identity(self.__cfg, name))
+        return self.__converters[name]
+
+    def convert(self, source: str | Path, rule: AssetRuleDict | None = None):
+        """Convert an asset file, return converted content.
+
+        Args:
+            source (str | Path): The source file.
+            rule (AssetRuleDict | None): The asset rule, default is the one matched by the source file.
+
+        Raises:
+            CompileError: The converter failed.
+
+        Returns:
+            bytes: Converted content.
+        """
+        if not isinstance(source, Path):
+            source = Path(source)
+        if not source.exists():
+            raise FileNotFoundError(source)
+        if rule is None:
+            rule = self.__cfg.find_asset_rule(source)
+            if rule is None:
+                raise CompileError(source, "no asset rule matches the file")
+        with open(source, "rb") as f:
+            source_content = f.read()
+        try:
+            func, identity = self.__get_converter(rule["converter"])
+        except (ImportError, AssetFormatError) as e:
+            raise CompileError(source, str(e))
+        options = rule["options"]
+        cache_key = ""
+        if self.__cache is not None:
+            with self.__profiler.span("cache lookup", "cache", source=source) as span:
+                cache_key = hash_key("asset", identity, json.dumps(options, sort_keys=True, default=dict), source_content)
+                data = self.__cache.get(cache_key)
+                span.name = "cache miss" if data is None else "cache hit"
+            if data is not None:
+                return data
+        with self.__profiler.span(rule["converter"], "convert", source=source):
+            try:
+                data = func(source_content, options)
+            except (ValueError, StructError, zlib.error) as e:
+                raise CompileError(source, f"{rule['converter']}: {e}")
+        if self.__cache is not None:
+            self.__cache.put(cache_key, data)
+        return data
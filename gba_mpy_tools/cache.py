@@ -0,0 +1,198 @@
+from pathlib import Path
+from hashlib import sha256
+from threading import Lock, get_ident
+from os import environ, replace, scandir, utime, getpid
+from shutil import rmtree
+import json
+
+DEFAULT_CACHE_MAX_SIZE = 256 * 1024 * 1024
+OBJECTS_DIRNAME = "objects"
+STATS_FILENAME = "stats.json"
+
+def default_cache_dir():
+    """Get the default cache dir, following XDG_CACHE_HOME if it is set.
+
+    Returns:
+        Path: The cache dir.
+    """
+    xdg_cache = environ.get("XDG_CACHE_HOME", "")
+    base = Path(xdg_cache) if xdg_cache else Path.home().joinpath(".cache")
+    return base.joinpath("gba_mpy_tools")
+
+def hash_key(*parts: bytes | str):
+    """Build a cache key from several parts.
+
+    Every part is length-prefixed, so ("ab", "c") and ("a", "bc") give different keys.
+
+    Returns:
+        str: hex digest used as the cache key.
+    """
+    h = sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+class BuildCache():
+    """Content-addressed on-disk cache with size-bounded LRU eviction.
+
+    Entries are stored as `objects/<key[:2]>/<key>`, the mtime of an entry is
+    refreshed on every hit, and the oldest entries are evicted on `flush`
+    once the total size exceeds `max_size`.
+    """
+    def __init__(self, cache_dir: str | Path, max_size: int = DEFAULT_CACHE_MAX_SIZE):
+        self.__dir = Path(cache_dir)
+        self.__max_size = max_size
+        self.__lock = Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__written = 0
+
+    @property
+    def cache_dir(self):
+        return self.__dir
+
+    @property
+    def max_size(self):
+        return self.__max_size
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
+
+    def __object_path(self, key: str):
+        return self.__dir.joinpath(OBJECTS_DIRNAME, key[:2], key)
+
+    def get(self, key: str):
+        """Get the cached content.
+
+        Args:
+            key (str): The cache key, see `hash_key`.
+
+        Returns:
+            bytes | None: The cached content, None if missed.
+        """
+        opath = self.__object_path(key)
+        try:
+            with open(opath, "rb") as f:
+                data = f.read()
+            utime(opath)
+        except OSError:
+            with self.__lock:
+                self.__misses += 1
+            return None
+        with self.__lock:
+            self.__hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store content into the cache.
+
+        Args:
+            key (str): The cache key, see `hash_key`.
+            data (bytes): The content.
+        """
+        opath = self.__object_path(key)
+        opath.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temp file then rename, readers never see partial content,
+        # per thread too, the variants are assembled in parallel and may put the same template
+        tpath = opath.with_name(f"{key}.{getpid()}.{get_ident()}.tmp")
+        with open(tpath, "wb") as f:
+            f.write(data)
+        replace(tpath, opath)
+        with self.__lock:
+            self.__written += len(data)
+
+    def __list_objects(self):
+        objects: list[tuple[float, int, str]] = []
+        try:
+            buckets = list(scandir(self.__dir.joinpath(OBJECTS_DIRNAME)))
+        except OSError:
+            return objects
+        for bucket in buckets:
+            if not bucket.is_dir():
+                continue
+            with scandir(bucket.path) as it:
+                for entry in it:
+                    st = entry.stat()
+                    objects.append((st.st_mtime, st.st_size, entry.path))
+        return objects
+
+    def __load_stats(self):
+        try:
+            with open(self.__dir.joinpath(STATS_FILENAME), "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {}
+        return { "hits": int(stats.get("hits", 0)), "misses": int(stats.get("misses", 0)) }
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_size`.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        objects = self.__list_objects()
+        total = sum(size for _, size, _ in objects)
+        removed = 0
+        if total <= self.__max_size:
+            return removed
+        objects.sort()
+        for _, size, opath in objects:
+            if total <= self.__max_size:
+                break
+            Path(opath).unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def flush(self):
+        """Persist the hit/miss counters, and evict old entries if anything was written."""
+        with self.__lock:
+            hits, misses, written = self.__hits, self.__misses, self.__written
+            self.__hits = self.__misses = self.__written = 0
+        if hits == 0 and misses == 0 and written == 0:
+            return
+        self.__dir.mkdir(parents=True, exist_ok=True)
+        stats = self.__load_stats()
+        stats["hits"] += hits
+        stats["misses"] += misses
+        spath = self.__dir.joinpath(STATS_FILENAME)
+        tpath = spath.with_name(f"{STATS_FILENAME}.{getpid()}.tmp")
+        with open(tpath, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+        replace(tpath, spath)
+        if written > 0:
+            self.evict()
+
+    def stats(self):
+        """Collect the cache statistics.
+
+        Returns:
+            dict: entries, size, max_size, hits, misses and hit_rate.
+        """
+        objects = self.__list_objects()
+        stats = self.__load_stats()
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "dir": str(self.__dir),
+            "entries": len(objects),
+            "size": sum(size for _, size, _ in objects),
+            "max_size": self.__max_size,
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+            "hit_rate": (stats["hits"] / lookups) if lookups > 0 else 0.0,
+        }
+
+    def clear(self):
+        """Remove all the cached entries and statistics."""
+        rmtree(self.__dir.joinpath(OBJECTS_DIRNAME), ignore_errors=True)
+        self.__dir.joinpath(STATS_FILENAME).unlink(missing_ok=True)
+        with self.__lock:
+            self.__hits = self.__misses = self.__written = 0
@@ -2,8 +2,69 @@ import sys
 # the real import begin
 from argparse import ArgumentParser
 from os import chdir
+from pathlib import Path
+from typing import TYPE_CHECKING
 from gba_mpy_tools.config import Config
-import gba_mpy_tools.action as m_action
+from gba_mpy_tools.cache import BuildCache
+from gba_mpy_tools.profiler import Profiler
+from gba_mpy_tools.errors import VariantNotFoundError
+# the build pipeline is imported by the subcommands that need it, to keep the startup fast
+if TYPE_CHECKING:
+    import gba_mpy_tools.action as m_action
+    from gba_mpy_tools.rom_inspect import RomEntry, RomUsage
+
+def resolved_path(path: str):
+    # resolved before changing to the config dir
+    return Path(path).resolve()
+
+def add_rom_argument(cmd: ArgumentParser, dest: str = "rom", help: str = "The ROM file, default is the output ROM in the config"):
+    cmd.add_argument(
+        dest,
+        type=resolved_path,
+        nargs="?",
+        default=None,
+        help=help,
+    )
+
+def add_jobs_argument(cmd: ArgumentParser):
+    cmd.add_argument(
+        "-j", "--jobs",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Max parallel mpy-cross processes, default is the CPU count",
+    )
+
+def add_incremental_argument(cmd: ArgumentParser):
+    cmd.add_argument(
+        "-i", "--incremental",
+        dest="incremental",
+        action="store_true",
+        help="Only rewrite the changed files in the previous output ROM",
+    )
+    cmd.add_argument(
+        "-f", "--force",
+        dest="force",
+        action="store_true",
+        help="Build even if the inputs are the same as the last build, by default the output is kept then",
+    )
+
+def add_profile_argument(cmd: ArgumentParser):
+    cmd.add_argument(
+        "--profile",
+        dest="profile",
+        nargs="?",
+        const="gbampy-trace.json",
+        default="",
+        help="Record the build phases into a Chrome trace JSON file (default: gbampy-trace.json), and print the slowest ones",
+    )
+    cmd.add_argument(
+        "--profile-top",
+        dest="profile_top",
+        type=int,
+        default=10,
+        help="Number of the slowest phases and files to print",
+    )
 
 def parse_args():
     parser = ArgumentParser(
@@ -15,6 +76,14 @@ def parse_args():
         default=".",
         help="Config file path, or workspace which contains the config file (.gbampy.toml)",
     )
+    parser.add_argument(
+        "--variant",
+        dest="variants",
+        action="append",
+        default=[],
+        help="Use this [[variant]] in the config, can be given more than once. "
+            "build builds all the variants by default, the other commands use the first one",
+    )
     subparser = parser.add_subparsers()
 
     cmd_build = subparser.add_parser(
@@ -22,18 +91,213 @@ def parse_args():
         help="List all the files that will be write into the ROM"
     )
     cmd_build.set_defaults(action="list")
+    cmd_build.add_argument(
+        "--why",
+        dest="why",
+        action="store_true",
+        help="Print why each file is included, like the module importing it when [prune] is enabled",
+    )
 
     cmd_build = subparser.add_parser(
         "build",
         help="Build GBA ROM"
     )
     cmd_build.set_defaults(action="build")
+    add_jobs_argument(cmd_build)
+    add_incremental_argument(cmd_build)
+    add_profile_argument(cmd_build)
+    cmd_build.add_argument(
+        "--measure-pack",
+        dest="measure_pack",
+        action="store_true",
+        help="With [pack], also build the file system without packing on full builds to report the ROM bytes saved",
+    )
     
     cmd_run = subparser.add_parser(
         "run",
         help="Build GBA ROM and run with emulator",
     )
     cmd_run.set_defaults(action="run")
+    add_jobs_argument(cmd_run)
+    add_incremental_argument(cmd_run)
+    add_profile_argument(cmd_run)
+
+    cmd_watch = subparser.add_parser(
+        "watch",
+        help="Rebuild GBA ROM when the source files change, and restart the emulator",
+    )
+    cmd_watch.set_defaults(action="watch")
+    add_jobs_argument(cmd_watch)
+    cmd_watch.add_argument(
+        "--poll",
+        dest="poll",
+        action="store_true",
+        help="Check the source files by polling instead of inotify",
+    )
+    cmd_watch.add_argument(
+        "--no-run",
+        dest="no_run",
+        action="store_true",
+        help="Only rebuild, do not start the emulator",
+    )
+
+    cmd_inspect = subparser.add_parser(
+        "inspect",
+        help="List the files in a built ROM with their size and block usage",
+    )
+    cmd_inspect.set_defaults(action="inspect")
+    add_rom_argument(cmd_inspect)
+    cmd_inspect.add_argument(
+        "--hash",
+        dest="hash",
+        action="store_true",
+        help="Print the sha256 of every file",
+    )
+
+    cmd_extract = subparser.add_parser(
+        "extract",
+        help="Copy the files out of a built ROM",
+    )
+    cmd_extract.set_defaults(action="extract")
+    add_rom_argument(cmd_extract)
+    cmd_extract.add_argument(
+        "-o", "--output",
+        dest="output_dir",
+        type=resolved_path,
+        default="extracted",
+        help="The dir to write into, default is ./extracted",
+    )
+    cmd_extract.add_argument(
+        "-p", "--path",
+        dest="path",
+        default="/",
+        help="The dir or file in the ROM to extract, default is the whole file system",
+    )
+
+    cmd_diff = subparser.add_parser(
+        "diff",
+        help="Compare the files in two built ROMs by content, exit with 1 if they are different",
+    )
+    cmd_diff.set_defaults(action="diff")
+    cmd_diff.add_argument(
+        "old_rom",
+        type=resolved_path,
+        help="The old ROM file",
+    )
+    add_rom_argument(cmd_diff, "new_rom", "The new ROM file, default is the output ROM in the config")
+
+    cmd_test = subparser.add_parser(
+        "test",
+        help="Run the built ROMs in a headless emulator at the same time, pass or fail by the output, exit with 1 if any fails",
+    )
+    cmd_test.set_defaults(action="test")
+    cmd_test.add_argument(
+        "roms",
+        type=resolved_path,
+        nargs="*",
+        help="The ROM files, default is the output ROM of each variant in the config",
+    )
+    cmd_test.add_argument(
+        "-e", "--entry",
+        dest="entries",
+        action="append",
+        default=None,
+        help="Test entry point passed to the emulator command, can be given more than once, default is [test] entries",
+    )
+    cmd_test.add_argument(
+        "-j", "--jobs",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Max emulators running at the same time, default is [test] jobs or the CPU count",
+    )
+    cmd_test.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        default=None,
+        help="Seconds before each emulator is stopped, default is [test] timeout",
+    )
+    cmd_test.add_argument(
+        "--json",
+        dest="json_report",
+        type=resolved_path,
+        default=None,
+        help="Write the results into a JSON file",
+    )
+    cmd_test.add_argument(
+        "--junit",
+        dest="junit_report",
+        type=resolved_path,
+        default=None,
+        help="Write the results into a JUnit XML file",
+    )
+
+    cmd_emitters = subparser.add_parser(
+        "emitters",
+        help="Compile every module with each mpy-cross emitter and compare the .mpy sizes",
+    )
+    cmd_emitters.set_defaults(action="emitters")
+    add_jobs_argument(cmd_emitters)
+    add_profile_argument(cmd_emitters)
+    cmd_emitters.add_argument(
+        "--emit",
+        dest="emitters",
+        action="append",
+        choices=("bytecode", "native", "viper"),
+        default=None,
+        help="The emitter compared, can be given more than once, default is all of them",
+    )
+    cmd_emitters.add_argument(
+        "--march",
+        dest="march",
+        default="armv6m",
+        help="The arch of the native code, passed to mpy-cross as -march, default is armv6m",
+    )
+
+    cmd_patch = subparser.add_parser(
+        "patch",
+        help="Apply the IPS or BPS patches made by the build",
+    )
+    patch_subparser = cmd_patch.add_subparsers()
+    cmd_patch_apply = patch_subparser.add_parser(
+        "apply",
+        help="Apply a patch to the ROM it was made against",
+    )
+    cmd_patch_apply.set_defaults(action="patch_apply")
+    cmd_patch_apply.add_argument(
+        "patch",
+        type=resolved_path,
+        help="The .bps or .ips patch file",
+    )
+    cmd_patch_apply.add_argument(
+        "rom",
+        type=resolved_path,
+        help="The ROM the patch was made against, the previous output or the template",
+    )
+    cmd_patch_apply.add_argument(
+        "-o", "--output",
+        dest="output",
+        type=resolved_path,
+        default=None,
+        help="The patched ROM, default is patching the ROM in place",
+    )
+
+    cmd_cache = subparser.add_parser(
+        "cache",
+        help="Manage the build cache",
+    )
+    cache_subparser = cmd_cache.add_subparsers()
+    cmd_cache_stats = cache_subparser.add_parser(
+        "stats",
+        help="Show cache size and hit rate",
+    )
+    cmd_cache_stats.set_defaults(action="cache_stats")
+    cmd_cache_clear = cache_subparser.add_parser(
+        "clear",
+        help="Remove all the cached files",
+    )
+    cmd_cache_clear.set_defaults(action="cache_clear")
 
     args = parser.parse_args()
     if not hasattr(args, "action"):
@@ -41,35 +305,273 @@ def parse_args():
         sys.exit(-1)
     return args
 
+def select_variants(cfg: Config, names: list[str]):
+    variants = cfg.variants()
+    if not names:
+        return variants
+    by_name = { variant.variant_name: variant for variant in variants }
+    for name in names:
+        if name not in by_name:
+            raise VariantNotFoundError(name)
+    return [ by_name[name] for name in names ]
+
+def print_hook_result(result: 'm_action.BuildHookResult'):
+    if result.skipped:
+        print(f"Skipped {result.entry}, the inputs and outputs are not changed since its last run")
+
+def print_build_result(result: 'm_action.BuildResult'):
+    if result.minified:
+        print("Minified:")
+        for item in result.minified:
+            print(f"  {item.before:>8} -> {item.after:>8} bytes  {item.target}")
+        before = sum(item.before for item in result.minified)
+        after = sum(item.after for item in result.minified)
+        print(f"  {before:>8} -> {after:>8} bytes  total, {(before - after) * 100 / max(before, 1):.1f}% smaller")
+    if result.fs_trials:
+        print(f"{'block_size':>10} {'blocks':>8} {'used':>8} {'used_bytes':>12} {'overhead':>12}")
+        for trial in result.fs_trials:
+            if trial.error:
+                print(f"{trial.block_size:>10} {trial.block_count:>8} failed: {trial.error}")
+            else:
+                print(f"{trial.block_size:>10} {trial.block_count:>8} {trial.used_blocks:>8} {trial.used_bytes:>12} {trial.overhead:>12}")
+    if result.reused:
+        print("Up to date, the output is kept, fingerprint:", result.fingerprint[:16])
+        return
+    print(
+        "Incremental build:" if result.incremental else "Full build:",
+        result.written, "written,", result.removed, "removed,",
+        "block_size:", f"{result.block_size},", "fingerprint:", result.fingerprint[:16],
+    )
+    if result.patch is not None:
+        patch = result.patch
+        print(
+            f"Patch ({patch.format} against the {patch.base}):", patch.path, ",",
+            patch.size, "bytes,", f"made in {patch.seconds * 1000:.1f} ms",
+        )
+    if result.pack is not None:
+        pack = result.pack
+        print(
+            "Packed", pack.modules, "modules",
+            f"into a {pack.archive_size} bytes archive," if pack.archive_size is not None else "(archive unchanged),",
+            f"directory entries: {pack.entries_change:+d} ({pack.dirs_removed} dirs removed),",
+            "ROM bytes:", f"{pack.bytes_change:+d}" if pack.bytes_change is not None else "not measured (use --measure-pack on a full build)",
+        )
+        if not pack.helped:
+            print("Packing did not help, it uses more ROM bytes or directory entries than it saves, pack more modules or remove the [pack] patterns")
+
+def print_emitter_report(rows: list['m_action.EmitterReportRow'], emitters: tuple[str, ...]):
+    print(f"{'source':>8} " + " ".join(f"{emitter:>10}" for emitter in emitters) + "  path")
+    for row in rows:
+        sizes = " ".join(
+            f"{'failed':>10}" if row.sizes[emitter] is None else f"{row.sizes[emitter]:>10}"
+            for emitter in emitters
+        )
+        print(f"{row.source_size:>8} {sizes}  {row.target} (now {row.emitter})")
+    totals = " ".join(
+        f"{sum(row.sizes[emitter] for row in rows if row.sizes[emitter] is not None):>10}" for emitter in emitters
+    )
+    print(f"{sum(row.source_size for row in rows):>8} {totals}  total, {len(rows)} modules")
+    print("Compile time:", ", ".join(
+        f"{emitter} {sum(row.seconds[emitter] for row in rows) * 1000:.1f} ms" for emitter in emitters
+    ))
+    for row in rows:
+        for emitter, error in row.errors.items():
+            print(f"Failed with {emitter}: {row.target}")
+            print("  " + error.replace("\n", "\n  "))
+
+def open_rom_or_exit(path: Path, cfg: Config):
+    # exit with 2 if the ROM can not be opened, "diff" exits with 1 for differences
+    from gba_mpy_tools.rom_inspect import open_rom
+    from gba_mpy_tools.errors import LFSNotFormatedError, ROMInvalidError, FileNotFoundError, LFSConfigInvalidError
+    try:
+        return open_rom(path, **cfg.littlefs_options)
+    except LFSNotFormatedError:
+        # like the template
+        print(f"no LittleFS file system in {path}", file=sys.stderr)
+    except ROMInvalidError:
+        print(f"not a MicroPython ROM for GBA: {path}", file=sys.stderr)
+    except (FileNotFoundError, LFSConfigInvalidError) as e:
+        print(e, file=sys.stderr)
+    sys.exit(2)
+
+def print_rom_entries(entries: list['RomEntry'], usage: 'RomUsage', show_hash: bool):
+    print(f"{'size':>10} {'blocks':>8}  path")
+    for entry in entries:
+        if entry.is_dir:
+            print(f"{'<dir>':>10} {'':>8}  {entry.path}")
+        else:
+            line = f"{entry.size:>10} {entry.blocks:>8}  {entry.path}"
+            print(f"{line}  {entry.hash}" if show_hash else line)
+    print(
+        usage.files, "files,", usage.dirs, "dirs,", usage.total_size, "bytes,",
+        "blocks used:", usage.used_blocks, "/", usage.block_count,
+        f"({usage.data_blocks} data, {usage.used_blocks - usage.data_blocks} metadata),",
+        "block_size:", usage.block_size,
+    )
+
+def print_profile(profiler: Profiler, trace_path: str, top_n: int):
+    profiler.save_chrome_trace(trace_path)
+    phases, files = profiler.summary(top_n)
+    print()
+    print("========================================")
+    print("Profile saved to:", trace_path)
+    print("========================================")
+    print("Slowest phases:")
+    for name, seconds, count in phases:
+        print(f"  {seconds * 1000:10.1f} ms  {count:6d}x  {name}")
+    print("Slowest files:")
+    for name, seconds, count in files:
+        print(f"  {seconds * 1000:10.1f} ms  {count:6d}x  {name}")
+
 def main():
     args = parse_args()
     cfg = Config(args.config_path)
     chdir(cfg.config_file_dir)
+    # relative paths are resolved in the config dir
+    variants = [ variant.freeze() for variant in select_variants(cfg, args.variants) ]
+    cfg = variants[0] if variants else cfg.freeze()
     if args.action == "list":
-        file_list = m_action.list_files(cfg)
-        for item in file_list:
-            print(item.target, "    -> is_dir:", item.is_dir, ",", "compile:", item.compile)
+        import gba_mpy_tools.action as m_action
+        # one buffered write, printing each line is slower than the walk
+        if args.why:
+            lines = [ f"{item.target}     <- {reason}" for item, reason in m_action.explain_files(cfg) ]
+        else:
+            lines = [
+                f"{item.target}     -> is_dir: {item.is_dir} , compile: {item.compile} , convert: {item.convert}"
+                for item in (m_action.list_files(cfg) if cfg.prune_enable else m_action.iter_files(cfg))
+            ]
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
     elif args.action == "build":
+        import gba_mpy_tools.action as m_action
         print()
         print("========================================")
         print("Execute before build script...")
         print("========================================")
-        m_action.execute_before_build_script(cfg)
+        profiler = Profiler(enabled=bool(args.profile))
+        with profiler.span("before build", "hook"):
+            for target in variants or [ cfg ]:
+                print_hook_result(m_action.execute_before_build_script(target))
         print()
         print("========================================")
         print("Building ROM...")
         print("========================================")
-        m_action.build(cfg)
+        if variants:
+            results = m_action.build_variants(
+                variants, args.jobs, args.incremental, profiler=profiler, force=args.force, measure_pack=args.measure_pack,
+            )
+            for variant, result in zip(variants, results):
+                print(f"Variant {variant.variant_name}:", variant.gba_output)
+                print_build_result(result)
+        else:
+            result = m_action.build(cfg, args.jobs, args.incremental, profiler=profiler, force=args.force, measure_pack=args.measure_pack)
+            print_build_result(result)
         print()
         print("========================================")
         print("Execute after build script...")
         print("========================================")
-        m_action.execute_after_build_script(cfg)
+        with profiler.span("after build", "hook"):
+            for target in variants or [ cfg ]:
+                print_hook_result(m_action.execute_after_build_script(target))
+        if profiler.enabled:
+            print_profile(profiler, args.profile, args.profile_top)
     elif args.action == "run":
-        m_action.execute_before_build_script(cfg)
-        m_action.build(cfg)
-        m_action.execute_after_build_script(cfg)
+        import gba_mpy_tools.action as m_action
+        profiler = Profiler(enabled=bool(args.profile))
+        with profiler.span("before build", "hook"):
+            m_action.execute_before_build_script(cfg)
+        m_action.build(cfg, args.jobs, args.incremental, profiler=profiler, force=args.force)
+        with profiler.span("after build", "hook"):
+            m_action.execute_after_build_script(cfg)
+        if profiler.enabled:
+            print_profile(profiler, args.profile, args.profile_top)
         m_action.run(cfg)
+    elif args.action == "watch":
+        import gba_mpy_tools.watch as m_watch
+        m_watch.watch(cfg, args.jobs, args.poll, not args.no_run)
+    elif args.action == "inspect":
+        from gba_mpy_tools.rom_inspect import iter_rom_entries, rom_usage
+        rom = open_rom_or_exit(args.rom or cfg.gba_output, cfg)
+        try:
+            entries = list(iter_rom_entries(rom, hash_files=args.hash))
+            print_rom_entries(entries, rom_usage(rom, entries), args.hash)
+        finally:
+            rom.close()
+    elif args.action == "extract":
+        from gba_mpy_tools.rom_inspect import extract_rom
+        rom = open_rom_or_exit(args.rom or cfg.gba_output, cfg)
+        try:
+            extracted = extract_rom(rom, args.output_dir, args.path)
+        finally:
+            rom.close()
+        files = [ entry for entry in extracted if not entry.is_dir ]
+        print("Extracted", len(files), "files,", sum(entry.size for entry in files), "bytes into", args.output_dir)
+    elif args.action == "diff":
+        from gba_mpy_tools.rom_inspect import diff_roms
+        old_rom = open_rom_or_exit(args.old_rom, cfg)
+        try:
+            new_rom = open_rom_or_exit(args.new_rom or cfg.gba_output, cfg)
+            try:
+                diff = diff_roms(old_rom, new_rom)
+            finally:
+                new_rom.close()
+        finally:
+            old_rom.close()
+        print(f"{'status':>8} {'old size':>10} {'new size':>10}  path")
+        for item in diff:
+            old_size = item.old_size if item.old_size >= 0 else "-"
+            new_size = item.new_size if item.new_size >= 0 else "-"
+            print(f"{item.status:>8} {old_size:>10} {new_size:>10}  {item.path}")
+        print(len(diff), "differences")
+        if diff:
+            sys.exit(1)
+    elif args.action == "test":
+        from gba_mpy_tools.headless import HeadlessEmulator, write_logs, write_json_report, write_junit_report
+        roms = args.roms or [ variant.gba_output.resolve() for variant in variants or [ cfg ] ]
+        results = HeadlessEmulator(cfg).run_all(roms, args.entries, args.jobs, args.timeout)
+        for result in results:
+            print(f"{result.status.upper():>8} {result.duration:8.2f}s  {result.name}  ({result.message})")
+        if cfg.test_log_dir is not None:
+            write_logs(results, cfg.test_log_dir)
+        if args.json_report is not None:
+            write_json_report(results, args.json_report)
+        if args.junit_report is not None:
+            write_junit_report(results, args.junit_report)
+        passed = sum(1 for result in results if result.passed)
+        print(passed, "/", len(results), "passed")
+        if passed < len(results):
+            sys.exit(1)
+    elif args.action == "emitters":
+        import gba_mpy_tools.action as m_action
+        profiler = Profiler(enabled=bool(args.profile))
+        emitters = tuple(dict.fromkeys(args.emitters or m_action.EMITTERS))
+        rows = m_action.emitter_report(cfg, emitters, args.march, args.jobs, profiler)
+        print_emitter_report(rows, emitters)
+        if profiler.enabled:
+            print_profile(profiler, args.profile, args.profile_top)
+    elif args.action == "patch_apply":
+        from gba_mpy_tools.patch import apply_patch
+        with open(args.patch, "rb") as f:
+            patch = f.read()
+        with open(args.rom, "rb") as f:
+            source = f.read()
+        target = apply_patch(patch, source)
+        output = args.output or args.rom
+        with open(output, "wb") as f:
+            f.write(target)
+        print("Patched:", output, ",", len(target), "bytes")
+    elif args.action == "cache_stats":
+        cache = BuildCache(cfg.cache_dir, cfg.cache_max_size)
+        stats = cache.stats()
+        print("Cache dir:", stats["dir"])
+        print("Entries:", stats["entries"])
+        print("Size:", stats["size"], "/", stats["max_size"], "bytes")
+        print("Hits:", stats["hits"], ",", "Misses:", stats["misses"])
+        print(f"Hit rate: {stats['hit_rate'] * 100:.1f}%")
+    elif args.action == "cache_clear":
+        cache = BuildCache(cfg.cache_dir, cfg.cache_max_size)
+        cache.clear()
+        print("Cache cleared:", cache.cache_dir)
 
 def _start_():
     main()
@@ -2,22 +2,40 @@ from pathlib import Path, PurePosixPath
 from typing import TypedDict, NotRequired
 from tomllib import load as load_toml
 from shlex import split as sh_split
+from glob import translate as glob_translate
+from types import MappingProxyType
+from copy import deepcopy
+import re
+from gba_mpy_tools.cache import default_cache_dir, DEFAULT_CACHE_MAX_SIZE
+
+DEFAULT_BUILD_MEMORY_LIMIT = 64 * 1024 * 1024
+LITTLEFS_OPTION_KEYS = ("read_size", "prog_size", "cache_size", "lookahead_size", "inline_max")
 
 DEFAULT_CONFIG_FILENAME = ".gbampy.toml"
 LOCAL_CONFIG_FILENAME = ".gbampy.local.toml"
 
+BuildHookDict = TypedDict("BuildHook", {
+    "entry": NotRequired[str],
+    "inputs": NotRequired[list[str]],
+    "outputs": NotRequired[list[str]],
+})
 ProjectSectionDict = TypedDict("ProjectSection", {
     "source_dir": NotRequired[str],
     "target_dir": NotRequired[str],
     "ignore_pattern": NotRequired[list[str]],
-    "before_build": NotRequired[str],
-    "after_build": NotRequired[str],
+    "before_build": NotRequired[str | BuildHookDict],
+    "after_build": NotRequired[str | BuildHookDict],
+})
+MpyCrossOverrideDict = TypedDict("MpyCrossOverride", {
+    "pattern": NotRequired[list[str]],
+    "params": NotRequired[str],
 })
 MpyCorssSectionDict = TypedDict("MpyCorssSection", {
     "compile": NotRequired[bool],
     "path": NotRequired[str],
     "params": NotRequired[str],
     "ignore_pattern": NotRequired[list[str]],
+    "overrides": NotRequired[list[MpyCrossOverrideDict]],
 })
 GBASectionDict = TypedDict("ProjectSection", {
     "template": NotRequired[str],
@@ -25,15 +43,100 @@ GBASectionDict = TypedDict("ProjectSection", {
     "emulator": NotRequired[str],
     "params": NotRequired[str],
 })
+CacheSectionDict = TypedDict("CacheSection", {
+    "enable": NotRequired[bool],
+    "dir": NotRequired[str],
+    "max_size": NotRequired[int],
+})
+LittleFSSectionDict = TypedDict("LittleFSSection", {
+    "block_size": NotRequired[int | str],
+    "block_size_candidates": NotRequired[list[int]],
+    "read_size": NotRequired[int],
+    "prog_size": NotRequired[int],
+    "cache_size": NotRequired[int],
+    "lookahead_size": NotRequired[int],
+    "inline_max": NotRequired[int],
+})
+BuildSectionDict = TypedDict("BuildSection", {
+    "memory_limit": NotRequired[int],
+})
+WatchSectionDict = TypedDict("WatchSection", {
+    "debounce": NotRequired[float],
+    "poll_interval": NotRequired[float],
+})
+PatchSectionDict = TypedDict("PatchSection", {
+    "format": NotRequired[str],
+    "path": NotRequired[str],
+})
+TestSectionDict = TypedDict("TestSection", {
+    "emulator": NotRequired[str],
+    "params": NotRequired[str],
+    "entries": NotRequired[list[str]],
+    "timeout": NotRequired[float],
+    "pass_pattern": NotRequired[str],
+    "fail_pattern": NotRequired[str],
+    "pass_settle": NotRequired[float],
+    "jobs": NotRequired[int],
+    "log_dir": NotRequired[str],
+})
+MinifySectionDict = TypedDict("MinifySection", {
+    "enable": NotRequired[bool],
+    "rename_locals": NotRequired[bool],
+    "ignore_pattern": NotRequired[list[str]],
+})
+PruneSectionDict = TypedDict("PruneSection", {
+    "enable": NotRequired[bool],
+    "roots": NotRequired[list[str]],
+    "keep": NotRequired[list[str]],
+    "search_path": NotRequired[list[str]],
+})
+PackSectionDict = TypedDict("PackSection", {
+    "pattern": NotRequired[list[str]],
+    "archive": NotRequired[str],
+    "hook": NotRequired[str],
+    "mount": NotRequired[str],
+})
+AssetRuleDict = TypedDict("AssetRule", {
+    "pattern": NotRequired[list[str]],
+    "converter": NotRequired[str],
+    "suffix": NotRequired[str],
+    "options": NotRequired[dict],
+})
 ConfigDict = TypedDict("ConfigDict",{
     "project": NotRequired[ProjectSectionDict],
     "mpy-cross": NotRequired[MpyCorssSectionDict],
     "gba": NotRequired[GBASectionDict],
+    "cache": NotRequired[CacheSectionDict],
+    "build": NotRequired[BuildSectionDict],
+    "watch": NotRequired[WatchSectionDict],
+    "littlefs": NotRequired[LittleFSSectionDict],
+    "assets": NotRequired[list[AssetRuleDict]],
+    "pack": NotRequired[PackSectionDict],
+    "minify": NotRequired[MinifySectionDict],
+    "prune": NotRequired[PruneSectionDict],
+    "patch": NotRequired[PatchSectionDict],
+    "test": NotRequired[TestSectionDict],
+    "variant": NotRequired[list["VariantDict"]],
+})
+VariantDict = TypedDict("Variant", {
+    "name": NotRequired[str],
+    "project": NotRequired[ProjectSectionDict],
+    "mpy-cross": NotRequired[MpyCorssSectionDict],
+    "gba": NotRequired[GBASectionDict],
+    "cache": NotRequired[CacheSectionDict],
+    "build": NotRequired[BuildSectionDict],
+    "littlefs": NotRequired[LittleFSSectionDict],
+    "assets": NotRequired[list[AssetRuleDict]],
+    "pack": NotRequired[PackSectionDict],
+    "minify": NotRequired[MinifySectionDict],
+    "test": NotRequired[TestSectionDict],
+    "patch": NotRequired[PatchSectionDict],
+    "prune": NotRequired[PruneSectionDict],
 })
 
 def deep_update_dict(dest: dict, update_from: dict):
     for k, v in update_from.items():
-        if k in dest and isinstance(v, dict):
+        if k in dest and isinstance(v, dict) and isinstance(dest[k], dict):
             deep_update_dict(dest[k], v)
         else:
             dest[k] = v
@@ -47,9 +150,26 @@ def parse_script_module_and_function(module_function_str: str):
         function_name = module_function_str[split_pos+1:]
     return module_name, function_name
 
+def compile_patterns(patterns: list[str]):
+    """Compile glob patterns into one regex, matching like `PurePosixPath.full_match`.
+
+    Args:
+        patterns (list[str]): Glob patterns.
+
+    Returns:
+        re.Pattern | None: The regex to match the relative posix path, None if there is no pattern.
+    """
+    if not patterns:
+        return None
+    parts = [ glob_translate(pattern, recursive=True, include_hidden=True, seps="/") for pattern in patterns ]
+    return re.compile("|".join(f"(?:{part})" for part in parts))
+
 class Config():
     def __init__(self, config_file_or_dir: str | Path = "."):
         self.__cfg: ConfigDict = dict()
+        self.__matchers: dict[str, re.Pattern | None] = dict()
+        self.__snapshot: ConfigSnapshot | None = None
+        self.__variant_name = ""
         temp_path = Path(config_file_or_dir)
         if temp_path.exists() and temp_path.is_dir():
             config_path = temp_path.joinpath(DEFAULT_CONFIG_FILENAME)
@@ -70,6 +190,45 @@ class Config():
     
     def replace_config(self, cfg: ConfigDict):
         self.__cfg = cfg
+        self.__matchers = dict()
+        self.__snapshot = None
+
+    def variants(self):
+        """Make a config for each `[[variant]]`, the variant table is merged into the base config like the local config.
+
+        Returns:
+            list[Config]: The variant configs in the file order, empty if there is no variant.
+        """
+        base = { k: v for k, v in self.__cfg.items() if k != "variant" }
+        variants: list[Config] = []
+        for i, variant in enumerate(self.__cfg.get("variant", [])):
+            merged: ConfigDict = deepcopy(base)
+            deep_update_dict(merged, deepcopy({ k: v for k, v in variant.items() if k != "name" }))
+            cfg = Config.__new__(Config)
+            cfg.__cfgdir = self.__cfgdir
+            cfg.__variant_name = variant.get("name", f"variant{i}")
+            cfg.replace_config(merged)
+            variants.append(cfg)
+        return variants
+
+    def freeze(self):
+        """Take an immutable snapshot of the config, every value is computed once.
+
+        Relative paths are resolved against the current dir, so freeze it after changing to the config dir.
+        The snapshot is kept until `replace_config`.
+
+        Returns:
+            ConfigSnapshot: The snapshot.
+        """
+        if self.__snapshot is None:
+            self.__snapshot = ConfigSnapshot(self)
+        return self.__snapshot
+
+    def __get_matcher(self, name: str, patterns: list[str]):
+        # compile once, reset by replace_config
+        if name not in self.__matchers:
+            self.__matchers[name] = compile_patterns(patterns)
+        return self.__matchers[name]
 
     def to_target_path(self, source_file: str | Path):
         if not isinstance(source_file, Path):
@@ -81,23 +240,44 @@ class Config():
         if isinstance(source_file, (str, Path, )):
             source_file = self.to_target_path(source_file)
         source_file = source_file.relative_to(self.project_target_dir) # use rel path to match
-        for pattern in self.project_ignore_pattern:
-            if source_file.full_match(pattern):
-                return True
-        return False
+        matcher = self.project_ignore_matcher
+        return matcher is not None and matcher.match(source_file.as_posix()) is not None
 
     def should_ignore_mpy_cross_compile(self, source_file: str | Path | PurePosixPath):
         if isinstance(source_file, (str, Path, )):
             source_file = self.to_target_path(source_file)
         source_file = source_file.relative_to(self.project_target_dir) # use rel path to match
-        for pattern in self.mpy_cross_ignore_pattern:
-            if source_file.full_match(pattern):
-                return True
-        return False
+        matcher = self.mpy_cross_ignore_matcher
+        return matcher is not None and matcher.match(source_file.as_posix()) is not None
+
+    def find_asset_rule(self, source_file: str | Path | PurePosixPath) -> AssetRuleDict | None:
+        if isinstance(source_file, (str, Path, )):
+            source_file = self.to_target_path(source_file)
+        rel = source_file.relative_to(self.project_target_dir).as_posix() # use rel path to match
+        for i, rule in enumerate(self.asset_rules):
+            matcher = self.__get_matcher(f"asset{i}", rule["pattern"])
+            if matcher is not None and matcher.match(rel) is not None:
+                return rule
+        return None
+
+    def find_mpy_cross_params(self, source_file: str | Path | PurePosixPath) -> list[str]:
+        # the first matching override replaces the params
+        if isinstance(source_file, (str, Path, )):
+            source_file = self.to_target_path(source_file)
+        rel = source_file.relative_to(self.project_target_dir).as_posix() # use rel path to match
+        for i, override in enumerate(self.mpy_cross_overrides):
+            matcher = self.__get_matcher(f"mpy-cross{i}", override["pattern"])
+            if matcher is not None and matcher.match(rel) is not None:
+                return sh_split(override["params"])
+        return self.mpy_cross_params
 
     @property
     def config_file_dir(self):
         return self.__cfgdir
+
+    @property
+    def variant_name(self):
+        return self.__variant_name
     
     @property
     def project_source_dir(self):
@@ -115,16 +295,43 @@ class Config():
         return prj.setdefault("ignore_pattern", [])
     
     @property
-    def project_before_build(self):
+    def project_ignore_matcher(self):
+        return self.__get_matcher("project", self.project_ignore_pattern)
+
+    def __build_hook(self, name: str) -> BuildHookDict:
         prj: ProjectSectionDict = self.__cfg.setdefault("project", dict())
-        before_build_str = prj.setdefault("before_build", ".")
-        return parse_script_module_and_function(before_build_str)
+        hook = prj.setdefault(name, "")
+        if isinstance(hook, str):
+            # "module:func" is the entry without inputs, it always runs
+            hook = prj[name] = { "entry": hook }
+        hook.setdefault("entry", "")
+        hook.setdefault("inputs", [])
+        hook.setdefault("outputs", [])
+        return hook
+
+    @property
+    def project_before_build(self):
+        return parse_script_module_and_function(self.__build_hook("before_build")["entry"])
+
+    @property
+    def project_before_build_inputs(self) -> list[str]:
+        return self.__build_hook("before_build")["inputs"]
+
+    @property
+    def project_before_build_outputs(self):
+        return [ Path(output).resolve() for output in self.__build_hook("before_build")["outputs"] ]
     
     @property
     def project_after_build(self):
-        prj: ProjectSectionDict = self.__cfg.setdefault("project", dict())
-        after_build_str = prj.setdefault("after_build", ".")
-        return parse_script_module_and_function(after_build_str)
+        return parse_script_module_and_function(self.__build_hook("after_build")["entry"])
+
+    @property
+    def project_after_build_inputs(self) -> list[str]:
+        return self.__build_hook("after_build")["inputs"]
+
+    @property
+    def project_after_build_outputs(self):
+        return [ Path(output).resolve() for output in self.__build_hook("after_build")["outputs"] ]
     
     @property
     def mpy_cross_compile(self):
@@ -146,6 +353,104 @@ class Config():
         mpyc: MpyCorssSectionDict = self.__cfg.setdefault("mpy-cross", dict())
         return mpyc.setdefault("ignore_pattern", [])
 
+    @property
+    def mpy_cross_ignore_matcher(self):
+        return self.__get_matcher("mpy-cross", self.mpy_cross_ignore_pattern)
+
+    @property
+    def mpy_cross_overrides(self) -> list[MpyCrossOverrideDict]:
+        mpyc: MpyCorssSectionDict = self.__cfg.setdefault("mpy-cross", dict())
+        overrides: list[MpyCrossOverrideDict] = mpyc.setdefault("overrides", [])
+        for override in overrides:
+            override.setdefault("pattern", [])
+            override.setdefault("params", "")
+        return overrides
+
+    @property
+    def asset_rules(self) -> list[AssetRuleDict]:
+        rules: list[AssetRuleDict] = self.__cfg.setdefault("assets", [])
+        for rule in rules:
+            rule.setdefault("pattern", [])
+            rule.setdefault("converter", "")
+            rule.setdefault("suffix", "")
+            rule.setdefault("options", dict())
+        return rules
+
+    @property
+    def asset_matcher(self):
+        return self.__get_matcher("assets", [ p for rule in self.asset_rules for p in rule["pattern"] ])
+
+    @property
+    def minify_enable(self):
+        minify: MinifySectionDict = self.__cfg.setdefault("minify", dict())
+        return minify.setdefault("enable", False)
+
+    @property
+    def minify_rename_locals(self):
+        minify: MinifySectionDict = self.__cfg.setdefault("minify", dict())
+        return minify.setdefault("rename_locals", False)
+
+    @property
+    def minify_ignore_pattern(self) -> list[str]:
+        minify: MinifySectionDict = self.__cfg.setdefault("minify", dict())
+        return minify.setdefault("ignore_pattern", [])
+
+    @property
+    def minify_ignore_matcher(self):
+        return self.__get_matcher("minify", self.minify_ignore_pattern)
+
+    @property
+    def prune_enable(self):
+        prune: PruneSectionDict = self.__cfg.setdefault("prune", dict())
+        return prune.setdefault("enable", False)
+
+    @property
+    def prune_roots(self) -> list[str]:
+        prune: PruneSectionDict = self.__cfg.setdefault("prune", dict())
+        return prune.setdefault("roots", [])
+
+    @property
+    def prune_roots_matcher(self):
+        return self.__get_matcher("prune-roots", self.prune_roots)
+
+    @property
+    def prune_keep(self) -> list[str]:
+        prune: PruneSectionDict = self.__cfg.setdefault("prune", dict())
+        return prune.setdefault("keep", [])
+
+    @property
+    def prune_keep_matcher(self):
+        return self.__get_matcher("prune-keep", self.prune_keep)
+
+    @property
+    def prune_search_path(self):
+        prune: PruneSectionDict = self.__cfg.setdefault("prune", dict())
+        return [ PurePosixPath("/").joinpath(p) for p in prune.setdefault("search_path", ["/", "/lib"]) ]
+
+    @property
+    def pack_pattern(self) -> list[str]:
+        pack: PackSectionDict = self.__cfg.setdefault("pack", dict())
+        return pack.setdefault("pattern", [])
+
+    @property
+    def pack_matcher(self):
+        return self.__get_matcher("pack", self.pack_pattern)
+
+    @property
+    def pack_archive(self):
+        pack: PackSectionDict = self.__cfg.setdefault("pack", dict())
+        return PurePosixPath("/").joinpath(pack.setdefault("archive", "modules.pak"))
+
+    @property
+    def pack_hook(self):
+        pack: PackSectionDict = self.__cfg.setdefault("pack", dict())
+        return PurePosixPath("/").joinpath(pack.setdefault("hook", "pakimport.py"))
+
+    @property
+    def pack_mount(self) -> str:
+        pack: PackSectionDict = self.__cfg.setdefault("pack", dict())
+        return pack.setdefault("mount", "/pak")
+
     @property
     def gba_template(self):
         gba: GBASectionDict = self.__cfg.setdefault("gba", dict())
@@ -165,3 +470,201 @@ class Config():
     def gba_params(self):
         gba: GBASectionDict = self.__cfg.setdefault("gba", dict())
         return sh_split(gba.setdefault("params", ""))
+
+    @property
+    def cache_enable(self):
+        cache: CacheSectionDict = self.__cfg.setdefault("cache", dict())
+        return cache.setdefault("enable", True)
+
+    @property
+    def cache_dir(self):
+        cache: CacheSectionDict = self.__cfg.setdefault("cache", dict())
+        cache_dir = cache.setdefault("dir", "")
+        return Path(cache_dir).resolve() if cache_dir else default_cache_dir()
+
+    @property
+    def cache_max_size(self):
+        cache: CacheSectionDict = self.__cfg.setdefault("cache", dict())
+        return cache.setdefault("max_size", DEFAULT_CACHE_MAX_SIZE)
+
+    @property
+    def build_memory_limit(self) -> int:
+        build: BuildSectionDict = self.__cfg.setdefault("build", dict())
+        return build.setdefault("memory_limit", DEFAULT_BUILD_MEMORY_LIMIT)
+
+    @property
+    def watch_debounce(self) -> float:
+        watch: WatchSectionDict = self.__cfg.setdefault("watch", dict())
+        return watch.setdefault("debounce", 0.2)
+
+    @property
+    def watch_poll_interval(self) -> float:
+        watch: WatchSectionDict = self.__cfg.setdefault("watch", dict())
+        return watch.setdefault("poll_interval", 0.5)
+
+    @property
+    def patch_format(self) -> str:
+        # empty means no patch
+        patch: PatchSectionDict = self.__cfg.setdefault("patch", dict())
+        return patch.setdefault("format", "").lower()
+
+    @property
+    def patch_path(self):
+        patch: PatchSectionDict = self.__cfg.setdefault("patch", dict())
+        patch_path = patch.setdefault("path", "")
+        if patch_path:
+            return Path(patch_path).resolve()
+        output = self.gba_output.resolve()
+        return output.with_name(f"{output.name}.{self.patch_format or 'bps'}")
+
+    @property
+    def test_emulator(self):
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        return Path(test.setdefault("emulator", "mgba-headless"))
+
+    @property
+    def test_params(self):
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        return sh_split(test.setdefault("params", ""))
+
+    @property
+    def test_entries(self) -> list[str]:
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        return test.setdefault("entries", [])
+
+    @property
+    def test_timeout(self) -> float:
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        return test.setdefault("timeout", 30.0)
+
+    @property
+    def test_pass_pattern(self) -> str:
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        return test.setdefault("pass_pattern", "")
+
+    @property
+    def test_fail_pattern(self) -> str:
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        return test.setdefault("fail_pattern", r"Traceback \(most recent call last\)")
+
+    @property
+    def test_pass_settle(self) -> float:
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        return test.setdefault("pass_settle", 1.0)
+
+    @property
+    def test_jobs(self) -> int:
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        return test.setdefault("jobs", 0)
+
+    @property
+    def test_log_dir(self):
+        test: TestSectionDict = self.__cfg.setdefault("test", dict())
+        log_dir = test.setdefault("log_dir", "")
+        return Path(log_dir).resolve() if log_dir else None
+
+    @property
+    def littlefs_block_size(self) -> int | str:
+        lfs: LittleFSSectionDict = self.__cfg.setdefault("littlefs", dict())
+        return lfs.setdefault("block_size", 512)
+
+    @property
+    def littlefs_block_size_candidates(self) -> list[int]:
+        lfs: LittleFSSectionDict = self.__cfg.setdefault("littlefs", dict())
+        return lfs.setdefault("block_size_candidates", [256, 512, 1024, 2048, 4096])
+
+    @property
+    def littlefs_options(self) -> dict[str, int]:
+        # 0 or missing means the LittleFS default
+        lfs: LittleFSSectionDict = self.__cfg.setdefault("littlefs", dict())
+        return { k: lfs[k] for k in LITTLEFS_OPTION_KEYS if lfs.get(k, 0) > 0 }
+
+def freeze_config_value(value):
+    """Make a read-only copy of a config value, lists become tuples and dicts become read-only mappings."""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_config_value(v) for v in value)
+    if isinstance(value, dict):
+        return MappingProxyType({ k: freeze_config_value(v) for k, v in value.items() })
+    return value
+
+def thaw_config_value(value):
+    """Make a picklable copy of a frozen config value, the read-only mappings become dicts."""
+    if isinstance(value, tuple):
+        return tuple(thaw_config_value(v) for v in value)
+    if isinstance(value, MappingProxyType):
+        return { k: thaw_config_value(v) for k, v in value.items() }
+    return value
+
+CONFIG_FIELDS = tuple(name for name, value in vars(Config).items() if isinstance(value, property))
+
+class ConfigSnapshot():
+    """Immutable copy of a `Config`, made by `Config.freeze`.
+
+    It has the same properties and path helpers as `Config`, as plain attributes,
+    so the hot loops of the build do not parse, resolve or split anything again.
+    """
+    __slots__ = CONFIG_FIELDS + ("asset_rule_matchers", "mpy_cross_override_params")
+
+    def __init__(self, cfg: Config):
+        for name in CONFIG_FIELDS:
+            object.__setattr__(self, name, freeze_config_value(getattr(cfg, name)))
+        object.__setattr__(self, "asset_rule_matchers", tuple(
+            (compile_patterns(rule["pattern"]), rule) for rule in self.asset_rules
+        ))
+        object.__setattr__(self, "mpy_cross_override_params", tuple(
+            (compile_patterns(override["pattern"]), sh_split(override["params"])) for override in self.mpy_cross_overrides
+        ))
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError(f"config snapshot is read-only, can not set {name!r}")
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f"config snapshot is read-only, can not delete {name!r}")
+
+    def __getstate__(self):
+        # sent to the worker processes, the read-only mappings can not be pickled
+        return { name: thaw_config_value(getattr(self, name)) for name in self.__slots__ }
+
+    def __setstate__(self, state: dict):
+        for name, value in state.items():
+            object.__setattr__(self, name, freeze_config_value(value))
+
+    def freeze(self):
+        return self
+
+    def to_target_path(self, source_file: str | Path):
+        if not isinstance(source_file, Path):
+            source_file = Path(source_file)
+        rel = source_file.relative_to(self.project_source_dir)
+        return self.project_target_dir.joinpath(rel)
+
+    def should_ignore_project_file(self, source_file: str | Path | PurePosixPath):
+        if isinstance(source_file, (str, Path, )):
+            source_file = self.to_target_path(source_file)
+        matcher = self.project_ignore_matcher
+        return matcher is not None and matcher.match(source_file.relative_to(self.project_target_dir).as_posix()) is not None
+
+    def should_ignore_mpy_cross_compile(self, source_file: str | Path | PurePosixPath):
+        if isinstance(source_file, (str, Path, )):
+            source_file = self.to_target_path(source_file)
+        matcher = self.mpy_cross_ignore_matcher
+        return matcher is not None and matcher.match(source_file.relative_to(self.project_target_dir).as_posix()) is not None
+
+    def find_asset_rule(self, source_file: str | Path | PurePosixPath) -> AssetRuleDict | None:
+        if isinstance(source_file, (str, Path, )):
+            source_file = self.to_target_path(source_file)
+        rel = source_file.relative_to(self.project_target_dir).as_posix()
+        for matcher, rule in self.asset_rule_matchers:
+            if matcher is not None and matcher.match(rel) is not None:
+                return rule
+        return None
+
+    def find_mpy_cross_params(self, source_file: str | Path | PurePosixPath) -> list[str]:
+        if isinstance(source_file, (str, Path, )):
+            source_file = self.to_target_path(source_file)
+        rel = source_file.relative_to(self.project_target_dir).as_posix()
+        for matcher, params in self.mpy_cross_override_params:
+            if matcher is not None and matcher.match(rel) is not None:
+                return list(params)
+        # a fresh list like `Config.find_mpy_cross_params`, the frozen params are a tuple
+        return list(self.mpy_cross_params)
@@ -13,13 +13,48 @@ class FileNotFoundError(Exception):
         super().__init__(f"File '{str(file)}' is not exist.")
 
 class CompileError(Exception):
-    def __init__(self, source: str | Path, message: str):
-        super().__init__(f"Failed to compile: {str(source)}\nCompiling output:\n{message}")
+    def __init__(self, source: str | Path | list[str | Path], message: str):
+        self.sources = list(source) if isinstance(source, list) else [ source ]
+        self.output = message
+        sources_str = ", ".join(str(s) for s in self.sources)
+        super().__init__(f"Failed to compile: {sources_str}\nCompiling output:\n{message}")
 
 class ROMInvalidError(Exception):
     def __init__(self):
         super().__init__("Micropython ROM for GBA is invalid")
 
+class ROMReadOnlyError(Exception):
+    def __init__(self):
+        super().__init__("The ROM is mounted read-only")
+
 class LFSNotFormatedError(Exception):
     def __init__(self):
         super().__init__("The LittleFS file system in the ROM is not formated")
+
+class LFSConfigInvalidError(Exception):
+    def __init__(self, message: str):
+        super().__init__(f"The [littlefs] config is invalid: {message}")
+
+class LFSNoSpaceError(Exception):
+    def __init__(self, message: str):
+        super().__init__(f"The files do not fit in the LittleFS file system: {message}")
+
+class PatchInvalidError(Exception):
+    def __init__(self, message: str):
+        super().__init__(f"The patch is invalid: {message}")
+
+class PatchSourceMismatchError(Exception):
+    def __init__(self):
+        super().__init__("The patch is made against another ROM")
+
+class VariantNotFoundError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Variant '{name}' is not found in the config.")
+
+class OutputChangedError(Exception):
+    def __init__(self, output: str | Path):
+        super().__init__(f"The output '{str(output)}' is changed while building, please build again.")
+
+class VariantOutputConflictError(Exception):
+    def __init__(self, output: str | Path):
+        super().__init__(f"More than one variant is built into '{str(output)}'.")
@@ -0,0 +1,252 @@
+from gba_mpy_tools.config import Config
+from gba_mpy_tools.errors import GBAEmulatorNotFoundError, FileNotFoundError
+from pathlib import Path
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
+from shutil import which
+from tempfile import TemporaryFile
+from threading import Thread, Event
+from time import monotonic
+from typing import NamedTuple
+from os import cpu_count
+import os
+import re
+import signal
+import json
+
+# keep the tail of the output in the report, the log files have all of it
+REPORT_OUTPUT_MAX = 64 * 1024
+
+class HeadlessRun(NamedTuple):
+    name: str
+    rom: Path
+    entry: str
+    status: str
+    returncode: int | None
+    duration: float
+    stdout: str
+    stderr: str
+    message: str
+
+    @property
+    def passed(self):
+        return self.status == "passed"
+
+class HeadlessEmulator():
+    """Run ROMs in a headless emulator, deciding pass or fail by regex on its stdout.
+
+    The command is `[test] emulator` and `[test] params`, with "{rom}", "{entry}" and "{name}" replaced in the params.
+    The ROM is appended if no param has "{rom}". The ROM and the entry are also passed by the
+    GBAMPY_TEST_ROM and GBAMPY_TEST_ENTRY environment variables, so any script can stand in for the emulator.
+    """
+    def __init__(self, cfg: Config):
+        self.__cfg = cfg
+        self.__emu = ""
+        self.__pass_re = re.compile(cfg.test_pass_pattern) if cfg.test_pass_pattern else None
+        self.__fail_re = re.compile(cfg.test_fail_pattern) if cfg.test_fail_pattern else None
+        # check path
+        epath = cfg.test_emulator
+        if epath.exists() and epath.is_file():
+            self.__emu = str(epath.resolve())
+        else:
+            # search for emulator in default PATH
+            result = which(str(cfg.test_emulator))
+            if result:
+                self.__emu = result
+
+    def __ensure_emulator(self):
+        if self.__emu == "":
+            raise GBAEmulatorNotFoundError(str(self.__cfg.test_emulator))
+
+    def __make_command(self, rom: Path, entry: str, name: str):
+        cmd = [ self.__emu ]
+        has_rom = False
+        for param in self.__cfg.test_params:
+            has_rom = has_rom or "{rom}" in param
+            cmd.append(param.replace("{rom}", str(rom)).replace("{entry}", entry).replace("{name}", name))
+        if not has_rom:
+            cmd.append(str(rom))
+        return cmd
+
+    def __match(self, line: str):
+        # the fail pattern wins in the same line, the lines after a pass are still read for it
+        if self.__fail_re is not None and self.__fail_re.search(line):
+            return "failed"
+        if self.__pass_re is not None and self.__pass_re.search(line):
+            return "passed"
+        return ""
+
+    @staticmethod
+    def __signal(proc: Popen, kill: bool):
+        # the whole process group, a wrapper script may leave its children holding the output pipe
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(proc.pid, signal.SIGKILL if kill else signal.SIGTERM)
+                return
+            except OSError:
+                pass
+        proc.kill() if kill else proc.terminate()
+
+    @staticmethod
+    def __stop(proc: Popen, timeout: float = 2.0):
+        HeadlessEmulator.__signal(proc, False)
+        try:
+            proc.wait(timeout)
+        except TimeoutExpired:
+            HeadlessEmulator.__signal(proc, True)
+            proc.wait()
+
+    def run(self, rom: str | Path, entry: str = "", timeout: float | None = None):
+        """Run one ROM until the fail output, `[test] pass_settle` seconds after the pass output, the emulator exits or the timeout.
+
+        Args:
+            rom (str | Path): The GBA ROM file.
+            entry (str): The test entry point, passed to the command as "{entry}".
+            timeout (float | None): Seconds before the emulator is stopped, default is `[test] timeout`.
+
+        Returns:
+            HeadlessRun: The status is "passed", "failed", "timeout" or "error" (the emulator can not start).
+                A run without any matched line passes if there is no pass pattern and the emulator exits with 0.
+        """
+        self.__ensure_emulator()
+        rom = Path(rom)
+        if not rom.exists():
+            raise FileNotFoundError(rom)
+        if timeout is None:
+            timeout = self.__cfg.test_timeout
+        name = rom.stem + (f"::{entry}" if entry else "")
+        env = dict(os.environ, GBAMPY_TEST_ROM=str(rom), GBAMPY_TEST_ENTRY=entry)
+        start = monotonic()
+        with TemporaryFile("w+", encoding="utf-8", errors="replace") as stderr_file:
+            try:
+                proc = Popen(
+                    self.__make_command(rom, entry, name),
+                    stdin=DEVNULL, stdout=PIPE, stderr=stderr_file, env=env,
+                    text=True, encoding="utf-8", errors="replace", start_new_session=hasattr(os, "killpg"),
+                )
+            except OSError as e:
+                return HeadlessRun(name, rom, entry, "error", None, monotonic() - start, "", "", str(e))
+            lines: list[str] = []
+            matched = [ "" ]
+            passed_time: list[float] = []
+            done = Event()
+            def read_stdout():
+                # stop reading at a fail, keep reading after a pass so a crash after it still fails
+                for line in proc.stdout:
+                    lines.append(line)
+                    status = self.__match(line)
+                    if status == "failed":
+                        matched[0] = status
+                        break
+                    if status == "passed" and not passed_time:
+                        matched[0] = status
+                        passed_time.append(monotonic())
+                done.set()
+            reader = Thread(target=read_stdout, daemon=True)
+            reader.start()
+            settle = self.__cfg.test_pass_settle
+            deadline = start + timeout
+            while not done.is_set():
+                stop_time = deadline
+                if passed_time and settle >= 0:
+                    stop_time = min(deadline, passed_time[0] + settle)
+                now = monotonic()
+                if now >= stop_time:
+                    break
+                done.wait(min(stop_time - now, 0.1))
+            timed_out = not done.is_set()
+            self.__stop(proc)
+            reader.join(timeout=2.0)
+            proc.stdout.close()
+            duration = monotonic() - start
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+        stdout = "".join(lines)
+        if matched[0]:
+            status = matched[0]
+            message = f"output matched the {matched[0][:4]} pattern"
+        elif timed_out:
+            status = "timeout"
+            message = f"no matched output in {timeout:g} seconds"
+        elif self.__pass_re is None and proc.returncode == 0:
+            status = "passed"
+            message = "exited with 0"
+        else:
+            status = "failed"
+            message = f"exited with {proc.returncode} without the pass output"
+        return HeadlessRun(name, rom, entry, status, proc.returncode, duration, stdout, stderr, message)
+
+    def run_all(self, roms: list[Path], entries: list[str] | None = None, jobs: int | None = None, timeout: float | None = None):
+        """Run every ROM with every entry point concurrently.
+
+        Args:
+            roms (list[Path]): The GBA ROM files.
+            entries (list[str] | None): Test entry points, default is `[test] entries`, empty runs each ROM once.
+            jobs (int | None): Max emulators running at the same time, default is `[test] jobs` or the CPU count.
+            timeout (float | None): Seconds before each emulator is stopped, default is `[test] timeout`.
+
+        Returns:
+            list[HeadlessRun]: Results in the order of the ROMs then the entries.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        self.__ensure_emulator()
+        if entries is None:
+            entries = list(self.__cfg.test_entries)
+        if jobs is None or jobs <= 0:
+            jobs = self.__cfg.test_jobs
+        if jobs <= 0:
+            jobs = cpu_count() or 1
+        runs = [ (rom, entry) for rom in roms for entry in (entries or [ "" ]) ]
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(runs)))) as executor:
+            return list(executor.map(lambda run: self.run(run[0], run[1], timeout), runs))
+
+def __tail(text: str):
+    return text[-REPORT_OUTPUT_MAX:]
+
+def write_logs(results: list[HeadlessRun], log_dir: Path):
+    """Write the stdout and stderr of each run into `<log_dir>/<name>.log`."""
+    log_dir.mkdir(parents=True, exist_ok=True)
+    for result in results:
+        file_name = re.sub(r"[^\w.-]+", "_", result.name) + ".log"
+        with open(log_dir.joinpath(file_name), "w", encoding="utf-8") as f:
+            f.write(f"# {result.name}: {result.status}, {result.message}\n")
+            f.write("# stdout\n")
+            f.write(result.stdout)
+            f.write("\n# stderr\n")
+            f.write(result.stderr)
+
+def write_json_report(results: list[HeadlessRun], path: Path):
+    """Write the results as JSON, the outputs are cut to the last `REPORT_OUTPUT_MAX` characters."""
+    report = {
+        "total": len(results),
+        "passed": sum(1 for r in results if r.passed),
+        "runs": [
+            {
+                "name": r.name, "rom": str(r.rom), "entry": r.entry, "status": r.status, "returncode": r.returncode,
+                "duration": r.duration, "message": r.message, "stdout": __tail(r.stdout), "stderr": __tail(r.stderr),
+            }
+            for r in results
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+
+def write_junit_report(results: list[HeadlessRun], path: Path):
+    """Write the results as a JUnit XML test suite, timeouts are reported as errors."""
+    from xml.etree import ElementTree as ET
+    suite = ET.Element(
+        "testsuite",
+        name="gbampy",
+        tests=str(len(results)),
+        failures=str(sum(1 for r in results if r.status == "failed")),
+        errors=str(sum(1 for r in results if r.status in ("timeout", "error"))),
+        time=f"{sum(r.duration for r in results):.3f}",
+    )
+    for r in results:
+        case = ET.SubElement(suite, "testcase", classname=r.rom.stem, name=r.name, time=f"{r.duration:.3f}")
+        if r.status == "failed":
+            ET.SubElement(case, "failure", message=r.message)
+        elif r.status != "passed":
+            ET.SubElement(case, "error", type=r.status, message=r.message)
+        ET.SubElement(case, "system-out").text = __tail(r.stdout)
+        ET.SubElement(case, "system-err").text = __tail(r.stderr)
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
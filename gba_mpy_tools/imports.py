@@ -0,0 +1,217 @@
+from gba_mpy_tools.config import Config, ConfigSnapshot
+from gba_mpy_tools.cache import BuildCache, hash_key
+from gba_mpy_tools.profiler import Profiler, NO_PROFILER
+from collections import deque
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple, TYPE_CHECKING
+import ast
+import json
+
+if TYPE_CHECKING:
+    from gba_mpy_tools.action import FileItemPair
+
+# always reachable, relative to the source dir
+ENTRY_FILES = ("boot.py", "main.py")
+MODULE_SUFFIXES = (".py", ".mpy")
+
+class ImportRecord(NamedTuple):
+    module: str
+    level: int
+    names: tuple[str, ...]
+
+    def __str__(self):
+        if self.level == 0 and not self.names:
+            return f"import {self.module}"
+        return f"from {'.' * self.level}{self.module} import {', '.join(self.names) or '*'}"
+
+def parse_imports(source: bytes | str):
+    """Find the import statements of a python file, including the ones in functions and `try` blocks.
+
+    Args:
+        source (bytes | str): The python source.
+
+    Returns:
+        list[ImportRecord]: The imports in the source order, empty if the source can not be parsed.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        # the compile stage reports it
+        return []
+    nodes: list[ast.Import | ast.ImportFrom] = [ node for node in ast.walk(tree) if isinstance(node, (ast.Import, ast.ImportFrom)) ]
+    nodes.sort(key=lambda node: (node.lineno, node.col_offset))
+    records: list[ImportRecord] = []
+    for node in nodes:
+        if isinstance(node, ast.Import):
+            records.extend(ImportRecord(alias.name, 0, ()) for alias in node.names)
+        else:
+            records.append(ImportRecord(node.module or "", node.level, tuple(alias.name for alias in node.names if alias.name != "*")))
+    return records
+
+class ImportCache():
+    """Imports of each source file, reused while the size and the mtime of the file are the same.
+
+    All of them are kept in one build cache entry per source dir.
+    """
+    def __init__(self, cfg: Config, cache: BuildCache | None = None):
+        self.__cache = cache
+        self.__key = hash_key("import-graph", str(cfg.project_source_dir))
+        self.__entries: dict[str, list] = dict()
+        self.__seen: set[str] = set()
+        self.__changed = False
+        self.__parsed = 0
+        if cache is not None:
+            data = cache.get(self.__key)
+            if data is not None:
+                try:
+                    self.__entries = json.loads(data)
+                except ValueError:
+                    self.__entries = dict()
+
+    @property
+    def parsed(self):
+        return self.__parsed
+
+    def imports(self, source: Path):
+        """Get the imports of a file, parsed only if it is changed."""
+        key = str(source)
+        st = source.stat()
+        self.__seen.add(key)
+        entry = self.__entries.get(key)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return [ ImportRecord(module, level, tuple(names)) for module, level, names in entry[2] ]
+        with open(source, "rb") as f:
+            records = parse_imports(f.read())
+        self.__entries[key] = [ st.st_size, st.st_mtime_ns, [ [ r.module, r.level, list(r.names) ] for r in records ] ]
+        self.__changed = True
+        self.__parsed += 1
+        return records
+
+    def save(self):
+        """Save the imports of the files used since loading, the others are dropped."""
+        if self.__cache is None:
+            return
+        entries = { key: entry for key, entry in self.__entries.items() if key in self.__seen }
+        if self.__changed or len(entries) != len(self.__entries):
+            self.__cache.put(self.__key, json.dumps(entries, separators=(",", ":")).encode("utf-8"))
+            self.__entries = entries
+            self.__changed = False
+
+class __ModuleIndex(NamedTuple):
+    # target paths without the suffix, and the dirs, in the ROM
+    modules: dict[PurePosixPath, 'FileItemPair']
+    dirs: set[PurePosixPath]
+
+def __module_target(item: 'FileItemPair'):
+    # "/pkg/mod.mpy" from "pkg/mod.py" is imported as "/pkg/mod"
+    return item.target.with_suffix("")
+
+def __find_module(index: __ModuleIndex, path: PurePosixPath):
+    # a package is imported by its __init__, a dir without it is a namespace package
+    init = index.modules.get(path.joinpath("__init__"))
+    if init is not None:
+        return init, True
+    module = index.modules.get(path)
+    if module is not None:
+        return module, True
+    return None, path in index.dirs
+
+def __resolve_from(index: __ModuleIndex, base: PurePosixPath, record: ImportRecord):
+    # the imported modules, the parent packages first, or None if it is not under the base
+    found: list['FileItemPair'] = []
+    path = base
+    for part in [ part for part in record.module.split(".") if part ]:
+        path = path.joinpath(part)
+        module, exists = __find_module(index, path)
+        if not exists:
+            return None
+        if module is not None:
+            found.append(module)
+    for name in record.names:
+        # "from pkg import name" imports the submodule if there is one
+        module, _ = __find_module(index, path.joinpath(name))
+        if module is not None:
+            found.append(module)
+    return found
+
+def __resolve(index: __ModuleIndex, cfg: ConfigSnapshot, importer: 'FileItemPair', record: ImportRecord):
+    if record.level > 0:
+        # relative to the package of the importer
+        base = importer.target.parent
+        for _ in range(record.level - 1):
+            base = base.parent
+        return __resolve_from(index, base, record) or []
+    for base in cfg.prune_search_path:
+        found = __resolve_from(index, base, record)
+        if found is not None:
+            return found
+    # built-in or missing modules
+    return []
+
+def prune_files(cfg: Config, items: list['FileItemPair'], cache: BuildCache | None = None, profiler: Profiler = NO_PROFILER):
+    """Keep only the modules reachable by imports from the entry files, and the kept files.
+
+    The roots are `boot.py`, `main.py`, the modules matching `[prune] roots`, and the files matching `[prune] keep`.
+    Imports are resolved like on the device, in `[prune] search_path` and relative to the importing package.
+    Other files, assets included, are pruned unless they are kept. Dirs are kept if they have a kept file.
+
+    Args:
+        cfg (Config): Config info object.
+        items (list[FileItemPair]): The walked files, from `iter_files`.
+        cache (BuildCache | None): Cache the imports of each file, so only the changed files are parsed again.
+        profiler (Profiler): Record the import parsing.
+
+    Returns:
+        tuple[list[FileItemPair], dict[PurePosixPath, str]]: The kept items in the walk order,
+            and why each one is kept, by the target path.
+    """
+    cfg = cfg.freeze()
+    index = __ModuleIndex(dict(), set())
+    for item in items:
+        if item.is_dir:
+            index.dirs.add(item.target)
+        elif item.source.suffix.lower() in MODULE_SUFFIXES:
+            key = __module_target(item)
+            # the .py file wins over the .mpy one, like the import on the device
+            if key not in index.modules or item.source.suffix.lower() == ".py":
+                index.modules[key] = item
+    reasons: dict[PurePosixPath, str] = dict()
+    queue: deque['FileItemPair'] = deque()
+    def reach(item: 'FileItemPair', reason: str):
+        if item.target in reasons:
+            return
+        reasons[item.target] = reason
+        if item.source.suffix.lower() == ".py":
+            queue.append(item)
+    roots_matcher = cfg.prune_roots_matcher
+    keep_matcher = cfg.prune_keep_matcher
+    source_dir = cfg.project_source_dir
+    for item in items:
+        if item.is_dir:
+            continue
+        rel = item.source.relative_to(source_dir).as_posix()
+        if rel in ENTRY_FILES:
+            reach(item, "entry file")
+        elif roots_matcher is not None and roots_matcher.match(rel) is not None:
+            reach(item, "matches [prune] roots")
+        elif keep_matcher is not None and keep_matcher.match(rel) is not None:
+            reach(item, "matches [prune] keep")
+    imports = ImportCache(cfg, cache)
+    with profiler.span("import graph", "walk") as span:
+        while queue:
+            importer = queue.popleft()
+            for record in imports.imports(importer.source):
+                for module in __resolve(index, cfg, importer, record):
+                    reach(module, f"imported by {importer.target} ({record})")
+        span.args["parsed"] = imports.parsed
+    imports.save()
+    # the dirs of the kept files
+    for target, reason in list(reasons.items()):
+        for parent in target.parents:
+            if parent not in index.dirs or parent in reasons:
+                break
+            reasons[parent] = f"contains {target}"
+    kept = [ item for item in items if item.target in reasons or item.source == source_dir ]
+    if kept and kept[0].target not in reasons:
+        reasons[kept[0].target] = "source dir"
+    return kept, reasons
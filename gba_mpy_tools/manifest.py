@@ -0,0 +1,207 @@
+from pathlib import Path
+from hashlib import sha256, file_digest
+from typing import TypedDict
+from os import replace, getpid
+import json
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+HOOKS_SUFFIX = ".hooks.json"
+
+ManifestEntryDict = TypedDict("ManifestEntry", {
+    "source": str,
+    "is_dir": bool,
+    "size": int,
+    "mtime_ns": int,
+    "hash": str,
+    "key": str,
+})
+ManifestFileStatDict = TypedDict("ManifestFileStat", {
+    "path": str,
+    "size": int,
+    "mtime_ns": int,
+    "hash": str,
+})
+ManifestGeometryDict = TypedDict("ManifestGeometry", {
+    "block_size": int,
+    "block_count": int,
+    "options": dict[str, int],
+})
+ManifestPackDict = TypedDict("ManifestPack", {
+    "archive": str,
+    "hook": str,
+    "mount": str,
+    # how the hook is compiled
+    "key": str,
+})
+HookRecordDict = TypedDict("HookRecord", {
+    "fingerprint": str,
+    "inputs": dict[str, ManifestFileStatDict],
+    # None for the dirs, only their existence is checked
+    "outputs": dict[str, ManifestFileStatDict | None],
+})
+
+def manifest_path_for(output: str | Path):
+    """Get the manifest path next to the output ROM.
+
+    Args:
+        output (str | Path): The output ROM.
+
+    Returns:
+        Path: The manifest path.
+    """
+    output = Path(output)
+    return output.with_name(output.name + MANIFEST_SUFFIX)
+
+def hooks_path_for(output: str | Path):
+    """Get the path of the build hook records next to the output ROM.
+
+    Args:
+        output (str | Path): The output ROM.
+
+    Returns:
+        Path: The hook records path.
+    """
+    output = Path(output)
+    return output.with_name(output.name + HOOKS_SUFFIX)
+
+def load_hook_records(path: str | Path) -> dict[str, HookRecordDict]:
+    """Load the records of the last successful run of each build hook, empty if it is missing or broken."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("hooks", {})
+
+def save_hook_records(path: str | Path, records: dict[str, HookRecordDict]):
+    """Save the records of the build hooks."""
+    path = Path(path)
+    tpath = path.with_name(f"{path.name}.{getpid()}.tmp")
+    with open(tpath, "w", encoding="utf-8") as f:
+        json.dump({ "version": MANIFEST_VERSION, "hooks": records }, f, indent=1, sort_keys=True)
+    replace(tpath, path)
+
+def hash_file(path: str | Path):
+    """Hash the file content.
+
+    Returns:
+        str: sha256 hex digest.
+    """
+    with open(path, "rb") as f:
+        return file_digest(f, sha256).hexdigest()
+
+def stat_file(path: str | Path, known: ManifestFileStatDict | None = None):
+    """Stat and hash a file, reuse the known hash if size and mtime are not changed.
+
+    Args:
+        path (str | Path): The file.
+        known (ManifestFileStatDict | None): The previous record.
+
+    Returns:
+        ManifestFileStatDict: The file record.
+    """
+    path = Path(path).resolve()
+    st = path.stat()
+    if known is not None \
+        and known.get("path") == str(path) \
+        and known.get("size") == st.st_size \
+        and known.get("mtime_ns") == st.st_mtime_ns:
+        return known
+    return { "path": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": hash_file(path) }
+
+class BuildManifest():
+    """Record of what was written into the output ROM by the last build.
+
+    It is saved next to the output ROM, and used by the incremental build
+    to find out which files are changed.
+    """
+    def __init__(self):
+        self.template: ManifestFileStatDict | None = None
+        self.output: ManifestFileStatDict | None = None
+        self.geometry: ManifestGeometryDict | None = None
+        self.pack: ManifestPackDict | None = None
+        self.entries: dict[str, ManifestEntryDict] = {}
+        # hash of everything the output is made from
+        self.fingerprint: str | None = None
+        # the output is a full build, the same fingerprint makes the same bytes
+        self.reproducible = False
+
+    @staticmethod
+    def load(path: str | Path):
+        """Load the manifest, return an empty one if it is missing or broken.
+
+        Args:
+            path (str | Path): The manifest file.
+
+        Returns:
+            BuildManifest: The manifest.
+        """
+        manifest = BuildManifest()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return manifest
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            return manifest
+        manifest.template = data.get("template")
+        manifest.output = data.get("output")
+        manifest.geometry = data.get("geometry")
+        manifest.pack = data.get("pack")
+        manifest.entries = data.get("entries", {})
+        manifest.fingerprint = data.get("fingerprint")
+        manifest.reproducible = data.get("reproducible", False)
+        return manifest
+
+    def save(self, path: str | Path):
+        """Save the manifest.
+
+        Args:
+            path (str | Path): The manifest file.
+        """
+        path = Path(path)
+        data = {
+            "version": MANIFEST_VERSION,
+            "template": self.template,
+            "output": self.output,
+            "geometry": self.geometry,
+            "pack": self.pack,
+            "entries": self.entries,
+            "fingerprint": self.fingerprint,
+            "reproducible": self.reproducible,
+        }
+        tpath = path.with_name(f"{path.name}.{getpid()}.tmp")
+        with open(tpath, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        replace(tpath, path)
+
+    def source_stat(self, target: str):
+        """Get the recorded stat of the source file for the target path.
+
+        Args:
+            target (str): The target path in the ROM.
+
+        Returns:
+            ManifestFileStatDict | None: The file record.
+        """
+        entry = self.entries.get(target)
+        if entry is None or entry["is_dir"]:
+            return None
+        return { "path": entry["source"], "size": entry["size"], "mtime_ns": entry["mtime_ns"], "hash": entry["hash"] }
+
+    def is_output_matched(self, output: str | Path):
+        """Check if the output ROM is still the one written by the last build.
+
+        Args:
+            output (str | Path): The output ROM.
+        """
+        if self.output is None:
+            return False
+        try:
+            st = Path(output).resolve().stat()
+        except OSError:
+            return False
+        return self.output.get("size") == st.st_size and self.output.get("mtime_ns") == st.st_mtime_ns
@@ -0,0 +1,228 @@
+from gba_mpy_tools.config import Config
+from gba_mpy_tools.errors import FileNotFoundError, CompileError
+from gba_mpy_tools.cache import BuildCache, hash_key
+from gba_mpy_tools.profiler import Profiler, NO_PROFILER
+from pathlib import Path
+from keyword import iskeyword
+from itertools import count
+import builtins
+import tokenize
+import token
+import ast
+import io
+
+# bump it when the output changes, to invalidate the cache
+MINIFY_VERSION = 1
+
+def __char_col(lines: list[str], lineno: int, byte_col: int):
+    # ast uses utf-8 byte offsets, tokenize uses characters
+    line = lines[lineno - 1]
+    if line.isascii():
+        return byte_col
+    return len(line.encode("utf-8")[:byte_col].decode("utf-8", errors="ignore"))
+
+def __find_docstrings(tree: ast.Module, lines: list[str]):
+    # position of each docstring -> whether it is the only statement of its body
+    docstrings: dict[tuple[int, int], bool] = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        if not node.body:
+            continue
+        first = node.body[0]
+        if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+            pos = (first.lineno, __char_col(lines, first.lineno, first.col_offset))
+            docstrings[pos] = len(node.body) == 1 and not isinstance(node, ast.Module)
+    return docstrings
+
+def __is_renamable_function(node: ast.FunctionDef | ast.AsyncFunctionDef):
+    # closures and dynamic scope access are left alone
+    for child in ast.walk(node):
+        if child is node:
+            continue
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            return False
+        if isinstance(child, ast.Name) and child.id in ("locals", "vars", "eval", "exec", "dir"):
+            return False
+    return True
+
+def __find_local_renames(tree: ast.Module, lines: list[str]):
+    # position of each renamed name -> new name
+    used_names = { node.id for node in ast.walk(tree) if isinstance(node, ast.Name) }
+    used_names.update(dir(builtins))
+    renames: dict[tuple[int, int], str] = {}
+    for func in ast.walk(tree):
+        if not isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)) or not __is_renamable_function(func):
+            continue
+        args = func.args
+        params = { a.arg for a in args.posonlyargs + args.args + args.kwonlyargs }
+        params.update(a.arg for a in (args.vararg, args.kwarg) if a is not None)
+        excluded = set(params)
+        stores: set[str] = set()
+        for node in ast.walk(func):
+            if isinstance(node, (ast.Global, ast.Nonlocal)):
+                excluded.update(node.names)
+            elif isinstance(node, ast.ExceptHandler) and node.name:
+                excluded.add(node.name)
+            elif isinstance(node, ast.alias):
+                excluded.add((node.asname or node.name).split(".")[0])
+            elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+                excluded.add(node.name)
+            elif isinstance(node, ast.MatchMapping) and node.rest:
+                excluded.add(node.rest)
+            elif isinstance(node, ast.JoinedStr):
+                # f-strings are copied as they are
+                excluded.update(child.id for child in ast.walk(node) if isinstance(child, ast.Name))
+            elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                stores.add(node.id)
+        local_names = sorted(stores - excluded)
+        new_names = ( name for name in (__short_name(i) for i in count()) if name not in used_names and name not in stores and name not in excluded )
+        mapping: dict[str, str] = {}
+        new_name = next(new_names)
+        for name in local_names:
+            if len(new_name) < len(name):
+                mapping[name] = new_name
+                new_name = next(new_names)
+        for node in ast.walk(func):
+            if isinstance(node, ast.Name) and node.id in mapping:
+                renames[(node.lineno, __char_col(lines, node.lineno, node.col_offset))] = mapping[node.id]
+    return renames
+
+def __short_name(index: int):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    name = ""
+    index += 1
+    while index > 0:
+        index, rem = divmod(index - 1, len(letters))
+        name = letters[rem] + name
+    return name if not iskeyword(name) else "_" + name
+
+def __need_space(prev: tokenize.TokenInfo, text: str):
+    prev_text = prev.string
+    if (prev_text[-1].isalnum() or prev_text[-1] == "_") and (text[0].isalnum() or text[0] == "_"):
+        return True
+    # two strings must not be joined into a triple quote
+    if prev_text[-1] in "'\"" and text[0] in "'\"":
+        return True
+    # "1 .real" is not "1.real"
+    return prev.type == token.NUMBER and text[0] == "."
+
+def minify_source(source: str, rename_locals: bool = False):
+    """Strip the comments, docstrings and extra whitespace of python source.
+
+    Args:
+        source (str): The source code.
+        rename_locals (bool): Rename the local variables of the functions to short names.
+            Parameters, closures and functions using `locals()` like calls are not renamed.
+
+    Raises:
+        SyntaxError: The source is invalid.
+
+    Returns:
+        str: The minified source.
+    """
+    tree = ast.parse(source)
+    lines = io.StringIO(source).readlines()
+    line_offsets = [ 0 ]
+    for line in lines:
+        line_offsets.append(line_offsets[-1] + len(line))
+    docstrings = __find_docstrings(tree, lines)
+    renames = __find_local_renames(tree, lines) if rename_locals else {}
+    out: list[str] = []
+    indent = 0
+    line_start = True
+    prev: tokenize.TokenInfo | None = None
+    tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        i += 1
+        if tok.type in (tokenize.COMMENT, tokenize.NL, tokenize.ENCODING):
+            continue
+        if tok.type == tokenize.INDENT:
+            indent += 1
+            continue
+        if tok.type == tokenize.DEDENT:
+            indent -= 1
+            continue
+        if tok.type == tokenize.NEWLINE:
+            if not line_start:
+                out.append("\n")
+                line_start = True
+                prev = None
+            continue
+        if tok.type == tokenize.ENDMARKER:
+            break
+        text = tok.string
+        if tok.type == tokenize.STRING and tok.start in docstrings:
+            # skip the (implicitly concatenated) docstring, and its statement separator
+            while i < len(tokens) and tokens[i].type in (tokenize.STRING, tokenize.NL, tokenize.COMMENT):
+                i += 1
+            if not docstrings[tok.start]:
+                if i < len(tokens) and tokens[i].type == tokenize.OP and tokens[i].string == ";":
+                    i += 1
+                continue
+            text = "pass"
+        elif tok.type == getattr(tokenize, "FSTRING_START", None):
+            # keep the f-string as it is, including the nested expressions
+            depth = 1
+            while depth > 0:
+                if tokens[i].type == tokenize.FSTRING_START:
+                    depth += 1
+                elif tokens[i].type == tokenize.FSTRING_END:
+                    depth -= 1
+                i += 1
+            end = tokens[i - 1].end
+            text = source[line_offsets[tok.start[0] - 1] + tok.start[1]: line_offsets[end[0] - 1] + end[1]]
+        elif tok.type == tokenize.NAME and tok.start in renames:
+            text = renames[tok.start]
+        if line_start:
+            out.append(" " * indent)
+            line_start = False
+        elif prev is not None and __need_space(prev, text):
+            out.append(" ")
+        out.append(text)
+        prev = tokenize.TokenInfo(tok.type, text, tok.start, tok.end, tok.line)
+    return "".join(out)
+
+class Minifier():
+    def __init__(self, cfg: Config, cache: BuildCache | None = None, profiler: Profiler = NO_PROFILER):
+        self.__cfg = cfg
+        self.__cache = cache
+        self.__profiler = profiler
+
+    def minify(self, source: str | Path):
+        """Minify a python file, return minified content.
+
+        Args:
+            source (str | Path): The source file.
+
+        Raises:
+            CompileError: The source is invalid.
+
+        Returns:
+            bytes: Minified file content.
+        """
+        if not isinstance(source, Path):
+            source = Path(source)
+        if not source.exists():
+            raise FileNotFoundError(source)
+        with open(source, "rb") as f:
+            source_content = f.read()
+        rename_locals = self.__cfg.minify_rename_locals
+        cache_key = ""
+        if self.__cache is not None:
+            with self.__profiler.span("cache lookup", "cache", source=source) as span:
+                cache_key = hash_key("minify", str(MINIFY_VERSION), str(rename_locals), source_content)
+                data = self.__cache.get(cache_key)
+                span.name = "cache miss" if data is None else "cache hit"
+            if data is not None:
+                return data
+        with self.__profiler.span("minify", "minify", source=source):
+            try:
+                data = minify_source(source_content.decode("utf-8"), rename_locals).encode("utf-8")
+            except (SyntaxError, UnicodeDecodeError, tokenize.TokenError) as e:
+                raise CompileError(source, str(e))
+        if self.__cache is not None:
+            self.__cache.put(cache_key, data)
+        return data
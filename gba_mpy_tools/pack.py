@@ -0,0 +1,191 @@
+from struct import pack, unpack_from, calcsize
+from typing import NamedTuple
+
+ARCHIVE_MAGIC = b"GMPK"
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = "<4sHH"
+ARCHIVE_ENTRY = "<IIH"
+ARCHIVE_ALIGN = 4
+
+class ArchiveEntry(NamedTuple):
+    name: str
+    offset: int
+    size: int
+
+def make_archive(files: list[tuple[str, bytes]]):
+    """Pack files into one indexed archive.
+
+    Layout, little endian:
+        "GMPK", version (u16), file count (u16),
+        index: (offset (u32), size (u32), name length (u16), name (utf-8)) * file count,
+        file data, each one aligned to 4 bytes.
+
+    Args:
+        files (list[tuple[str, bytes]]): (path in the archive without the leading "/", content).
+
+    Returns:
+        bytes: The archive.
+    """
+    names = [ name.encode("utf-8") for name, _ in files ]
+    index_size = calcsize(ARCHIVE_HEADER) + sum(calcsize(ARCHIVE_ENTRY) + len(name) for name in names)
+    offset = (index_size + ARCHIVE_ALIGN - 1) // ARCHIVE_ALIGN * ARCHIVE_ALIGN
+    index = bytearray(pack(ARCHIVE_HEADER, ARCHIVE_MAGIC, ARCHIVE_VERSION, len(files)))
+    data = bytearray()
+    for name, (_, content) in zip(names, files):
+        index += pack(ARCHIVE_ENTRY, offset + len(data), len(content), len(name)) + name
+        data += content
+        data += bytes(-len(data) % ARCHIVE_ALIGN)
+    index += bytes(offset - len(index))
+    return bytes(index + data)
+
+def read_archive(data: bytes):
+    """Read the index of an archive.
+
+    Args:
+        data (bytes): The archive.
+
+    Raises:
+        ValueError: It is not an archive made by `make_archive`.
+
+    Returns:
+        list[ArchiveEntry]: The files in the archive.
+    """
+    if len(data) < calcsize(ARCHIVE_HEADER):
+        raise ValueError("archive is truncated")
+    magic, version, count = unpack_from(ARCHIVE_HEADER, data)
+    if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+        raise ValueError("not a module archive")
+    pos = calcsize(ARCHIVE_HEADER)
+    entries: list[ArchiveEntry] = []
+    for _ in range(count):
+        offset, size, name_len = unpack_from(ARCHIVE_ENTRY, data, pos)
+        pos += calcsize(ARCHIVE_ENTRY)
+        entries.append(ArchiveEntry(data[pos:pos + name_len].decode("utf-8"), offset, size))
+        pos += name_len
+    return entries
+
+IMPORT_HOOK_TEMPLATE = '''\
+# Generated by gba_mpy_tools, do not edit.
+# Import it in boot.py, then the modules in the archive can be imported as usual.
+import io
+import os
+import sys
+import struct
+
+ARCHIVE = {archive!r}
+MOUNT = {mount!r}
+
+class PackFile(io.IOBase):
+    def __init__(self, f, offset, size):
+        self.f = f
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+
+    def readinto(self, buf):
+        n = min(len(buf), self.size - self.pos)
+        if n <= 0:
+            return 0
+        self.f.seek(self.offset + self.pos)
+        n = self.f.readinto(memoryview(buf)[:n])
+        self.pos += n
+        return n
+
+    def read(self, size=-1):
+        if size < 0 or size > self.size - self.pos:
+            size = self.size - self.pos
+        buf = bytearray(size)
+        n = self.readinto(buf)
+        return bytes(buf[:n])
+
+    def ioctl(self, req, arg):
+        if req == 4: # MP_STREAM_CLOSE
+            return 0
+        if req == 11: # MP_STREAM_GET_BUFFER_SIZE
+            return 64
+        return -22
+
+class PackFS:
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        magic, version, count = struct.unpack("<4sHH", self.f.read(8))
+        if magic != b"GMPK" or version != 1:
+            raise OSError(22)
+        self.files = {{}}
+        self.dirs = {{"": {{}}}}
+        for _ in range(count):
+            offset, size, name_len = struct.unpack("<IIH", self.f.read(10))
+            name = self.f.read(name_len).decode()
+            self.files[name] = (offset, size)
+            parent = ""
+            for part in name.split("/")[:-1]:
+                path = parent + "/" + part if parent else part
+                self.dirs[parent][part] = True
+                self.dirs.setdefault(path, {{}})
+                parent = path
+            self.dirs[parent][name.rsplit("/", 1)[-1]] = False
+
+    def mount(self, readonly, mkfs):
+        pass
+
+    def umount(self):
+        self.f.close()
+
+    def chdir(self, path):
+        pass
+
+    def getcwd(self):
+        return ""
+
+    def stat(self, path):
+        path = path.strip("/")
+        if path in self.dirs:
+            return (0x4000, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        if path in self.files:
+            return (0x8000, 0, 0, 0, 0, 0, self.files[path][1], 0, 0, 0)
+        raise OSError(2)
+
+    def ilistdir(self, path):
+        path = path.strip("/")
+        if path not in self.dirs:
+            raise OSError(2)
+        for name, is_dir in self.dirs[path].items():
+            yield (name, 0x4000 if is_dir else 0x8000, 0)
+
+    def open(self, path, mode):
+        if "w" in mode or "a" in mode or "+" in mode:
+            raise OSError(30)
+        path = path.strip("/")
+        if path not in self.files:
+            raise OSError(2)
+        offset, size = self.files[path]
+        return PackFile(self.f, offset, size)
+
+def install():
+    fs = PackFS(ARCHIVE)
+    os.mount(fs, MOUNT)
+    # search the archive right after each dir the modules were packed from
+    i = 0
+    while i < len(sys.path):
+        path = sys.path[i].strip("/")
+        if path == ".":
+            path = ""
+        if (not sys.path[i].startswith(".frozen")) and path in fs.dirs:
+            sys.path.insert(i + 1, MOUNT + "/" + path if path else MOUNT)
+            i += 1
+        i += 1
+
+install()
+'''
+
+def make_import_hook(archive: str, mount: str):
+    """Generate the MicroPython module that mounts the archive and adds it to `sys.path`.
+
+    Args:
+        archive (str): Path of the archive on the device.
+        mount (str): Mount point of the archive on the device.
+
+    Returns:
+        bytes: Source of the hook module.
+    """
+    return IMPORT_HOOK_TEMPLATE.format(archive=archive, mount=mount).encode("utf-8")
@@ -0,0 +1,224 @@
+from gba_mpy_tools.errors import PatchInvalidError, PatchSourceMismatchError
+from pathlib import Path
+from typing import NamedTuple, Callable
+from zlib import crc32
+import os
+import struct
+
+# ref: https://zerosoft.zophar.net/ips.php and https://github.com/blakesmith/rombp/blob/master/docs/bps_spec.md
+IPS_MAGIC = b"PATCH"
+IPS_EOF = b"EOF"
+IPS_EOF_OFFSET = int.from_bytes(IPS_EOF, "big")
+IPS_MAX_OFFSET = 0xFFFFFF
+IPS_MAX_RECORD = 0xFFFF
+BPS_MAGIC = b"BPS1"
+BPS_SOURCE_READ = 0
+BPS_TARGET_READ = 1
+BPS_SOURCE_COPY = 2
+BPS_TARGET_COPY = 3
+PATCH_FORMATS = ("bps", "ips")
+CRC_CHUNK_SIZE = 1024 * 1024
+
+class PatchResult(NamedTuple):
+    path: Path
+    format: str
+    base: str
+    size: int
+    seconds: float
+
+def crc32_file(fd: int, size: int):
+    """CRC32 of the first `size` bytes of an open file, read in chunks."""
+    crc = 0
+    for pos in range(0, size, CRC_CHUNK_SIZE):
+        crc = crc32(os.pread(fd, min(CRC_CHUNK_SIZE, size - pos), pos), crc)
+    return crc
+
+def __encode_number(n: int):
+    # the BPS variable length number, every byte but the last one also adds one
+    out = bytearray()
+    while True:
+        x = n & 0x7F
+        n >>= 7
+        if n == 0:
+            out.append(0x80 | x)
+            return out
+        out.append(x)
+        n -= 1
+
+def make_bps(size: int, runs: list[tuple[int, bytes]], source_crc: int, target_crc: int):
+    """Make a BPS patch, the source and the target are the same size.
+
+    Args:
+        size (int): Size of the source and the target.
+        runs (list[tuple[int, bytes]]): Changed ranges as (offset, data), sorted and not overlapping.
+        source_crc (int): CRC32 of the source.
+        target_crc (int): CRC32 of the target.
+
+    Returns:
+        bytes: The patch.
+    """
+    out = bytearray(BPS_MAGIC)
+    out += __encode_number(size)
+    out += __encode_number(size)
+    out += __encode_number(0)
+    pos = 0
+    for offset, data in runs:
+        if not data:
+            continue
+        if offset > pos:
+            out += __encode_number(((offset - pos - 1) << 2) | BPS_SOURCE_READ)
+        out += __encode_number(((len(data) - 1) << 2) | BPS_TARGET_READ)
+        out += data
+        pos = offset + len(data)
+    if pos < size:
+        out += __encode_number(((size - pos - 1) << 2) | BPS_SOURCE_READ)
+    out += struct.pack("<II", source_crc, target_crc)
+    out += struct.pack("<I", crc32(out))
+    return bytes(out)
+
+def make_ips(runs: list[tuple[int, bytes]], read_target: Callable[[int, int], bytes]):
+    """Make an IPS patch, it can only change the first 16 MiB.
+
+    Args:
+        runs (list[tuple[int, bytes]]): Changed ranges as (offset, data), sorted and not overlapping.
+        read_target (Callable[[int, int], bytes]): Read (offset, size) of the target, for the record
+            that would start at the offset spelling "EOF".
+
+    Raises:
+        PatchInvalidError: A change is beyond the 16 MiB IPS offsets.
+
+    Returns:
+        bytes: The patch.
+    """
+    out = bytearray(IPS_MAGIC)
+    for offset, data in runs:
+        if not data:
+            continue
+        if offset + len(data) - 1 > IPS_MAX_OFFSET:
+            raise PatchInvalidError(f"IPS can not change the data beyond {IPS_MAX_OFFSET:#x}, use BPS instead")
+        pos = offset
+        end = offset + len(data)
+        while pos < end:
+            # a record at the offset spelling "EOF" starts one byte earlier, or it reads as the end of the patch
+            prefix = read_target(pos - 1, 1) if pos == IPS_EOF_OFFSET else b""
+            n = min(IPS_MAX_RECORD - len(prefix), end - pos)
+            out += __ips_record(pos - len(prefix), prefix + data[pos - offset: pos - offset + n])
+            pos += n
+    out += IPS_EOF
+    return bytes(out)
+
+def __ips_record(offset: int, data: bytes):
+    return offset.to_bytes(3, "big") + len(data).to_bytes(2, "big") + data
+
+def __decode_number(patch: bytes, pos: int):
+    data = 0
+    shift = 1
+    while True:
+        if pos >= len(patch):
+            raise PatchInvalidError("unexpected end of the patch")
+        x = patch[pos]
+        pos += 1
+        data += (x & 0x7F) * shift
+        if x & 0x80:
+            return data, pos
+        shift <<= 7
+        data += shift
+
+def __apply_bps(patch: bytes, source: bytes):
+    if len(patch) < len(BPS_MAGIC) + 12:
+        raise PatchInvalidError("too short")
+    source_crc, target_crc, patch_crc = struct.unpack("<III", patch[-12:])
+    if crc32(patch[:-4]) != patch_crc:
+        raise PatchInvalidError("the checksum is wrong")
+    if crc32(source) != source_crc:
+        raise PatchSourceMismatchError()
+    end = len(patch) - 12
+    pos = len(BPS_MAGIC)
+    source_size, pos = __decode_number(patch, pos)
+    target_size, pos = __decode_number(patch, pos)
+    metadata_size, pos = __decode_number(patch, pos)
+    pos += metadata_size
+    if source_size != len(source):
+        raise PatchSourceMismatchError()
+    target = bytearray(target_size)
+    out = 0
+    source_rel = 0
+    target_rel = 0
+    while pos < end:
+        n, pos = __decode_number(patch, pos)
+        action = n & 3
+        length = (n >> 2) + 1
+        if out + length > target_size:
+            raise PatchInvalidError("the target is overflowed")
+        if action == BPS_SOURCE_READ:
+            target[out: out + length] = source[out: out + length]
+        elif action == BPS_TARGET_READ:
+            target[out: out + length] = patch[pos: pos + length]
+            pos += length
+        else:
+            rel, pos = __decode_number(patch, pos)
+            delta = -(rel >> 1) if rel & 1 else rel >> 1
+            if action == BPS_SOURCE_COPY:
+                source_rel += delta
+                target[out: out + length] = source[source_rel: source_rel + length]
+                source_rel += length
+            else:
+                target_rel += delta
+                # the ranges may overlap, copy byte by byte
+                for i in range(length):
+                    target[out + i] = target[target_rel + i]
+                target_rel += length
+        out += length
+    if out != target_size or crc32(target) != target_crc:
+        raise PatchInvalidError("the patched ROM checksum is wrong")
+    return target
+
+def __apply_ips(patch: bytes, source: bytes):
+    target = bytearray(source)
+    pos = len(IPS_MAGIC)
+    while True:
+        if pos + 3 > len(patch):
+            raise PatchInvalidError("unexpected end of the patch")
+        if patch[pos: pos + 3] == IPS_EOF:
+            pos += 3
+            break
+        offset = int.from_bytes(patch[pos: pos + 3], "big")
+        size = int.from_bytes(patch[pos + 3: pos + 5], "big")
+        pos += 5
+        if size == 0:
+            # RLE record
+            size = int.from_bytes(patch[pos: pos + 2], "big")
+            data = patch[pos + 2: pos + 3] * size
+            pos += 3
+        else:
+            data = patch[pos: pos + size]
+            pos += size
+        if len(data) != size:
+            raise PatchInvalidError("unexpected end of the patch")
+        if offset + size > len(target):
+            target.extend(bytes(offset + size - len(target)))
+        target[offset: offset + size] = data
+    if pos + 3 <= len(patch):
+        # truncate extension
+        del target[int.from_bytes(patch[pos: pos + 3], "big"):]
+    return target
+
+def apply_patch(patch: bytes, source: bytes):
+    """Apply an IPS or BPS patch.
+
+    Args:
+        patch (bytes): The patch file content.
+        source (bytes): The ROM the patch was made against.
+
+    Raises:
+        PatchInvalidError: It is not an IPS or BPS patch, or it is broken.
+        PatchSourceMismatchError: The BPS patch is made against another ROM.
+
+    Returns:
+        bytearray: The patched ROM.
+    """
+    if patch.startswith(BPS_MAGIC):
+        return __apply_bps(patch, source)
+    if patch.startswith(IPS_MAGIC):
+        return __apply_ips(patch, source)
+    raise PatchInvalidError("not an IPS or BPS patch")
@@ -0,0 +1,146 @@
+from pathlib import PurePath, Path
+from threading import Lock, get_ident
+from time import perf_counter_ns
+from os import getpid
+import json
+
+class Span():
+    def __init__(self, profiler: 'Profiler | None', name: str, cat: str, args: dict):
+        self.__profiler = profiler
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start_ns = 0
+        self.end_ns = 0
+
+    def __enter__(self):
+        self.start_ns = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = perf_counter_ns()
+        if self.__profiler is not None:
+            self.__profiler.record(self)
+        return False
+
+class Profiler():
+    """Record build phases as spans, and export them as Chrome trace events.
+
+    A disabled profiler keeps nothing, so it can be passed around unconditionally.
+    """
+    def __init__(self, enabled: bool = True):
+        self.__enabled = enabled
+        self.__lock = Lock()
+        self.__spans: list[tuple[Span, int]] = []
+        self.__origin_ns = perf_counter_ns()
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    def span(self, name: str, cat: str, **args):
+        """Measure a block of code.
+
+        Args:
+            name (str): Span name, like "compile".
+            cat (str): Phase the span belongs to, like "compile".
+            **args: Extra info shown in the trace, like the file path. Can be updated through `Span.args`.
+
+        Returns:
+            Span: Context manager.
+        """
+        return Span(self if self.__enabled else None, name, cat, args)
+
+    def record(self, span: Span):
+        with self.__lock:
+            self.__spans.append((span, get_ident()))
+
+    def export_spans(self):
+        """Get the spans as plain data, to be merged into the profiler of the parent process.
+
+        Returns:
+            list[tuple]: (name, cat, args, start_ns, end_ns, tid) of each span, the tid is the process id.
+        """
+        pid = getpid()
+        with self.__lock:
+            return [ (span.name, span.cat, span.args, span.start_ns, span.end_ns, pid) for span, _ in self.__spans ]
+
+    def merge_spans(self, spans: list[tuple]):
+        """Add the spans exported by `export_spans` in a worker process.
+
+        `perf_counter_ns` is the system wide monotonic clock, so the times line up with the spans of this process.
+
+        Args:
+            spans (list[tuple]): The exported spans.
+        """
+        if not self.__enabled:
+            return
+        with self.__lock:
+            for name, cat, args, start_ns, end_ns, tid in spans:
+                span = Span(None, name, cat, args)
+                span.start_ns = start_ns
+                span.end_ns = end_ns
+                self.__spans.append((span, tid))
+
+    def to_chrome_trace(self):
+        """Export the spans.
+
+        Returns:
+            dict: Chrome trace event format, can be loaded by chrome://tracing or Perfetto.
+        """
+        pid = getpid()
+        events = []
+        with self.__lock:
+            spans = list(self.__spans)
+        for span, tid in spans:
+            events.append({
+                "name": span.name,
+                "cat": span.cat,
+                "ph": "X",
+                "ts": (span.start_ns - self.__origin_ns) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": { k: str(v) if isinstance(v, PurePath) else v for k, v in span.args.items() },
+            })
+        return { "traceEvents": events, "displayTimeUnit": "ms" }
+
+    def save_chrome_trace(self, path: str | Path):
+        """Write the spans as a Chrome trace JSON file.
+
+        Args:
+            path (str | Path): The output file.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def summary(self, top_n: int = 10):
+        """Sum up the time of each phase and each file.
+
+        Args:
+            top_n (int): Number of the slowest items to keep.
+
+        Returns:
+            tuple[list[tuple[str, float, int]], list[tuple[str, float, int]]]:
+                (name, seconds, count) of the slowest phases and the slowest files.
+        """
+        phases: dict[str, list] = {}
+        files: dict[str, list] = {}
+        with self.__lock:
+            spans = [ span for span, _ in self.__spans ]
+        for span in spans:
+            seconds = (span.end_ns - span.start_ns) / 1e9
+            phase = phases.setdefault(f"{span.cat}/{span.name}", [ 0.0, 0 ])
+            phase[0] += seconds
+            phase[1] += 1
+            if "file" in span.args:
+                file = files.setdefault(str(span.args["file"]), [ 0.0, 0 ])
+                file[0] += seconds
+                file[1] += 1
+        def top(items: dict[str, list]):
+            result = [ (name, value[0], value[1]) for name, value in items.items() ]
+            result.sort(key=lambda item: item[1], reverse=True)
+            return result[:top_n]
+        return top(phases), top(files)
+
+NO_PROFILER = Profiler(enabled=False)
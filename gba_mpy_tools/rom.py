@@ -1,20 +1,93 @@
 import typing
-from littlefs import LittleFS, UserContext
-from gba_mpy_tools.errors import ROMInvalidError, LFSNotFormatedError
+import os
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from shutil import copyfileobj
+from typing import NamedTuple
+from littlefs import LittleFS, LittleFSError, UserContext
+from gba_mpy_tools.errors import ROMInvalidError, ROMReadOnlyError, LFSNotFormatedError, LFSConfigInvalidError, PatchInvalidError
+from gba_mpy_tools.cache import hash_key
+from gba_mpy_tools.patch import PatchResult, PATCH_FORMATS, crc32_file, make_bps, make_ips
+from time import perf_counter
 
 if typing.TYPE_CHECKING:
     from os import PathLike
+    from gba_mpy_tools.cache import BuildCache
 # ref: https://github.com/devkitPro/gba-tools/blob/master/src/gbafix.c
 MAGIC_BLOCK_SIZE                                = 0x67452301
 MAGIC_BLOCK_COUNT                               = 0xEFCDAB89
+HEADER_TAG                                      = b"GBABDEV\0"
+FOOTER_TAG                                      = b"BDEVGBA\0"
+SAVE_CHUNK_SIZE                                 = 1024 * 1024
+
+def check_lfs_config(block_size: int, **options: int):
+    """Check the LittleFS config in python, a bad one fails a C assert in `lfs_init` and aborts the interpreter.
+
+    The missing options get the defaults of littlefs-python: `read_size` and `prog_size` are the block size,
+    `cache_size` is the larger one of them, and `inline_max` is chosen by LittleFS.
+
+    Args:
+        block_size (int): LittleFS block size.
+        **options (int): Other LittleFS config, like read_size, prog_size, cache_size, lookahead_size and inline_max.
+
+    Raises:
+        LFSConfigInvalidError: The config breaks a rule of LittleFS.
+    """
+    read_size = options.get("read_size") or block_size
+    prog_size = options.get("prog_size") or block_size
+    cache_size = options.get("cache_size") or max(read_size, prog_size)
+    lookahead_size = options.get("lookahead_size") or 8
+    inline_max = options.get("inline_max") or 0
+    if block_size < 128:
+        raise LFSConfigInvalidError(f"block_size {block_size} is less than 128")
+    if cache_size % read_size != 0:
+        raise LFSConfigInvalidError(f"cache_size {cache_size} is not a multiple of read_size {read_size}")
+    if cache_size % prog_size != 0:
+        raise LFSConfigInvalidError(f"cache_size {cache_size} is not a multiple of prog_size {prog_size}")
+    if block_size % cache_size != 0:
+        raise LFSConfigInvalidError(f"block_size {block_size} is not a multiple of cache_size {cache_size}")
+    if lookahead_size % 8 != 0:
+        raise LFSConfigInvalidError(f"lookahead_size {lookahead_size} is not a multiple of 8")
+    if inline_max > block_size // 8:
+        raise LFSConfigInvalidError(f"inline_max {inline_max} is larger than block_size/8 ({block_size // 8})")
+    if inline_max > cache_size:
+        raise LFSConfigInvalidError(f"inline_max {inline_max} is larger than cache_size {cache_size}")
+
+class RomSaveResult(NamedTuple):
+    copied: int
+    written: int
+    patch: PatchResult | None = None
+
+class ReadOnlyContext(UserContext):
+    """LittleFS user context reading the file system region of the mapped ROM in place.
+
+    Only the blocks LittleFS asks for are read, the image is never copied. Writing fails with LFS_ERR_IO.
+    """
+    def __init__(self, rom: 'mmap | bytes', offset: int, size: int):
+        self.buffer = b""
+        self.in_size = size
+        self.__rom = rom
+        self.__offset = offset
+
+    def read(self, cfg, block: int, off: int, size: int):
+        start = self.__offset + block * cfg.block_size + off
+        return self.__rom[start: start + size]
+
+    def prog(self, cfg, block: int, off: int, data: bytes):
+        return LittleFSError.Error.LFS_ERR_IO
+
+    def erase(self, cfg, block: int):
+        return LittleFSError.Error.LFS_ERR_IO
 
 class GBAMicroPythonRom():
     def __init__(self):
         self.__rom = b""
+        self.__path = ""
         self.__romfs_offset = -1
         self.__romfs_capacity = -1
         self.__romfs_bsize = -1
         self.__romfs_bcount = -1
+        self.__readonly = False
         self.__uctx = UserContext(0)
         self.__lfs = LittleFS()
     
@@ -34,65 +107,259 @@ class GBAMicroPythonRom():
     def fs_block_count(self):
         return self.__romfs_bcount if (self.__romfs_bcount > 0 and self.__romfs_bcount != MAGIC_BLOCK_COUNT) else -1
     
-    def mkfs(self, block_size: int, block_count: int = -1):
+    @property
+    def fs_capacity(self):
+        return self.__romfs_capacity
+
+    @property
+    def is_readonly(self):
+        return self.__readonly
+
+    def mkfs(self, block_size: int, block_count: int = -1, **options: int):
+        """Format a new LittleFS file system in the ROM.
+
+        Args:
+            block_size (int): LittleFS block size.
+            block_count (int): LittleFS block count, default is using the whole capacity.
+            **options (int): Other LittleFS config, like read_size, prog_size, cache_size, lookahead_size and inline_max.
+
+        Raises:
+            LFSConfigInvalidError: The config breaks a rule of LittleFS, see `check_lfs_config`.
+        """
         if not self.is_valid:
             raise ROMInvalidError()
+        check_lfs_config(block_size, **options)
         if block_count < 0:
             block_count = self.__romfs_capacity // block_size
         self.__romfs_bsize = block_size
         self.__romfs_bcount = block_count
-        self.__uctx = UserContext(self.__romfs_capacity)
-        self.__lfs = LittleFS(self.__uctx, False, block_size = block_size, block_count = block_count)
+        self.__readonly = False
+        # UserContext(size) builds the buffer from a list of ints, much larger than the buffer
+        self.__uctx = UserContext(0)
+        self.__uctx.buffer = bytearray(b"\xff") * self.__romfs_capacity
+        self.__lfs = LittleFS(self.__uctx, False, block_size = block_size, block_count = block_count, **options)
         assert self.__lfs.format() == 0
         assert self.__lfs.mount() == 0
-    
+
+    def mount(self, readonly: bool = False, **options: int):
+        """Mount the existing LittleFS file system in the ROM, using the block size and count in the header.
+
+        Args:
+            readonly (bool): Read the file system from the mapped ROM file in place, instead of copying it into memory.
+                The ROM can not be changed or saved then.
+            **options (int): Other LittleFS config, should be the same as `mkfs`.
+        """
+        if not self.is_valid:
+            raise ROMInvalidError()
+        if self.fs_block_size < 0 or self.fs_block_count < 0:
+            raise LFSNotFormatedError()
+        check_lfs_config(self.fs_block_size, **options)
+        p = self.__romfs_offset
+        self.__readonly = readonly
+        if readonly:
+            self.__uctx = ReadOnlyContext(self.__rom, p + 20, self.__romfs_capacity)
+        else:
+            self.__uctx = UserContext(0)
+            # read into the buffer directly, slicing the mapped ROM makes one more copy
+            self.__uctx.buffer = bytearray(self.__romfs_capacity)
+            with open(self.__path, "rb") as f:
+                f.seek(p + 20)
+                f.readinto(self.__uctx.buffer)
+        self.__lfs = LittleFS(self.__uctx, False, block_size = self.fs_block_size, block_count = self.fs_block_count, **options)
+        try:
+            self.__lfs.mount()
+        except LittleFSError:
+            raise LFSNotFormatedError()
+
     @staticmethod
-    def load(path: 'PathLike'):
+    def __find_header(rom: 'mmap | bytes'):
+        # the pos is aligned to 8, search in C and skip the unaligned matches
+        s_pos = rom.find(HEADER_TAG)
+        while s_pos >= 0 and s_pos % 8 != 0:
+            s_pos = rom.find(HEADER_TAG, s_pos + 1)
+        return s_pos
+
+    @staticmethod
+    def load(path: 'PathLike', cache: 'BuildCache | None' = None):
+        """Load the ROM, the file is mapped into memory instead of read.
+
+        Args:
+            path (PathLike): The ROM file.
+            cache (BuildCache | None): Cache the header offset for the same ROM file.
+
+        Returns:
+            GBAMicroPythonRom: The ROM, check `is_valid` before using it.
+        """
         nrom = GBAMicroPythonRom()
         # load ROM
         with open(path, "rb") as f:
-            nrom.__rom = f.read()
+            st = os.fstat(f.fileno())
+            if st.st_size <= 0:
+                return nrom
+            nrom.__rom = mmap(f.fileno(), 0, access=ACCESS_READ)
+        nrom.__path = str(Path(path).resolve())
         # search for location
-        # the pos is aligned to 8, so it is easy
-        s_pos = 0
-        while s_pos + 8 <= len(nrom.__rom):
-            chunk = nrom.__rom[s_pos: s_pos + 8]
-            if chunk == b"GBABDEV\0":
-                nrom.__romfs_offset = s_pos
-                break
-            s_pos += 8
+        cache_key = ""
+        s_pos = -1
+        if cache is not None:
+            cache_key = hash_key("rom-header", str(Path(path).resolve()), str(st.st_size), str(st.st_mtime_ns))
+            cached = cache.get(cache_key)
+            if cached is not None and cached.isdigit():
+                s_pos = int(cached)
+                if nrom.__rom[s_pos: s_pos + 8] != HEADER_TAG:
+                    s_pos = -1
+        if s_pos < 0:
+            s_pos = GBAMicroPythonRom.__find_header(nrom.__rom)
+            if cache is not None and s_pos > 0:
+                cache.put(cache_key, str(s_pos).encode("ascii"))
+        nrom.__romfs_offset = s_pos
         if nrom.__romfs_offset <= 0:
             # not a mpy ROM
             return nrom
-        s_pos = nrom.__romfs_offset
         nrom.__romfs_bsize = int.from_bytes(nrom.__rom[s_pos + 8: s_pos + 12], "little")
         nrom.__romfs_bcount = int.from_bytes(nrom.__rom[s_pos + 12: s_pos + 16], "little")
         nrom.__romfs_capacity = int.from_bytes(nrom.__rom[s_pos + 16: s_pos + 20], "little")
         # check last tag
         end = s_pos + 20 + nrom.__romfs_capacity
         chunk = nrom.__rom[end: end + 8]
-        if chunk != b"BDEVGBA\0":
+        if chunk != FOOTER_TAG:
             # make it invalid
+            nrom.close()
             nrom = GBAMicroPythonRom()
             return nrom
         return nrom
 
-    def save(self, path: 'PathLike'):
+    def close(self):
+        """Release the mapped ROM file."""
+        if isinstance(self.__rom, mmap):
+            self.__rom.close()
+        self.__rom = b""
+
+    def __is_same_outside_fs(self, path: Path):
+        # check if the file is this ROM, ignoring the header fields and the file system
+        try:
+            if path.stat().st_size != len(self.__rom):
+                return False
+        except OSError:
+            return False
+        p = self.__romfs_offset
+        fs_end = p + 20 + self.__romfs_capacity
+        ranges = [ (0, p + 8), (p + 16, p + 20), (fs_end, len(self.__rom)) ]
+        with open(path, "rb") as f:
+            for start, end in ranges:
+                f.seek(start)
+                for pos in range(start, end, SAVE_CHUNK_SIZE):
+                    n = min(SAVE_CHUNK_SIZE, end - pos)
+                    if f.read(n) != self.__rom[pos: pos + n]:
+                        return False
+        return True
+
+    def __copy_to(self, path: Path):
+        # copy the loaded ROM file inside the kernel
+        with open(self.__path, "rb") as fsrc, open(path, "wb") as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            if hasattr(os, "copy_file_range"):
+                try:
+                    while copied < size:
+                        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied, copied, copied)
+                        if n <= 0:
+                            break
+                        copied += n
+                except OSError:
+                    copied = 0
+            if copied < size:
+                fdst.seek(0)
+                fdst.truncate()
+                fsrc.seek(0)
+                copyfileobj(fsrc, fdst, SAVE_CHUNK_SIZE)
+        return size
+
+    def save(self, path: 'PathLike', patch_path: 'PathLike | None' = None, patch_format: str = "bps"):
+        """Save the ROM.
+
+        The output is copied from the loaded ROM file only if it is not the same ROM,
+        then only the header and the changed blocks of the file system are written.
+
+        Args:
+            path (PathLike): The output ROM file.
+            patch_path (PathLike | None): Also write the changes into this patch file, against the previous
+                output if only its file system is different, or else against the loaded ROM file.
+            patch_format (str): "bps", or "ips" which can only change the first 16 MiB.
+
+        Raises:
+            PatchInvalidError: The patch format is unknown, or the IPS patch can not hold the changes.
+
+        Returns:
+            RomSaveResult: Bytes copied from the loaded ROM file, bytes written, and the patch made.
+        """
         if not self.is_valid:
             raise ROMInvalidError()
+        if self.__readonly:
+            raise ROMReadOnlyError()
         if len(self.__uctx.buffer) <= 0 or self.fs_block_size < 0 or self.fs_block_count < 0:
             raise LFSNotFormatedError()
+        if patch_path is not None and patch_format not in PATCH_FORMATS:
+            raise PatchInvalidError(f"unknown format '{patch_format}'")
         assert self.__romfs_capacity == len(self.__uctx.buffer)
-        # modify ROM
+        path = Path(path)
+        copied = 0
+        written = 0
+        patch_base = "previous output"
+        if not self.__is_same_outside_fs(path):
+            copied = self.__copy_to(path)
+            patch_base = "template"
         p = self.__romfs_offset
-        data = bytearray(self.__rom)
-        data[p + 8: p + 12] = self.fs_block_size.to_bytes(4, "little")
-        data[p + 12: p + 16] = self.fs_block_count.to_bytes(4, "little")
-        fs_end = p + 20 + self.__romfs_capacity
-        data[p + 20 : fs_end] = self.__uctx.buffer
-        # write ROM
-        with open(path, "wb") as f:
-            f.write(data)
+        bsize = self.fs_block_size
+        buffer = self.__uctx.buffer
+        patch = None
+        with open(path, "r+b", buffering=0) as f:
+            fd = f.fileno()
+            # the changed ranges, and the checksum of the file before changing, for the patch
+            runs: list[tuple[int, bytes]] | None = None
+            if patch_path is not None:
+                patch_start = perf_counter()
+                size = os.fstat(fd).st_size
+                source_crc = crc32_file(fd, size) if patch_format == "bps" else 0
+                runs = []
+                patch_seconds = perf_counter() - patch_start
+            # modify header
+            header = self.fs_block_size.to_bytes(4, "little") + self.fs_block_count.to_bytes(4, "little")
+            if os.pread(fd, 8, p + 8) != header:
+                written += os.pwrite(fd, header, p + 8)
+                if runs is not None:
+                    runs.append((p + 8, header))
+            # modify changed blocks
+            fs_start = p + 20
+            chunk_size = max(bsize, SAVE_CHUNK_SIZE // bsize * bsize)
+            for pos in range(0, self.__romfs_capacity, chunk_size):
+                end = min(pos + chunk_size, self.__romfs_capacity)
+                disk = os.pread(fd, end - pos, fs_start + pos)
+                if disk == buffer[pos: end]:
+                    continue
+                # write the continuous changed blocks at once
+                run_start = -1
+                for block in range(pos, end + bsize, bsize):
+                    changed = block < end and disk[block - pos: block - pos + bsize] != buffer[block: block + bsize]
+                    if changed and run_start < 0:
+                        run_start = block
+                    elif (not changed) and run_start >= 0:
+                        run_end = min(block, end)
+                        written += os.pwrite(fd, buffer[run_start: run_end], fs_start + run_start)
+                        if runs is not None:
+                            runs.append((fs_start + run_start, bytes(buffer[run_start: run_end])))
+                        run_start = -1
+            if runs is not None:
+                patch_start = perf_counter()
+                if patch_format == "ips":
+                    data = make_ips(runs, lambda offset, n: os.pread(fd, n, offset))
+                else:
+                    data = make_bps(size, runs, source_crc, crc32_file(fd, size))
+                with open(patch_path, "wb") as pf:
+                    pf.write(data)
+                patch_seconds += perf_counter() - patch_start
+                patch = PatchResult(Path(patch_path), patch_format, patch_base, len(data), patch_seconds)
+        return RomSaveResult(copied, written, patch)
     
     def __repr__(self):
         return f"<GBAMicropythonRom block_size={self.fs_block_size} block_count={self.fs_block_count} capacity={self.__romfs_capacity}>"
\ No newline at end of file
@@ -0,0 +1,226 @@
+from gba_mpy_tools.rom import GBAMicroPythonRom
+from gba_mpy_tools.errors import FileNotFoundError, ROMInvalidError
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple, Iterator, TYPE_CHECKING
+from hashlib import sha256
+from littlefs import LittleFSError
+
+if TYPE_CHECKING:
+    from os import PathLike
+
+# files are streamed out of the ROM in chunks, never read as a whole
+EXTRACT_CHUNK_SIZE = 64 * 1024
+# ref: littlefs lfs.c, LFS_ATTR_MAX and the default of lfs_config.inline_max
+LFS_ATTR_MAX = 1022
+
+class RomEntry(NamedTuple):
+    path: PurePosixPath
+    is_dir: bool
+    size: int
+    blocks: int
+    hash: str
+
+class RomUsage(NamedTuple):
+    block_size: int
+    block_count: int
+    used_blocks: int
+    data_blocks: int
+    files: int
+    dirs: int
+    total_size: int
+
+class RomDiffItem(NamedTuple):
+    path: PurePosixPath
+    status: str
+    old_size: int
+    new_size: int
+
+def open_rom(path: 'PathLike', **options: int):
+    """Load a built ROM and mount its file system read-only, in place from the mapped file.
+
+    Args:
+        path (PathLike): The ROM file.
+        **options (int): Other LittleFS config, should be the same as the build.
+
+    Raises:
+        FileNotFoundError: The ROM file is not exist.
+        ROMInvalidError: It is not a MicroPython ROM.
+        LFSNotFormatedError: The file system is not formated.
+
+    Returns:
+        GBAMicroPythonRom: The mounted ROM, close it after using.
+    """
+    if not Path(path).is_file():
+        raise FileNotFoundError(path)
+    rom = GBAMicroPythonRom.load(path)
+    if not rom.is_valid:
+        rom.close()
+        raise ROMInvalidError()
+    try:
+        rom.mount(readonly=True, **options)
+    except Exception:
+        rom.close()
+        raise
+    return rom
+
+def __inline_max(rom: GBAMicroPythonRom):
+    # files not larger than it are stored in the metadata, the same as lfs_init
+    cfg = rom.fs.cfg
+    if cfg.inline_max in (-1, 0xFFFFFFFF):
+        return 0
+    if cfg.inline_max > 0:
+        return cfg.inline_max
+    return min(cfg.cache_size, cfg.attr_max or LFS_ATTR_MAX, (cfg.metadata_max or cfg.block_size) // 8)
+
+def file_blocks(size: int, block_size: int, inline_max: int = 0):
+    """Count the data blocks of a file in LittleFS.
+
+    Files are stored as CTZ skip-lists, the block n (n > 0) starts with ctz(n) + 1 pointers to the previous blocks.
+
+    Args:
+        size (int): File size.
+        block_size (int): LittleFS block size.
+        inline_max (int): Max size of the files inlined into the metadata.
+
+    Returns:
+        int: Number of blocks.
+    """
+    if size <= inline_max:
+        return 0
+    blocks = 0
+    stored = 0
+    while stored < size:
+        stored += block_size if blocks == 0 else block_size - 4 * (blocks & -blocks).bit_length()
+        blocks += 1
+    return blocks
+
+def __hash_file(rom: GBAMicroPythonRom, path: str):
+    h = sha256()
+    with rom.fs.open(path, "rb", buffering=0) as f:
+        chunk = f.read(EXTRACT_CHUNK_SIZE)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(EXTRACT_CHUNK_SIZE)
+    return h.hexdigest()
+
+def __join(top: str, name: str):
+    return top.rstrip("/") + "/" + name
+
+def iter_rom_entries(rom: GBAMicroPythonRom, top: str = "/", hash_files: bool = False) -> Iterator[RomEntry]:
+    """Walk the file system of a mounted ROM, parents before children.
+
+    Args:
+        rom (GBAMicroPythonRom): The mounted ROM.
+        top (str): The dir to walk, or a single file.
+        hash_files (bool): Compute the sha256 of every file, streamed in chunks.
+
+    Raises:
+        FileNotFoundError: `top` is not in the ROM.
+
+    Yields:
+        RomEntry: Dirs and files, `blocks` is the data blocks of the file.
+    """
+    block_size = rom.fs_block_size
+    inline_max = __inline_max(rom)
+    try:
+        st = rom.fs.stat(top)
+    except LittleFSError:
+        raise FileNotFoundError(top)
+    if st.type != 2:
+        yield RomEntry(PurePosixPath(top), False, st.size, file_blocks(st.size, block_size, inline_max), __hash_file(rom, top) if hash_files else "")
+        return
+    for root, dirs, files in rom.fs.walk(top):
+        yield RomEntry(PurePosixPath(root), True, 0, 0, "")
+        for name in files:
+            path = __join(root, name)
+            size = rom.fs.stat(path).size
+            yield RomEntry(PurePosixPath(path), False, size, file_blocks(size, block_size, inline_max), __hash_file(rom, path) if hash_files else "")
+
+def rom_usage(rom: GBAMicroPythonRom, entries: list[RomEntry]):
+    """Sum up the usage of the file system.
+
+    Args:
+        rom (GBAMicroPythonRom): The mounted ROM.
+        entries (list[RomEntry]): All the entries, from `iter_rom_entries`.
+
+    Returns:
+        RomUsage: The usage, the blocks used but not by the file data are the metadata.
+    """
+    files = [ e for e in entries if not e.is_dir ]
+    return RomUsage(
+        rom.fs_block_size,
+        rom.fs_block_count,
+        rom.fs.used_block_count,
+        sum(e.blocks for e in files),
+        len(files),
+        len(entries) - len(files),
+        sum(e.size for e in files),
+    )
+
+def extract_rom(rom: GBAMicroPythonRom, output_dir: Path, top: str = "/"):
+    """Copy the files out of a mounted ROM, streamed in chunks.
+
+    Args:
+        rom (GBAMicroPythonRom): The mounted ROM.
+        output_dir (Path): The dir to write into, `top` is written as the dir itself.
+        top (str): The dir or the single file to extract.
+
+    Raises:
+        FileNotFoundError: `top` is not in the ROM.
+
+    Returns:
+        list[RomEntry]: Extracted dirs and files.
+    """
+    extracted: list[RomEntry] = []
+    top_path = PurePosixPath(top)
+    for entry in iter_rom_entries(rom, top):
+        if entry.is_dir:
+            output_dir.joinpath(entry.path.relative_to(top_path)).mkdir(parents=True, exist_ok=True)
+            extracted.append(entry)
+            continue
+        if entry.path == top_path:
+            dest = output_dir.joinpath(top_path.name)
+            output_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            dest = output_dir.joinpath(entry.path.relative_to(top_path))
+        with rom.fs.open(str(entry.path), "rb", buffering=0) as fsrc, open(dest, "wb") as fdst:
+            chunk = fsrc.read(EXTRACT_CHUNK_SIZE)
+            while chunk:
+                fdst.write(chunk)
+                chunk = fsrc.read(EXTRACT_CHUNK_SIZE)
+        extracted.append(entry)
+    return extracted
+
+def diff_roms(old_rom: GBAMicroPythonRom, new_rom: GBAMicroPythonRom):
+    """Compare the file systems of two mounted ROMs by the content hash.
+
+    Only the files of the same size in both ROMs are hashed.
+
+    Args:
+        old_rom (GBAMicroPythonRom): The old ROM.
+        new_rom (GBAMicroPythonRom): The new ROM.
+
+    Returns:
+        list[RomDiffItem]: Differences sorted by path, `status` is "added", "removed", "changed" or "type"
+            (a file replaced by a dir or the reverse). The size of a missing entry or a dir is -1.
+    """
+    old = { e.path: e for e in iter_rom_entries(old_rom) }
+    new = { e.path: e for e in iter_rom_entries(new_rom) }
+    def size(entry: RomEntry | None):
+        return -1 if entry is None or entry.is_dir else entry.size
+    diff: list[RomDiffItem] = []
+    for path in sorted(old.keys() | new.keys(), key=lambda p: p.parts):
+        o = old.get(path)
+        n = new.get(path)
+        if o is None:
+            status = "added"
+        elif n is None:
+            status = "removed"
+        elif o.is_dir != n.is_dir:
+            status = "type"
+        elif (not o.is_dir) and (o.size != n.size or __hash_file(old_rom, str(path)) != __hash_file(new_rom, str(path))):
+            status = "changed"
+        else:
+            continue
+        diff.append(RomDiffItem(path, status, size(o), size(n)))
+    return diff
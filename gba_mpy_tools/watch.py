@@ -0,0 +1,310 @@
+from gba_mpy_tools.config import Config
+from gba_mpy_tools.wrap_gba_emulator import GBAEmulator
+from gba_mpy_tools.manifest import BuildManifest, manifest_path_for
+import gba_mpy_tools.errors as m_errors
+import gba_mpy_tools.action as m_action
+from traceback import print_exception
+from pathlib import Path
+from select import select
+from time import monotonic, sleep, time_ns
+from struct import unpack_from, calcsize
+import ctypes
+import ctypes.util
+import os
+
+# ref: <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_STRUCT = "iIII"
+EVENT_SIZE = calcsize(EVENT_STRUCT)
+
+class InotifyWatcher():
+    """Watch the source dir with Linux inotify, ignored dirs are not watched."""
+    def __init__(self, cfg: Config):
+        self.__cfg = cfg
+        self.__wds: dict[int, Path] = {}
+        libc_name = ctypes.util.find_library("c")
+        self.__libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.__add_tree(cfg.project_source_dir)
+
+    def __add_tree(self, dir: Path):
+        for item in m_action.iter_files(self.__cfg, dir):
+            if item.is_dir:
+                wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(item.source), WATCH_MASK)
+                if wd >= 0:
+                    self.__wds[wd] = item.source
+
+    def read_changes(self, timeout: float):
+        """Wait for changes.
+
+        Args:
+            timeout (float): Max seconds to wait.
+
+        Returns:
+            set[Path] | None: Changed paths, None if events are lost and everything should be checked.
+        """
+        changed: set[Path] = set()
+        readable, _, _ = select([ self.__fd ], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            buf = os.read(self.__fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        pos = 0
+        overflow = False
+        while pos + EVENT_SIZE <= len(buf):
+            wd, mask, _, name_len = unpack_from(EVENT_STRUCT, buf, pos)
+            name = buf[pos + EVENT_SIZE: pos + EVENT_SIZE + name_len].rstrip(b"\0")
+            pos += EVENT_SIZE + name_len
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.__wds.pop(wd, None)
+                continue
+            parent = self.__wds.get(wd)
+            if parent is None:
+                continue
+            path = parent.joinpath(os.fsdecode(name)) if name else parent
+            if self.__cfg.should_ignore_project_file(path):
+                continue
+            changed.add(path)
+            if (mask & IN_ISDIR) and (mask & (IN_CREATE | IN_MOVED_TO)):
+                self.__add_tree(path)
+        return None if overflow else changed
+
+    def close(self):
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+class PollingWatcher():
+    """Watch the source dir by comparing the stat of all the files every `interval` seconds."""
+    def __init__(self, cfg: Config, interval: float):
+        self.__cfg = cfg
+        self.__interval = interval
+        self.__snapshot = self.__take_snapshot()
+
+    def __take_snapshot(self):
+        snapshot: dict[Path, tuple[bool, int, int]] = {}
+        for item in m_action.iter_files(self.__cfg):
+            try:
+                st = item.source.stat()
+            except OSError:
+                continue
+            snapshot[item.source] = (item.is_dir, st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def read_changes(self, timeout: float):
+        """Wait for changes.
+
+        Args:
+            timeout (float): Max seconds to wait.
+
+        Returns:
+            set[Path] | None: Changed paths.
+        """
+        sleep(min(timeout, self.__interval))
+        snapshot = self.__take_snapshot()
+        old = self.__snapshot
+        self.__snapshot = snapshot
+        changed = { path for path, st in snapshot.items() if old.get(path) != st }
+        changed.update(path for path in old if path not in snapshot)
+        return changed
+
+    def close(self):
+        pass
+
+def open_watcher(cfg: Config, polling: bool = False):
+    """Create the watcher, inotify is used if available, fallback to polling.
+
+    Args:
+        cfg (Config): Config info object.
+        polling (bool): Force using the polling watcher.
+
+    Returns:
+        InotifyWatcher | PollingWatcher: The watcher.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(cfg)
+        except (OSError, AttributeError):
+            # not linux, or out of inotify instances
+            pass
+    return PollingWatcher(cfg, cfg.watch_poll_interval)
+
+def __hook_outputs(cfg: Config):
+    # the declared outputs of the build hooks, they are rewritten by the hooks in each build
+    return tuple(cfg.project_before_build_outputs) + tuple(cfg.project_after_build_outputs)
+
+def __drop_hook_outputs(changed: set[Path] | None, outputs: tuple[Path, ...]):
+    if changed is None or len(outputs) <= 0:
+        return changed
+    return { path for path in changed if not any(path == output or output in path.parents for output in outputs) }
+
+def __wait_for_burst(watcher: InotifyWatcher | PollingWatcher, debounce: float, hook_outputs: tuple[Path, ...]):
+    # block until the first change, then collect until it is quiet for `debounce` seconds,
+    # the hook outputs are left to the hooks, a skipped or unchanged hook does not start a build
+    changed = __drop_hook_outputs(watcher.read_changes(3600), hook_outputs)
+    while changed is not None and len(changed) <= 0:
+        changed = __drop_hook_outputs(watcher.read_changes(3600), hook_outputs)
+    first_event_time = monotonic()
+    while True:
+        more = watcher.read_changes(debounce)
+        if more is None:
+            changed = None
+        elif len(more) <= 0:
+            break
+        elif changed is not None:
+            changed.update(__drop_hook_outputs(more, hook_outputs))
+    return changed, first_event_time
+
+def __drain_changes(watcher: InotifyWatcher | PollingWatcher):
+    # collect the events already raised, without waiting
+    changed = watcher.read_changes(0)
+    more = changed
+    while more is None or len(more) > 0:
+        more = watcher.read_changes(0)
+        if more is None:
+            changed = None
+        elif changed is not None:
+            changed.update(more)
+    return changed
+
+def __drain_own_writes(watcher: InotifyWatcher | PollingWatcher, cfg: Config, after_build: tuple[int, int], hook_outputs: tuple[Path, ...]):
+    # collect the events raised while building, and drop the ones of the files the build
+    # already used as they are now, like the files written by the before_build hook,
+    # and of the files written while the after_build hook was running
+    changed = __drop_hook_outputs(__drain_changes(watcher), hook_outputs)
+    if changed is None or len(changed) <= 0:
+        return changed
+    built: dict[str, tuple[int, int] | None] = {}
+    for entry in BuildManifest.load(manifest_path_for(cfg.gba_output)).entries.values():
+        built[entry["source"]] = None if entry["is_dir"] else (entry["size"], entry["mtime_ns"])
+    left: set[Path] = set()
+    for path in changed:
+        try:
+            st = path.stat()
+        except OSError:
+            # a deleted file, it is a change only if the build wrote it into the ROM
+            if str(path) in built:
+                left.add(path)
+            continue
+        key = str(path)
+        if after_build[0] <= st.st_mtime_ns <= after_build[1]:
+            continue
+        if key not in built:
+            left.add(path)
+        elif built[key] is None:
+            if not path.is_dir():
+                left.add(path)
+        elif built[key] != (st.st_size, st.st_mtime_ns):
+            left.add(path)
+    return left
+
+def __report_failure(e: Exception):
+    # the errors of this package are explained by their message, others come from the hooks or converters
+    if type(e).__module__ == m_errors.__name__:
+        print(e)
+    else:
+        print_exception(e)
+
+def watch(cfg: Config, jobs: int | None = None, polling: bool = False, run_emulator: bool = True):
+    """Rebuild the ROM incrementally when the source dir changes, and restart the emulator.
+
+    Args:
+        cfg (Config): Config info object.
+        jobs (int | None): Max parallel mpy-cross processes, default is the CPU count.
+        polling (bool): Force using the polling watcher.
+        run_emulator (bool): Restart the emulator after each build.
+    """
+    cfg = cfg.freeze()
+    gba_emu = GBAEmulator(cfg) if run_emulator else None
+    watcher = open_watcher(cfg, polling)
+    print("Watching:", cfg.project_source_dir, "with", type(watcher).__name__)
+    hook_outputs = __hook_outputs(cfg)
+    try:
+        pending: set[Path] | None = set()
+        left: set[Path] | None = set()
+        try:
+            m_action.execute_before_build_script(cfg)
+            m_action.build(cfg, jobs, incremental=True)
+            after_build_start = time_ns()
+            m_action.execute_after_build_script(cfg)
+            left = __drain_own_writes(watcher, cfg, (after_build_start, time_ns()), hook_outputs)
+            if gba_emu is not None:
+                gba_emu.start(cfg.gba_output)
+        except Exception as e:
+            __report_failure(e)
+            # nothing is known to be built, check everything in the next build
+            pending = None
+            __drain_changes(watcher)
+        while True:
+            if left is None or len(left) > 0:
+                # changed while building, build again without waiting for more
+                changed, first_event_time = left, monotonic()
+            else:
+                changed, first_event_time = __wait_for_burst(watcher, cfg.watch_debounce, hook_outputs)
+            # keep the changes of the failed builds
+            if changed is None or pending is None:
+                pending = None
+            else:
+                pending.update(changed)
+            build_start_time = monotonic()
+            try:
+                hook = m_action.execute_before_build_script(cfg)
+                # the files the hook generated, walked without rescanning the source dir,
+                # and the ones it wrote without declaring them in its outputs
+                more = __drain_changes(watcher)
+                if more is None or pending is None:
+                    pending = None
+                else:
+                    pending.update(hook.changed)
+                    pending.update(more)
+                result = m_action.build(cfg, jobs, incremental=True, changed=pending)
+                after_build_start = time_ns()
+                m_action.execute_after_build_script(cfg)
+                after_build_end = time_ns()
+            except Exception as e:
+                __report_failure(e)
+                # wait for the fix, the changes made while building are checked with it
+                more = __drain_changes(watcher)
+                if more is None or pending is None:
+                    pending = None
+                else:
+                    pending.update(more)
+                left = set()
+                continue
+            pending = set()
+            build_end_time = monotonic()
+            left = __drain_own_writes(watcher, cfg, (after_build_start, after_build_end), hook_outputs)
+            if gba_emu is not None:
+                gba_emu.start(cfg.gba_output)
+            play_time = monotonic()
+            print(
+                f"{result.written} written, {result.removed} removed,",
+                f"build {(build_end_time - build_start_time) * 1000:.0f} ms,",
+                f"edit-to-play latency {(play_time - first_event_time) * 1000:.0f} ms",
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if gba_emu is not None:
+            gba_emu.stop()
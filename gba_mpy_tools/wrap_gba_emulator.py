@@ -1,13 +1,14 @@
 from gba_mpy_tools.config import Config
 from gba_mpy_tools.errors import GBAEmulatorNotFoundError, FileNotFoundError
 from pathlib import Path
-from subprocess import run
+from subprocess import run, Popen, TimeoutExpired
 from shutil import which
 
 class GBAEmulator():
     def __init__(self, cfg: Config):
         self.__cfg = cfg
         self.__emu = ""
+        self.__proc: Popen | None = None
         # check path
         mpath = cfg.gba_emulator
         if mpath.exists() and mpath.is_file():
@@ -20,20 +21,55 @@ class GBAEmulator():
     
     def __ensure_gba_emulator(self):
         if self.__emu == "":
-            raise GBAEmulatorNotFoundError()
-    
-    def run(self, gba_rom: str | Path):
-        """Run the GBA ROM with emulator.
+            raise GBAEmulatorNotFoundError(str(self.__cfg.gba_emulator))
 
-        Args:
-            gba_rom (str | Path): The GBA ROM file.
-        """
+    def __make_command(self, gba_rom: str | Path):
         self.__ensure_gba_emulator()
         if not isinstance(gba_rom, Path):
             gba_rom = Path(gba_rom)
         if not gba_rom.exists():
-            raise FileNotFoundError()
+            raise FileNotFoundError(gba_rom)
         cmd = [ self.__emu ]
         cmd.extend(self.__cfg.gba_params)
         cmd.append(gba_rom)
+        return cmd
+    
+    def run(self, gba_rom: str | Path):
+        """Run the GBA ROM with emulator.
+
+        Args:
+            gba_rom (str | Path): The GBA ROM file.
+        """
+        cmd = self.__make_command(gba_rom)
         p = run(cmd)
+
+    @property
+    def is_running(self):
+        return self.__proc is not None and self.__proc.poll() is None
+
+    def start(self, gba_rom: str | Path):
+        """Start the emulator with the GBA ROM in background, the running one is stopped first.
+
+        Args:
+            gba_rom (str | Path): The GBA ROM file.
+        """
+        cmd = self.__make_command(gba_rom)
+        self.stop()
+        self.__proc = Popen(cmd)
+
+    def stop(self, timeout: float = 2.0):
+        """Stop the emulator started by `start`, kill it if it does not exit in time.
+
+        Args:
+            timeout (float): Seconds to wait after terminating.
+        """
+        if self.__proc is None:
+            return
+        if self.__proc.poll() is None:
+            self.__proc.terminate()
+            try:
+                self.__proc.wait(timeout)
+            except TimeoutExpired:
+                self.__proc.kill()
+                self.__proc.wait()
+        self.__proc = None
@@ -1,14 +1,20 @@
 from gba_mpy_tools.config import Config
 from gba_mpy_tools.errors import MpyCrossNotFoundError, FileNotFoundError, CompileError
+from gba_mpy_tools.cache import BuildCache, hash_key
+from gba_mpy_tools.profiler import Profiler, NO_PROFILER
 from tempfile import NamedTemporaryFile
 from pathlib import Path
 from subprocess import run, DEVNULL, PIPE
 from shutil import which
 
 class MpyCross():
-    def __init__(self, cfg: Config):
+    def __init__(self, cfg: Config, cache: BuildCache | None = None, profiler: Profiler = NO_PROFILER):
         self.__cfg = cfg
+        self.__cache = cache
+        self.__profiler = profiler
         self.__mc = ""
+        self.__mc_identity = ""
+        self.__mc_version = ""
         # check mpy_cross
         mpath = cfg.mpy_cross_path
         if mpath.exists() and mpath.is_file():
@@ -26,12 +32,36 @@ class MpyCross():
     def __ensure_mpy_cross(self):
         if self.__mc == "":
             raise MpyCrossNotFoundError()
-    
-    def compile(self, source: str | Path):
+
+    def __get_mpy_cross_identity(self):
+        # resolved binary, its stat and its reported version
+        if self.__mc_identity == "":
+            mpath = Path(self.__mc).resolve()
+            st = mpath.stat()
+            self.__mc_identity = f"{mpath}\0{st.st_size}\0{st.st_mtime_ns}\0{self.version()}"
+        return self.__mc_identity
+
+    def version(self):
+        """Get the version reported by mpy-cross, and the size of the binary.
+
+        Unlike the cache key, it does not depend on where mpy-cross is installed.
+
+        Returns:
+            str: The version.
+        """
+        self.__ensure_mpy_cross()
+        if self.__mc_version == "":
+            p = run([ self.__mc, "--version" ], stdin=DEVNULL, stdout=PIPE, stderr=PIPE, text=True, encoding="utf-8")
+            self.__mc_version = f"{p.stdout.strip()}\0{Path(self.__mc).resolve().stat().st_size}"
+        return self.__mc_version
+
+    def compile(self, source: str | Path, params: list[str] | None = None):
         """Compile a mpy script, return compiled content.
 
         Args:
             source (str | Path): The source file.
+            params (list[str] | None): The mpy-cross params, default is the `[[mpy-cross.overrides]]`
+                matching the file, or `[mpy-cross] params`.
 
         Returns:
             bytes: .mpy file content.
@@ -40,13 +70,32 @@ class MpyCross():
         if not isinstance(source, Path):
             source = Path(source)
         if not source.exists():
-            raise FileNotFoundError()
-        with NamedTemporaryFile(delete_on_close=False, suffix=".mpy") as f:
+            raise FileNotFoundError(source)
+        if params is None:
+            params = self.__cfg.find_mpy_cross_params(source)
+        cache_key = ""
+        if self.__cache is not None:
+            with self.__profiler.span("cache lookup", "cache", source=source) as span:
+                with open(source, "rb") as f:
+                    source_content = f.read()
+                # the source name is embedded into the .mpy file by '-s'
+                cache_key = hash_key(
+                    "mpy-cross",
+                    self.__get_mpy_cross_identity(),
+                    "\0".join(params),
+                    source.name,
+                    source_content,
+                )
+                data = self.__cache.get(cache_key)
+                span.name = "cache miss" if data is None else "cache hit"
+            if data is not None:
+                return data
+        with self.__profiler.span("mpy-cross", "compile", source=source), NamedTemporaryFile(delete_on_close=False, suffix=".mpy") as f:
             fpath = f.name
             # close it allow mpy-cross to write
             f.close()
             cmd = [ self.__mc ]
-            cmd.extend(self.__cfg.mpy_cross_params)
+            cmd.extend(params)
             cmd.extend([ "-o", fpath ])
             cmd.extend([ "-s", source.name ])
             cmd.append(source)
@@ -56,5 +105,7 @@ class MpyCross():
             # read file
             with open(fpath, "rb") as compiled_file:
                 data = compiled_file.read()
+            if self.__cache is not None:
+                self.__cache.put(cache_key, data)
             # return it
             return data